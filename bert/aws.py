@@ -1,8 +1,10 @@
 import base64
-import boto3
+import hashlib
 import json
 import logging
 import os
+import threading
+import time
 import typing
 import uuid
 
@@ -10,46 +12,306 @@ from bert import \
     exceptions as bert_exceptions, \
     constants as bert_constants
 
-from botocore.exceptions import ClientError
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 PWN: typing.TypeVar = typing.TypeVar('PWN')
+# One boto3 session per process and one client per service, region and credentials. Emptied when the PID changes
+AWS_SESSIONS: typing.Dict[int, 'boto3.session.Session'] = {}
+AWS_CLIENTS: typing.Dict[typing.Tuple[str, str, str, str], typing.Any] = {}
+AWS_LOCK: threading.RLock = threading.RLock()
+
+def session() -> 'boto3.session.Session':
+    aws_session = AWS_SESSIONS.get(os.getpid(), None)
+    if aws_session is None:
+        import boto3
+        import botocore.session
+        AWS_SESSIONS.clear()
+        AWS_CLIENTS.clear()
+        ROLE_SESSIONS.clear()
+        aws_session = AWS_SESSIONS[os.getpid()] = boto3.session.Session(botocore_session=botocore.session.get_session())
+
+    return aws_session
+
+def client_config() -> 'botocore.config.Config':
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=bert_constants.AWS_MAX_POOL_CONNECTIONS,
+        retries={'mode': bert_constants.AWS_RETRY_MODE, 'max_attempts': bert_constants.AWS_MAX_ATTEMPTS},
+        tcp_keepalive=bert_constants.AWS_TCP_KEEPALIVE)
+
+def credential_context() -> typing.Tuple[str, str, str]:
+    """
+    The innermost role entered through assume_role and the credentials exported into the environment. Anything
+        cached with clients of bert.aws.client is keyed by it, so it's never used under other credentials
+    """
+    role_arn: str = ACTIVE_ROLES[-1] if len(ACTIVE_ROLES) > 0 else None
+    return role_arn, os.environ.get('AWS_ACCESS_KEY_ID', None), os.environ.get('AWS_SESSION_TOKEN', None)
+
+def client(service_name: str, region_name: str = None) -> typing.Any:
+    """
+    Cached boto3 client. Inside assume_role, clients use the refreshable credentials of the role. Credentials exported
+        into the environment get their own clients, so swapping credentials never reuses a client of the previous ones
+    """
+    role_arn, access_key_id, session_token = credential_context()
+    # Built outside AWS_LOCK. The role session fetches its credentials from STS on first use, not while it's built
+    role_aws_session: 'boto3.session.Session' = None if role_arn is None else role_session(role_arn)
+    with AWS_LOCK:
+        aws_session: 'boto3.session.Session' = session()
+        region_name = region_name or aws_session.region_name
+        if not role_arn is None:
+            key: typing.Tuple[str, str, str, str] = (service_name, region_name, 'role', role_arn)
+            aws_client = AWS_CLIENTS.get(key, None)
+            if aws_client is None:
+                aws_client = AWS_CLIENTS[key] = role_aws_session.client(service_name, region_name=region_name, config=client_config())
+
+            return aws_client
+
+        key: typing.Tuple[str, str, str, str] = (service_name, region_name, access_key_id, session_token)
+        aws_client = AWS_CLIENTS.get(key, None)
+        if aws_client is None:
+            credentials: typing.Dict[str, str] = {}
+            if access_key_id:
+                credentials = {
+                    'aws_access_key_id': access_key_id,
+                    'aws_secret_access_key': os.environ.get('AWS_SECRET_ACCESS_KEY', None),
+                    'aws_session_token': session_token,
+                }
+
+            aws_client = AWS_CLIENTS[key] = aws_session.client(service_name, region_name=region_name, config=client_config(), **credentials)
+
+        return aws_client
+
+# Roles entered through assume_role, innermost last. Sessions of assumed roles, keyed by role ARN and emptied with
+#   AWS_SESSIONS. Credentials of assumed roles, kept for the process and inherited by forked workers
+ACTIVE_ROLES: typing.List[str] = []
+ROLE_SESSIONS: typing.Dict[str, 'boto3.session.Session'] = {}
+ROLE_CREDENTIALS: typing.Dict[str, typing.Dict[str, str]] = {}
+ROLE_DURATIONS: typing.Dict[str, int] = {}
+# Credentials of the process before any role was assumed, STS is always called with these. Resolved before the
+#   first role exports its credentials, and inherited by forked workers
+BASE_CREDENTIALS: typing.List[typing.Any] = []
+
+def _seconds_left(credentials: typing.Dict[str, str]) -> float:
+    from botocore.utils import parse_timestamp
+    expiry_time: datetime = parse_timestamp(credentials['expiry_time'])
+    return (expiry_time - datetime.now(timezone.utc)).total_seconds()
+
+def _credential_cache_key(role_arn: str) -> str:
+    return f'bert-etl-credentials-{hashlib.sha256(role_arn.encode(bert_constants.ENCODING)).hexdigest()}'
+
+def _read_cached_credentials(role_arn: str) -> typing.Dict[str, str]:
+    credentials: typing.Dict[str, str] = ROLE_CREDENTIALS.get(role_arn, None)
+    if not credentials is None and _seconds_left(credentials) >= bert_constants.AWS_CREDENTIAL_REFRESH:
+        return credentials
+
+    credentials = None
+    try:
+        if bert_constants.AWS_CREDENTIAL_CACHE == 'redis':
+            from bert import datasource as bert_datasource
+            value: bytes = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client().get(_credential_cache_key(role_arn))
+            credentials = None if value is None else json.loads(value.decode(bert_constants.ENCODING))
+
+        elif bert_constants.AWS_CREDENTIAL_CACHE == 'file':
+            filepath: str = os.path.join(bert_constants.AWS_CREDENTIAL_CACHE_DIR, f'{_credential_cache_key(role_arn)}.json')
+            if os.path.exists(filepath):
+                with open(filepath, 'r', encoding=bert_constants.ENCODING) as stream:
+                    credentials = json.loads(stream.read())
+
+    except Exception as err:
+        logger.warning(f'Unable to read cached credentials for Role[{role_arn}]: {err}')
+        return None
+
+    if credentials is None or _seconds_left(credentials) < bert_constants.AWS_CREDENTIAL_REFRESH:
+        return None
+
+    return credentials
+
+def _write_cached_credentials(role_arn: str, credentials: typing.Dict[str, str]) -> None:
+    ROLE_CREDENTIALS[role_arn] = credentials
+    try:
+        if bert_constants.AWS_CREDENTIAL_CACHE == 'redis':
+            from bert import datasource as bert_datasource
+            expires_ms: int = max(1, int(_seconds_left(credentials) * 1000))
+            bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client().set(_credential_cache_key(role_arn), json.dumps(credentials), px=expires_ms)
+
+        elif bert_constants.AWS_CREDENTIAL_CACHE == 'file':
+            os.makedirs(bert_constants.AWS_CREDENTIAL_CACHE_DIR, mode=0o700, exist_ok=True)
+            filepath: str = os.path.join(bert_constants.AWS_CREDENTIAL_CACHE_DIR, f'{_credential_cache_key(role_arn)}.json')
+            partial_filepath: str = f'{filepath}.{os.getpid()}'
+            with open(os.open(partial_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding=bert_constants.ENCODING) as stream:
+                stream.write(json.dumps(credentials))
+
+            os.replace(partial_filepath, filepath)
+
+    except Exception as err:
+        logger.warning(f'Unable to cache credentials for Role[{role_arn}]: {err}')
+
+class _credential_lock:
+    """
+    Only one worker calls STS for a role at a time, the others wait and read what it cached
+    """
+    __slots__ = ('_role_arn', '_stream', '_acquired')
+    def __init__(self: PWN, role_arn: str) -> None:
+        self._role_arn = role_arn
+        self._stream = None
+        self._acquired = False
+
+    def __enter__(self: PWN) -> PWN:
+        if bert_constants.AWS_CREDENTIAL_CACHE == 'redis':
+            from bert import datasource as bert_datasource
+            redis_client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
+            lock_key: str = f'{_credential_cache_key(self._role_arn)}:lock'
+            for idx in range(0, int(bert_constants.SUPER_LONG_DELAY / bert_constants.DELAY)):
+                if redis_client.set(lock_key, os.getpid(), nx=True, px=int(bert_constants.SUPER_LONG_DELAY * 1000)):
+                    self._acquired = True
+                    break
+
+                if not _read_cached_credentials(self._role_arn) is None:
+                    break
+
+                time.sleep(bert_constants.DELAY)
+
+        elif bert_constants.AWS_CREDENTIAL_CACHE == 'file':
+            import fcntl
+            try:
+                os.makedirs(bert_constants.AWS_CREDENTIAL_CACHE_DIR, mode=0o700, exist_ok=True)
+                self._stream = open(os.path.join(bert_constants.AWS_CREDENTIAL_CACHE_DIR, f'{_credential_cache_key(self._role_arn)}.lock'), 'a')
+                fcntl.flock(self._stream, fcntl.LOCK_EX)
+
+            except OSError as err:
+                # A read-only HOME, in Lambda for example, goes without the lock like it goes without the cache
+                logger.warning(f'Unable to lock cached credentials for Role[{self._role_arn}]: {err}')
+                if not self._stream is None:
+                    self._stream.close()
+                    self._stream = None
+
+        return self
+
+    def __exit__(self: PWN, exception_type: 'ExceptionType', exception_value: Exception, traceback: typing.Any) -> None:
+        if self._acquired:
+            from bert import datasource as bert_datasource
+            bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client().delete(f'{_credential_cache_key(self._role_arn)}:lock')
+
+        if not self._stream is None:
+            import fcntl
+            fcntl.flock(self._stream, fcntl.LOCK_UN)
+            self._stream.close()
+
+def _sts_client() -> typing.Any:
+    # Assumed credentials may be exported into the environment, so STS is called with the credentials the process
+    #   had before any role was assumed
+    if len(BASE_CREDENTIALS) == 0 or BASE_CREDENTIALS[0] is None:
+        return client('sts')
+
+    frozen = BASE_CREDENTIALS[0].get_frozen_credentials()
+    return session().client('sts', config=client_config(),
+        aws_access_key_id=frozen.access_key,
+        aws_secret_access_key=frozen.secret_key,
+        aws_session_token=frozen.token)
+
+def assumed_role_credentials(role_arn: str, duration: int = 3600) -> typing.Dict[str, str]:
+    """
+    Credentials of `role_arn` in botocore's metadata format. Read from the shared cache when they have more than
+        AWS_CREDENTIAL_REFRESH seconds left, otherwise requested from STS and cached for the other workers
+    """
+    credentials: typing.Dict[str, str] = _read_cached_credentials(role_arn)
+    if not credentials is None:
+        return credentials
+
+    with _credential_lock(role_arn):
+        credentials = _read_cached_credentials(role_arn)
+        if not credentials is None:
+            return credentials
+
+        logger.info(f'Assuming Role[{role_arn}] Duration[{duration}]')
+        response: typing.Dict[str, typing.Any] = _sts_client().assume_role(RoleArn=role_arn, RoleSessionName=str(uuid.uuid4()), DurationSeconds=duration)
+        credentials = {
+            'access_key': response['Credentials']['AccessKeyId'],
+            'secret_key': response['Credentials']['SecretAccessKey'],
+            'token': response['Credentials']['SessionToken'],
+            'expiry_time': response['Credentials']['Expiration'].astimezone(timezone.utc).isoformat(),
+        }
+        _write_cached_credentials(role_arn, credentials)
+        return credentials
+
+def _role_credential_provider(role_arn: str) -> 'botocore.credentials.CredentialProvider':
+    from botocore.credentials import CredentialProvider, DeferredRefreshableCredentials
+    class RoleCredentialProvider(CredentialProvider):
+        """
+        Credentials of `role_arn`. botocore fetches them on first use and refreshes them before they expire
+        """
+        METHOD: str = 'bert-assume-role'
+        CANONICAL_NAME: str = 'bert-assume-role'
+        def load(self: PWN) -> 'botocore.credentials.DeferredRefreshableCredentials':
+            return DeferredRefreshableCredentials(
+                refresh_using=lambda: assumed_role_credentials(role_arn, ROLE_DURATIONS[role_arn]),
+                method=self.METHOD)
+
+    return RoleCredentialProvider()
+
+def role_session(role_arn: str, duration: int = 3600) -> 'boto3.session.Session':
+    """
+    boto3 session of `role_arn`, with credentials botocore refreshes through assumed_role_credentials
+    """
+    if len(BASE_CREDENTIALS) == 0:
+        # Resolving the credentials of the process may call the instance metadata service, so AWS_LOCK isn't held
+        base_credentials: 'botocore.credentials.Credentials' = session().get_credentials()
+        with AWS_LOCK:
+            if len(BASE_CREDENTIALS) == 0:
+                BASE_CREDENTIALS.append(base_credentials)
+
+    ROLE_DURATIONS[role_arn] = duration
+    with AWS_LOCK:
+        # Empties ROLE_SESSIONS in a forked worker
+        session()
+        role_aws_session: 'boto3.session.Session' = ROLE_SESSIONS.get(role_arn, None)
+        if role_aws_session is None:
+            import boto3
+            import botocore.session
+            from botocore.credentials import CredentialResolver
+            botocore_session = botocore.session.get_session()
+            botocore_session.register_component('credential_provider', CredentialResolver(providers=[_role_credential_provider(role_arn)]))
+            role_aws_session = ROLE_SESSIONS[role_arn] = boto3.session.Session(botocore_session=botocore_session)
+
+    return role_aws_session
 
 class assume_role:
-    __slots__ = ('_role_arn', '_duration', '_session_name', '_env_vars', '_old_values')
+    """
+    Run a block as `role_arn`. Clients from bert.aws.client use refreshable credentials of the role. The credentials
+        are also exported into the environment when the block starts, for code that builds its own clients, and are
+        not refreshed there. Credentials are shared between workers through BERT_AWS_CREDENTIAL_CACHE
+    """
+    __slots__ = ('_role_arn', '_duration', '_env_vars', '_old_values')
     _env_vars: typing.Dict[str, str]
     _old_values: typing.Dict[str, str]
     _role_arn: str
     _duration: int
-    _session_name: str
 
     def __init__(self: PWN, role_arn: str, duration: int = 3600) -> None:
         self._role_arn = role_arn
         self._duration = duration
-        self._session_name = str(uuid.uuid4())
         self._env_vars = {}
         self._old_values = {}
 
     def __enter__(self: PWN) -> PWN:
-        sts_client = boto3.client('sts')
-        try:
-            response = sts_client.assume_role(RoleArn=self._role_arn, RoleSessionName=self._session_name, DurationSeconds=self._duration)
-        except ClientError as err:
-            # This could happen for two reasons.
-            # 1. The user is not registered as a trust entity
-            # 2. The duration of the assume role is greater than what has been configured in IAM
-            raise err
-
-        self._env_vars['AWS_ACCESS_KEY_ID'] = response['Credentials']['AccessKeyId']
-        self._env_vars['AWS_SECRET_ACCESS_KEY'] = response['Credentials']['SecretAccessKey']
-        self._env_vars['AWS_SESSION_TOKEN'] = response['Credentials']['SessionToken']
+        # This could fail for two reasons.
+        # 1. The user is not registered as a trust entity
+        # 2. The duration of the assume role is greater than what has been configured in IAM
+        role_session(self._role_arn, self._duration)
+        credentials: typing.Dict[str, str] = assumed_role_credentials(self._role_arn, self._duration)
+        self._env_vars['AWS_ACCESS_KEY_ID'] = credentials['access_key']
+        self._env_vars['AWS_SECRET_ACCESS_KEY'] = credentials['secret_key']
+        self._env_vars['AWS_SESSION_TOKEN'] = credentials['token']
         for key, value in self._env_vars.items():
             self._old_values[key] = os.environ.get(key, None)
             os.environ[key] = value
 
+        ACTIVE_ROLES.append(self._role_arn)
         return self
 
     def __exit__(self: PWN, exception_type: 'ExceptionType', exception_value: Exception, traceback: typing.Any) -> None:
+        ACTIVE_ROLES.remove(self._role_arn)
         for key, old_value in self._old_values.items():
             if old_value is None:
                 del os.environ[key]
@@ -75,14 +337,14 @@ class kms:
         pass
 
     def __init__(self: PWN, alias: str, usernames: typing.List[str] = [], auto_create: bool = False) -> None:
-        self._kms_client = boto3.client('kms')
+        self._kms_client = client('kms')
         self._alias = alias
         self._key = None
         self._auto_create = auto_create
         self._usernames = usernames
 
     def _gen_key_policy(self: PWN) -> str:
-        caller_info: typing.Dict[str, typing.Any] = boto3.client('sts').get_caller_identity()
+        caller_info: typing.Dict[str, typing.Any] = client('sts').get_caller_identity()
         caller_username: str = caller_info['Arn'].rsplit(':', 1)[-1]
         usernames: typing.List[str] = list({username for username in self._usernames})
         if not caller_username in usernames:
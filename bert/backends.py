@@ -27,7 +27,7 @@ class CacheBackend:
 class RedisCacheBackend(CacheBackend):
     def __init__(self: PWN, *args, **kwargs) -> None:
         super(RedisCacheBackend, self).__init__(*args, **kwargs)
-        self._client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client
+        self._client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
         self._contains_key = 'redis-cache-backend'
         self._step = 20000
 
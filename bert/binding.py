@@ -1,16 +1,16 @@
 import functools
 import hashlib
 import logging
-import marshmallow
-# import marshmallow.schema.UnmarshalResult
-import multiprocessing
 import os
 import inspect
 import types
 import typing
 
-from bert import constants, naming, backends
-from bert.runner.async_utils import obtain_event_loop
+from bert import constants, naming, queues
+
+if typing.TYPE_CHECKING:
+  import marshmallow
+  from bert import backends
 
 DAISY_CHAIN = {}
 REGISTRY: typing.Dict[str, types.FunctionType] = {}
@@ -18,7 +18,7 @@ ENCODING = 'utf-8'
 NOOP_SPACE: str = naming.calc_func_space(constants.NOOP)
 logger = logging.getLogger(__name__)
 
-def _merge_parent_funcs(parent_func: types.FunctionType) -> typing.List[types.FunctionType]:
+def _merge_parent_funcs(parent_func: typing.Union[str, types.FunctionType, typing.List[types.FunctionType]]) -> typing.List[types.FunctionType]:
     if isinstance(parent_func, str):
         return []
 
@@ -27,49 +27,118 @@ def _merge_parent_funcs(parent_func: types.FunctionType) -> typing.List[types.Fu
         parents.append(parent_func)
         return parents
 
+    elif isinstance(parent_func, (list, tuple)):
+        # Join stages inherit the ancestors of every parent, once
+        parents: typing.List[types.FunctionType] = []
+        for func in parent_func:
+            for parent in _merge_parent_funcs(func):
+                if not parent in parents:
+                    parents.append(parent)
+
+        return parents
+
     else:
         raise NotImplementedError
 
+def _setup_parent_func(parent_func: types.FunctionType) -> None:
+  parent_func_space = naming.calc_func_space(parent_func)
+  if getattr(parent_func, 'func_space', None) is None:
+      parent_func.func_space = parent_func_space
+
+  if getattr(parent_func, 'work_key', None) is None:
+      parent_func.work_key = naming.calc_func_key(parent_func_space, 'work')
+
+  if getattr(parent_func, 'done_key', None) is None:
+      parent_func.done_key = naming.calc_func_key(parent_func_space, 'done')
+
+  if getattr(parent_func, 'done_keys', None) is None:
+      parent_func.done_keys = []
+
 # Bert, a microframework for simple ETL solution that helps
 def follow(
-  parent_func: typing.Union[str, types.FunctionType],
+  parent_func: typing.Union[str, types.FunctionType, typing.List[types.FunctionType]],
   pipeline_type: constants.PipelineType = constants.PipelineType.BOTTLE,
-  workers: int = multiprocessing.cpu_count(),
-  schema: marshmallow.Schema = None,
-  cache_backend: backends.CacheBackend = None):
-
-  parent_func_space = naming.calc_func_space(parent_func)
-  parent_func_work_key = naming.calc_func_key(parent_func_space, 'work')
-  parent_func_done_key = naming.calc_func_key(parent_func_space, 'done')
-  if isinstance(parent_func, str) and parent_func_space == NOOP_SPACE:
-    pass
+  workers: int = os.cpu_count() or 1,
+  schema: 'marshmallow.Schema' = None,
+  cache_backend: 'backends.CacheBackend' = None,
+  fuse: bool = False,
+  partitions: int = 0,
+  partition_key: typing.Union[str, typing.Callable[[typing.Any], typing.Any]] = None,
+  memoize: bool = False):
+  """
+  Bind the decorated function to its parent. `parent_func` is either 'noop', a bound function, or a list of bound
+    functions. A list makes the decorated function a join stage, consuming the done output of every parent. A parent
+    may be followed by more than one function, in which case its done output is broadcast to each of them.
+
+  `partitions` splits the work queue into that many Redis shards, items are placed by `partition_key`. See
+    bert.queues.ShardedRedisQueue
+
+  `memoize` records the outputs of every item the decorated function processes, keyed by the item, the source of the
+    function and the encoders. A re-run puts the recorded outputs of unchanged items straight on the done queue and
+    only processes new or changed items. See bert.etl.memo
+  """
+  if isinstance(parent_func, (list, tuple)):
+    parent_func_list: typing.List[types.FunctionType] = list(parent_func)
+    if len(parent_func_list) == 0:
+      raise NotImplementedError(f'Join stages require at least one parent')
+
+    for func in parent_func_list:
+      if not isinstance(func, types.FunctionType):
+        raise NotImplementedError(f'Follow Parent[{func}] is not valid. Must be types.FunctionType')
+
+  elif isinstance(parent_func, str) and naming.calc_func_space(parent_func) == NOOP_SPACE:
+    parent_func_list: typing.List[types.FunctionType] = []
 
   elif isinstance(parent_func, types.FunctionType):
-    if getattr(parent_func, 'func_space', None) is None:
-        parent_func.func_space = parent_func_space
-
-    if getattr(parent_func, 'work_key', None) is None:
-        parent_func.work_key = parent_func_work_key
-
-    if getattr(parent_func, 'done_key', None) is None:
-        parent_func.done_key = parent_func_done_key
+    parent_func_list: typing.List[types.FunctionType] = [parent_func]
 
   elif isinstance(parent_func, str):
     raise NotImplementedError(f'Follow Parent[{parent_func}] is not valid. Must be types.FunctionType')
 
   else:
-    import ipdb; ipdb.set_trace()
     raise NotImplementedError
 
-  @functools.wraps(parent_func)
+  for func in parent_func_list:
+    _setup_parent_func(func)
+
+  if fuse is True:
+    # Fused stages run inside the worker of their parent, passing items in-process. See bert.utils.run_fused_chain
+    if len(parent_func_list) != 1:
+      raise NotImplementedError(f'Fused stages require exactly one parent function')
+
+    if pipeline_type != constants.PipelineType.CONCURRENT or getattr(parent_func_list[0], 'pipeline_type', None) != constants.PipelineType.CONCURRENT:
+      raise NotImplementedError(f'Only CONCURRENT stages can be fused')
+
+    if len(parent_func_list[0].done_keys) > 0:
+      raise NotImplementedError(f'Fused stages must be the only child of Parent[{parent_func_list[0].__name__}]')
+
+  if partitions > 0 and fuse is True:
+    raise NotImplementedError(f'Fused stages read from their parent in-process and can not be partitioned')
+
+  for func in parent_func_list:
+    if not getattr(func, 'fused_func', None) is None:
+      raise NotImplementedError(f'Parent[{func.__name__}] has a fused child and can not be followed again')
+
+  @functools.wraps(parent_func_list[0] if parent_func_list else parent_func)
   def _parent_wrapper(wrapped_func):
-    # Let the parent know who follows
-    wrapped_func.parent_func: typing.Union[str, types.FunctionType] = parent_func
+    if fuse is True and inspect.iscoroutinefunction(wrapped_func):
+      raise NotImplementedError(f'Fused stage[{wrapped_func.__name__}] must be a synchronous function')
+
+    if memoize is True and inspect.iscoroutinefunction(wrapped_func):
+      raise NotImplementedError(f'Memoized stage[{wrapped_func.__name__}] must be a synchronous function')
+
     wrapped_func_space: str = naming.calc_func_space(wrapped_func)
-    wrapped_func_work_key: str = parent_func_done_key
+    # The first child of a single parent reads the parent's done queue, like a linear pipeline always has. Any other
+    #   child, and every join stage, reads a work queue of its own which its parents broadcast their done output into
+    if len(parent_func_list) == 1 and not parent_func_list[0].done_key in parent_func_list[0].done_keys:
+      wrapped_func_work_key: str = parent_func_list[0].done_key
+
+    else:
+      wrapped_func_work_key: str = naming.calc_func_key(wrapped_func_space, 'work')
+
     wrapped_func_done_key: str = naming.calc_func_key(wrapped_func_space, 'done')
     wrapped_func_build_dir: str = os.path.join('/tmp', wrapped_func_space, 'build')
-    wrapped_func_cache_backend: backends.CacheBackend = cache_backend(wrapped_func_work_key, wrapped_func_done_key) if cache_backend else None
+    wrapped_func_cache_backend: 'backends.CacheBackend' = cache_backend(wrapped_func_work_key, wrapped_func_done_key) if cache_backend else None
 
     if getattr(wrapped_func, 'func_space', None) is None:
       wrapped_func.func_space = wrapped_func_space
@@ -80,6 +149,9 @@ def follow(
     if getattr(wrapped_func, 'done_key', None) is None:
       wrapped_func.done_key = wrapped_func_done_key
 
+    if getattr(wrapped_func, 'done_keys', None) is None:
+      wrapped_func.done_keys = []
+
     if getattr(wrapped_func, 'build_dir', None) is None:
       wrapped_func.build_dir = wrapped_func_build_dir
 
@@ -95,18 +167,27 @@ def follow(
     if getattr(wrapped_func, 'schema', None) is None:
       wrapped_func.schema = schema
 
+    if getattr(wrapped_func, 'memoize', None) is None:
+      wrapped_func.memoize = memoize
+
+    if getattr(wrapped_func, 'fused', None) is None:
+      wrapped_func.fused = fuse
+      wrapped_func.fused_func = None
+
     if getattr(wrapped_func, 'parent_space', None) is None:
-      if parent_func_space != NOOP_SPACE:
-        wrapped_func.parent_func = parent_func
-        wrapped_func.parent_space = parent_func_space
-        wrapped_func.parent_func_work_key = parent_func.work_key
-        wrapped_func.parent_func_done_key = parent_func.done_key
+      if len(parent_func_list) > 0:
+        wrapped_func.parent_func = parent_func_list[0]
+        wrapped_func.parent_func_list = parent_func_list
+        wrapped_func.parent_space = parent_func_list[0].func_space
+        wrapped_func.parent_func_work_key = parent_func_list[0].work_key
+        wrapped_func.parent_func_done_key = parent_func_list[0].done_key
         wrapped_func.parent_noop_space = False
-        wrapped_func.parent_funcs = _merge_parent_funcs(parent_func)
+        wrapped_func.parent_funcs = _merge_parent_funcs(parent_func_list)
 
       else:
         wrapped_func.parent_space = None
         wrapped_func.parent_func = 'noop'
+        wrapped_func.parent_func_list = []
         wrapped_func.parent_func_work_key = None
         wrapped_func.parent_func_done_key = None
         wrapped_func.parent_noop_space = True
@@ -115,36 +196,53 @@ def follow(
     @functools.wraps(wrapped_func)
     def _wrapper(*args, **kwargs):
       if inspect.iscoroutinefunction(wrapped_func):
+        from bert.runner.async_utils import obtain_event_loop
         return obtain_event_loop().run_until_complete(wrapped_func(*args, **kwargs))
 
       else:
         return wrapped_func(*args, **kwargs)
 
-    chain: typing.List[types.FunctionType] = DAISY_CHAIN.get(parent_func_space, [])
-    chain.append(wrapped_func_space)
-    if len(chain) > 1:
-      raise NotImplementedError('One child to parent per program')
+    # Let the parents know who follows
+    for parent_space in [func.func_space for func in parent_func_list] or [NOOP_SPACE]:
+      DAISY_CHAIN.setdefault(parent_space, []).append(wrapped_func_space)
+
+    for func in parent_func_list:
+      func.done_keys.append(wrapped_func.work_key)
 
-    DAISY_CHAIN[parent_func_space] = chain
     REGISTRY[wrapped_func_space] = _wrapper
+    if partitions > 0:
+      queues.PARTITIONED_QUEUES[wrapped_func.work_key] = queues.PartitionSpec(partitions, partition_key)
+
+    if fuse is True:
+      parent_func_list[0].fused_func = _wrapper
 
     return _wrapper
   return _parent_wrapper
 
-def build_job_chain() -> typing.Any:
-  job_chain: typing.List[types.FunctionType] = []
-  job_chain.append(DAISY_CHAIN[NOOP_SPACE][0])
-  while True:
-    latest_job = job_chain[-1:][0]
-    for key, values in DAISY_CHAIN.items():
-      if latest_job == key:
-        job_chain.append(values[0])
-
-    if len(DAISY_CHAIN.keys()) == len(job_chain):
-      break
-
-  for idx, job_space in enumerate(job_chain):
-    job_chain[idx] = REGISTRY[job_space]
-
-  return job_chain
-
+def build_job_chain() -> typing.List[types.FunctionType]:
+  """
+  Order every registered job so each one comes after all of its parents
+  """
+  job_chain: typing.List[str] = []
+  pending: typing.List[str] = DAISY_CHAIN.get(NOOP_SPACE, [])[:]
+  stalled: int = 0
+  while len(pending) > 0:
+    job_space: str = pending.pop(0)
+    if job_space in job_chain:
+      continue
+
+    parent_spaces: typing.List[str] = [func.func_space for func in REGISTRY[job_space].parent_func_list]
+    if not all([parent_space in job_chain for parent_space in parent_spaces]):
+      # A join stage, revisit once the other parents are in the chain
+      stalled += 1
+      if stalled > len(pending):
+        raise NotImplementedError(f'Unable to resolve the parents of Job[{REGISTRY[job_space].__name__}]')
+
+      pending.append(job_space)
+      continue
+
+    stalled = 0
+    job_chain.append(job_space)
+    pending.extend(DAISY_CHAIN.get(job_space, []))
+
+  return [REGISTRY[job_space] for job_space in job_chain]
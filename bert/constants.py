@@ -16,11 +16,28 @@ DEBUG: bool = False if os.environ.get('DEBUG', 'true').lower() in ['f', 'false',
 DELAY: int = .1
 LONG_DELAY = 5.0
 SUPER_LONG_DELAY = 10.0
+# Upper bound of items held between two fused stages before the upstream stage blocks
+FUSED_QUEUE_SIZE: int = int(os.environ.get('BERT_FUSED_QUEUE_SIZE', 1000))
+# Seconds a worker of a partitioned queue holds its shards without a heartbeat, and how often it rebalances them
+PARTITION_LEASE: float = float(os.environ.get('BERT_PARTITION_LEASE', 30.0))
+PARTITION_REBALANCE: float = float(os.environ.get('BERT_PARTITION_REBALANCE', 5.0))
+# Seconds an agent of `bert-runner.py --agent` stays registered, or holds the coordinator lease, without a heartbeat
+AGENT_LEASE: float = float(os.environ.get('BERT_AGENT_LEASE', 15.0))
 DATETIME_FORMAT: str = '%Y-%m-%dT%H:%M:%SZ'
 WWW_SECRET: str = os.environ.get('WWW_SECRET', 'noop')
 WWW_PORT: int = int(os.environ.get('WWW_PORT', 8000))
 
 REPORTING_TIME_FORMAT: str = '%Y-%m-%dT%H-%M-%S'
+# Tuning of the boto3 clients built by bert.aws.client
+AWS_MAX_POOL_CONNECTIONS: int = int(os.environ.get('BERT_AWS_MAX_POOL_CONNECTIONS', 50))
+AWS_RETRY_MODE: str = os.environ.get('BERT_AWS_RETRY_MODE', 'standard')
+AWS_MAX_ATTEMPTS: int = int(os.environ.get('BERT_AWS_MAX_ATTEMPTS', 5))
+AWS_TCP_KEEPALIVE: bool = False if os.environ.get('BERT_AWS_TCP_KEEPALIVE', 'true').lower() in ['f', 'false', 'no'] else True
+# Where assume_role shares credentials between workers: none, file or redis. Credentials with less than
+#   AWS_CREDENTIAL_REFRESH seconds left are refreshed
+AWS_CREDENTIAL_CACHE: str = os.environ.get('BERT_AWS_CREDENTIAL_CACHE', 'none').lower()
+AWS_CREDENTIAL_CACHE_DIR: str = os.environ.get('BERT_AWS_CREDENTIAL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.bert-etl', 'credentials'))
+AWS_CREDENTIAL_REFRESH: float = float(os.environ.get('BERT_AWS_CREDENTIAL_REFRESH', 900.0))
 
 MAIN_SERVICE_HOST: str = os.environ.get('MAIN_SERVICE_HOST', None)
 MAIN_SERVICE_NONCE: str = os.environ.get('MAIN_SERVICE_NONCE', None)
@@ -30,6 +47,11 @@ SERVICE_NAME: str = os.environ.get('SERVICE_NAME', None)
 SERVICE_MODULE: str = os.environ.get('SERVICE_MODULE', None)
 
 REDIS_URL: str = os.environ.get('REDIS_URL', 'http://localhost:6379/4')
+# Connections each process may open to one Redis URL, and socket timeouts in seconds
+REDIS_MAX_CONNECTIONS: int = int(os.environ.get('BERT_REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT: float = float(os.environ.get('BERT_REDIS_SOCKET_TIMEOUT', 30.0))
+REDIS_CONNECT_TIMEOUT: float = float(os.environ.get('BERT_REDIS_CONNECT_TIMEOUT', 5.0))
+REDIS_KEEPALIVE: bool = False if os.environ.get('BERT_REDIS_KEEPALIVE', 'true').lower() in ['f', 'false', 'no'] else True
 if SERVICE_NAME:
   REMOTE_CONFIG_SPACE: str = ''.join([SERVICE_NAME, WWW_SECRET])
   REMOTE_CONFIG_SPACE: str = hashlib.sha256(REMOTE_CONFIG_SPACE.encode(ENCODING)).hexdigest()
@@ -1,21 +1,19 @@
 import collections
+import functools
 import getpass
 import json
 import os
 import logging
-import redis
 import typing
 
 from bert.constants import PWN
 
-from urllib.parse import ParseResult, urlparse
+from urllib.parse import ParseResult, parse_qs, urlparse
 
 logger = logging.getLogger(__name__)
 
-try:
-    import aioredis
-except ModuleNotFoundError:
-    logger.warning('Unable to import aioredis')
+if typing.TYPE_CHECKING:
+    import redis
 
 class ENVVars:
     __slots__ = ('_env_vars', '_old_values')
@@ -83,30 +81,89 @@ class Postgres(collections.namedtuple('Postgres', ['host', 'port', 'dbname', 'us
     del os.environ['PGUSER']
     del os.environ['PGPASSWORD']
 
+# Redis pools and clients of this process, keyed by RedisConnection. Emptied when the PID changes, so a forked worker
+#   never shares a socket with its parent
+REDIS_POOLS: typing.Dict[typing.Any, typing.Any] = {}
+REDIS_POOLS_PID: int = os.getpid()
+
+def _redis_registry() -> typing.Dict[typing.Any, typing.Any]:
+    global REDIS_POOLS_PID
+    if REDIS_POOLS_PID != os.getpid():
+        REDIS_POOLS.clear()
+        REDIS_POOLS_PID = os.getpid()
+
+    return REDIS_POOLS
+
 class RedisConnection(typing.NamedTuple):
     host: str
     port: int
     db: int
-    username: str
     password: str
-    clients: typing.Dict[str, typing.Any] = {}
+    unix_socket_path: str = None
+
+    def pool(self: PWN) -> 'redis.ConnectionPool':
+        registry: typing.Dict[typing.Any, typing.Any] = _redis_registry()
+        pool = registry.get(('pool', self), None)
+        if pool is None:
+            import redis
+            from bert import constants as bert_constants
+            options: typing.Dict[str, typing.Any] = {
+                'db': self.db,
+                'password': self.password,
+                'max_connections': bert_constants.REDIS_MAX_CONNECTIONS,
+                'socket_timeout': bert_constants.REDIS_SOCKET_TIMEOUT,
+            }
+            if self.unix_socket_path:
+                pool = redis.ConnectionPool(connection_class=redis.UnixDomainSocketConnection, path=self.unix_socket_path, **options)
+
+            else:
+                pool = redis.ConnectionPool(
+                    host=self.host,
+                    port=self.port,
+                    socket_connect_timeout=bert_constants.REDIS_CONNECT_TIMEOUT,
+                    socket_keepalive=bert_constants.REDIS_KEEPALIVE,
+                    **options)
 
-    def client(self: PWN) -> redis.Redis:
-        cli = self.clients.get('client', None)
+            registry[('pool', self)] = pool
+
+        return pool
+
+    def client(self: PWN) -> 'redis.Redis':
+        registry: typing.Dict[typing.Any, typing.Any] = _redis_registry()
+        cli = registry.get(('client', self), None)
         if cli is None:
-            self.clients['client'] = redis.Redis(host=self.host, port=self.port, db=self.db)
+            import redis
+            cli = registry[('client', self)] = redis.Redis(connection_pool=self.pool())
 
-        return self.clients['client']
+        return cli
 
     async def client_async(self: PWN) -> 'aioredis.create_pool':
-        cli = self.clients.get('client-async', None)
+        registry: typing.Dict[typing.Any, typing.Any] = _redis_registry()
+        cli = registry.get(('client-async', self), None)
         if cli is None:
-            self.clients['client-async'] = await aioredis.create_pool([self.host, self.port], db=self.db, minsize=5, maxsize=10)
-
-        return self.clients['client-async']
+            import aioredis
+            from bert import constants as bert_constants
+            address: typing.Any = self.unix_socket_path or (self.host, self.port)
+            cli = registry[('client-async', self)] = await aioredis.create_pool(
+                address,
+                db=self.db,
+                password=self.password,
+                minsize=min(5, bert_constants.REDIS_MAX_CONNECTIONS),
+                maxsize=bert_constants.REDIS_MAX_CONNECTIONS,
+                create_connection_timeout=bert_constants.REDIS_CONNECT_TIMEOUT)
+
+        return cli
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def ParseURL(cls: PWN, url: str) -> PWN:
+        """
+        redis://[:password@]host:port/db, or unix:///path/to/redis.sock?db=4 for a unix socket. A username is ignored,
+            ACL users need a newer redis client than the one pinned in setup.py
+        """
         parts: ParseResult = urlparse(url)
-        host, port = parts.netloc.split(':')
-        return cls(host, int(port), int(parts.path.strip('/')), None, None)
+        query: typing.Dict[str, typing.List[str]] = parse_qs(parts.query)
+        if parts.scheme == 'unix':
+            return cls(None, None, int(query.get('db', ['0'])[0]), parts.password or None, parts.path)
+
+        return cls(parts.hostname, parts.port or 6379, int(parts.path.strip('/') or 0), parts.password or None)
@@ -41,7 +41,7 @@ def print_job_spaces(options: argparse.Namespace):
 def count_job_duplicates(options: argparse.Namespace) -> None:
     jobs = bert_utils.scan_jobs(options.module_name)
     jobs = bert_utils.map_jobs(jobs, options.module_name)
-    client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client
+    client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
     for job_name, conf in jobs.items():
         job = conf['job']
         work_queue, done_queue, ologger = bert_utils.comm_binders(job)
@@ -61,7 +61,7 @@ def count_job_duplicates(options: argparse.Namespace) -> None:
 def count_job_spaces(options: argparse.Namespace):
     jobs = bert_utils.scan_jobs(options.module_name)
     jobs = bert_utils.map_jobs(jobs, options.module_name)
-    client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client
+    client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
     for idx, (job_name, conf) in enumerate(jobs.items()):
         job = conf['job']
         work_queue, done_queue, ologger = bert_utils.comm_binders(job)
@@ -16,7 +16,7 @@ import types
 
 from datetime import datetime
 
-from bert import utils as bert_utils, constants as bert_constants
+from bert import aws as bert_aws, utils as bert_utils, constants as bert_constants
 from bert.deploy import utils as bert_deploy_utils
 
 logger = logging.getLogger(__name__)
@@ -44,10 +44,9 @@ def deploy_service(options) -> None:
 
     if options.service == Service.AWSLambda:
         if options.invoke:
-            import boto3
             job_name: str = [job for job in jobs.keys()][0]
             invoke_args: typing.List[typing.Dict[str, typing.Any]] = {key: value for key, value in jobs.items()}[job_name]['aws-deploy']['invoke-args']
-            client = boto3.client('lambda')
+            client = bert_aws.client('lambda')
             if len(invoke_args) < 1:
                 logger.info(f'Invoking Job[{job_name}]')
                 client.invoke(FunctionName=job_name, InvocationType='Event')
@@ -70,9 +69,12 @@ def deploy_service(options) -> None:
             reporting.monitor_function_progress(options.module_name)
             import sys; sys.exit(0)
 
+        # Fused jobs are rendered into the lambda of the job they're fused to and aren't deployed on their own
+        all_jobs: typing.Dict[str, typing.Any] = jobs
+        jobs: typing.Dict[str, typing.Any] = {job_name: conf for job_name, conf in all_jobs.items() if not conf['spaces']['fused']}
         bert_deploy_utils.validate_inputs(jobs)
         bert_deploy_utils.build_project(jobs)
-        bert_deploy_utils.build_lambda_handlers(jobs)
+        bert_deploy_utils.build_lambda_handlers(all_jobs)
         bert_deploy_utils.build_archives(jobs)
         bert_deploy_utils.create_roles(jobs)
         bert_deploy_utils.scan_dynamodb_tables(jobs)
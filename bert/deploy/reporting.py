@@ -1,4 +1,3 @@
-import boto3
 import os
 import json
 import logging
@@ -7,7 +6,7 @@ import types
 import typing
 import uuid
 
-from bert import constants as bert_constants
+from bert import aws as bert_aws, constants as bert_constants
 
 from botocore.errorfactory import ClientError
 
@@ -20,7 +19,6 @@ logger = logging.getLogger(__name__)
 
 
 def monitor_function_progress(module_name: str = None) -> None:
-    import boto3
     from bert import \
             utils as bert_utils, \
             constants as bert_constants
@@ -31,8 +29,8 @@ def monitor_function_progress(module_name: str = None) -> None:
         if module_name is None:
             raise NotImplementedError
 
-    dynamodb_client = boto3.client('dynamodb')
-    lambda_client = boto3.client('lambda')
+    dynamodb_client = bert_aws.client('dynamodb')
+    lambda_client = bert_aws.client('lambda')
     time_offset: int = 15
     logger.info('Running Monitor function')
     jobs: typing.Dict[str, typing.Any] = bert_utils.scan_jobs(module_name)
@@ -91,7 +89,7 @@ def monitor_function_progress(module_name: str = None) -> None:
 
 class track_execution():
     def __init__(self: PWN, job: types.FunctionType, **kwargs) -> None:
-        self._client = boto3.client('dynamodb')
+        self._client = bert_aws.client('dynamodb')
         self._job = job
         self._identity = str(uuid.uuid4())
 
@@ -119,7 +117,7 @@ class track_execution():
 
 class manager():
     def __init__(self: PWN, job: types.FunctionType) -> None:
-        self._client = boto3.client('dynamodb')
+        self._client = bert_aws.client('dynamodb')
         self._job = job
         self._identity = str(uuid.uuid4())
         self._delay = 3
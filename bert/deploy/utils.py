@@ -1,4 +1,3 @@
-import boto3
 import collections
 import glob
 import logging
@@ -14,6 +13,7 @@ import typing
 import zipfile
 
 from bert import \
+    aws as bert_aws, \
     utils as bert_utils, \
     encoders as bert_encoders, \
     exceptions as bert_exceptions, \
@@ -107,33 +107,42 @@ def find_site_packages_dir(start: str, find: str) -> str:
 
 def build_lambda_handlers(jobs: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
     for job_name, conf in jobs.items():
+        if conf['spaces']['fused']:
+            # Fused stages are rendered into the handler of the job they're fused to
+            continue
+
         job_source: str = inspect.getsource(conf['job']).split('\n')
+        fused_names: typing.List[str] = [job.__name__ for job in bert_utils.fused_chain(conf['job'])[1:]]
         job_templates: typing.List[str] = []
-        previous_job: str = None
         head_templates: typing.List[str] = []
         tail_templates: typing.List[str] = []
         head_on: bool = True
         for sub_name, sub_conf in jobs.items():
             if sub_name == job_name:
-                previous_job = sub_name
                 head_on = False
                 continue
 
-            if previous_job:
+            if sub_name in fused_names:
+                template: str = '\n%s\n' % inspect.getsource(sub_conf['job'])
+
+            else:
+                # Stubs follow the same parents, in the same order, so every job resolves to the same queues
+                parent_names: typing.List[str] = sub_conf['spaces']['parent']['names']
+                if len(parent_names) == 0:
+                    parent_name: str = "'noop'"
+
+                elif len(parent_names) == 1:
+                    parent_name: str = parent_names[0]
+
+                else:
+                    parent_name: str = '[%s]' % ', '.join(parent_names)
+
                 template: str = '''
 @binding.follow(%(parent_name)s)
 def %(job_name)s() -> None:
     pass
 '''% {
-    'parent_name': previous_job,
-    'job_name': sub_name
-}
-            else:
-                template: str = '''
-@binding.follow('noop')
-def %(job_name)s() -> None:
-    pass
-''' % {
+    'parent_name': parent_name,
     'job_name': sub_name
 }
 
@@ -143,7 +152,6 @@ def %(job_name)s() -> None:
             else:
                 tail_templates.append(template)
 
-            previous_job = sub_name
         else:
             head_templates: str = ''.join(head_templates)
             tail_templates: str = ''.join(tail_templates)
@@ -223,7 +231,7 @@ def %(job_name)s_handler(event: typing.Dict[str, typing.Any] = {}, context: 'lam
             work_queue, done_queue, ologger = bert_utils.comm_binders(%(job_name)s)
 
         ologger.info(f'QueueType[{bert_constants.QueueType}]')
-        %(job_name)s()
+        bert_utils.run_fused_chain(%(job_name)s)
 
 
 def %(job_name)s_manager(event: typing.Dict[str, typing.Any] = {}, context: 'lambda_context' = None) -> None:
@@ -233,7 +241,7 @@ def %(job_name)s_manager(event: typing.Dict[str, typing.Any] = {}, context: 'lam
             work_queue, done_queue, ologger = bert_utils.comm_binders(%(job_name)s)
             ologger.info('Executing Bottle Function')
             ologger.info(f'QueueType[{bert_constants.QueueType}]')
-            %(job_name)s()
+            bert_utils.run_fused_chain(%(job_name)s)
 
 def %(job_name)s_api_handler(event: typing.Dict[str, typing.Any] = {}, context: 'lambda_context' = None) -> None:
     with bert_reporting.track_execution(%(job_name)s):
@@ -330,7 +338,7 @@ def include_bert_dev(dev_path: str, build_path: str, excludes: typing.List[str]
 
 
 def _validate_concurrency(jobs: typing.Dict[str, typing.Any]) -> str:
-    client = boto3.client('lambda')
+    client = bert_aws.client('lambda')
     account_settings = client.get_account_settings()
     account_concurrency_limit = account_settings['AccountLimit']['ConcurrentExecutions']
     # Don't use UnreservedConcurrentExecutions because we'll release the ConcurrentExecutions with every deployment
@@ -501,7 +509,7 @@ def build_archives(jobs: typing.Dict[str, typing.Any]) -> str:
 
 
 def scan_dynamodb_tables(jobs: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
-    client = boto3.client('dynamodb')
+    client = bert_aws.client('dynamodb')
     for job_name, conf in jobs.items():
         try:
             conf['aws-deployed']['work-table'] = client.describe_table(TableName=conf['aws-deploy']['work-table-name'])
@@ -514,7 +522,7 @@ def scan_dynamodb_tables(jobs: typing.Dict[str, typing.Dict[str, typing.Any]]) -
             conf['aws-deployed']['done-table'] = None
 
 def create_reporting_dynamodb_table() -> None:
-    client = boto3.client('dynamodb')
+    client = bert_aws.client('dynamodb')
     try:
         client.describe_table(TableName=bert_reporting.TABLE_NAME)
     except ClientError as err:
@@ -540,7 +548,7 @@ def create_reporting_dynamodb_table() -> None:
 
 
 def create_dynamodb_tables(jobs: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
-    client = boto3.client('dynamodb')
+    client = bert_aws.client('dynamodb')
     for job_name, conf in jobs.items():
         try:
             conf['aws-deployed']['work-table'] = client.describe_table(TableName=conf['aws-deploy']['work-table-name'])
@@ -613,8 +621,8 @@ def create_roles(jobs: typing.Dict[str, typing.Any]) -> None:
             }
         ]
     }
-    region_name: str = boto3.session.Session().region_name
-    account_id: str = boto3.client('sts').get_caller_identity().get('Account')
+    region_name: str = bert_aws.session().region_name
+    account_id: str = bert_aws.client('sts').get_caller_identity().get('Account')
     policy_document = {
         "Version": "2012-10-17",
         "Statement": [
@@ -691,7 +699,7 @@ def create_roles(jobs: typing.Dict[str, typing.Any]) -> None:
         'PolicyDocument': json.dumps(policy_document),
         'Description': 'Bert-ETL Lambda Execution Policy'
     }
-    iam_client = boto3.client('iam')
+    iam_client = bert_aws.client('iam')
     role = bert_deploy_shortcuts.map_iam_role(ROLE_NAME)
     if role is None:
         iam_client.create_role(**iam_role)
@@ -711,8 +719,8 @@ def create_roles(jobs: typing.Dict[str, typing.Any]) -> None:
         conf['aws-deployed']['iam-policy'] = policy
 
 def destroy_lambda_to_table_bindings(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
-    dynamodb_client = boto3.client('dynamodb')
+    client = bert_aws.client('lambda')
+    dynamodb_client = bert_aws.client('dynamodb')
     for job_name, conf in jobs.items():
         if conf['spaces']['parent']['noop-space'] is True:
             continue
@@ -721,7 +729,7 @@ def destroy_lambda_to_table_bindings(jobs: typing.Dict[str, typing.Any]) -> None
             continue
 
         try:
-            parent_table = dynamodb_client.describe_table(TableName=conf['spaces']['parent']['done-key'])
+            parent_table = dynamodb_client.describe_table(TableName=conf['aws-deploy']['work-table-name'])
         except ClientError:
             return None
 
@@ -734,7 +742,7 @@ def destroy_lambda_to_table_bindings(jobs: typing.Dict[str, typing.Any]) -> None
             client.delete_event_source_mapping(UUID=event_mapping['UUID'])
 
 def destroy_lambda_concurrency(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
+    client = bert_aws.client('lambda')
     for job_name, conf in jobs.items():
         try:
             client.delete_function_concurrency(FunctionName=conf['aws-deploy']['lambda-name'])
@@ -742,8 +750,8 @@ def destroy_lambda_concurrency(jobs: typing.Dict[str, typing.Any]) -> None:
             pass
 
 def destroy_sns_topic_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
-    lambda_client = boto3.client('lambda')
-    sns_client = boto3.client('sns')
+    lambda_client = bert_aws.client('lambda')
+    sns_client = bert_aws.client('sns')
     for job_name, conf in jobs.items():
         if conf['spaces']['parent']['noop-space'] is True:
             try:
@@ -759,7 +767,7 @@ def destroy_sns_topic_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
 
 
 def destroy_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
+    client = bert_aws.client('lambda')
     for job_name, conf in jobs.items():
         try:
             client.delete_function(FunctionName=conf['aws-deploy']['lambda-name'])
@@ -771,7 +779,7 @@ def destroy_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
             logger.info(f'Deleted Lambda[{job_name}]')
 
 def destroy_dynamodb_tables(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('dynamodb')
+    client = bert_aws.client('dynamodb')
     table_names: typing.List[str] = []
     for job_name, conf in jobs.items():
         table_names.append(conf['aws-deploy']['work-table-name'])
@@ -802,7 +810,7 @@ def create_lambda_s3_item(job_name: str, conf: typing.Dict[str, typing.Any]) ->
     if conf['deployment']['s3_bucket'] is None:
         raise bert_exceptions.BertConfigError('Archive over 50 MB. Please specify an s3_bucket to upload to. https://bert-etl.readthedocs.io/en/latest/bert-etl.yaml#s3_bucket')
 
-    client = boto3.client('s3')
+    client = bert_aws.client('s3')
 
     try:
         client.head_bucket(Bucket=conf['deployment']['s3_bucket'])
@@ -829,7 +837,7 @@ Should not contain uppercase characters
     }
 
 def create_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
+    client = bert_aws.client('lambda')
     for job_name, conf in jobs.items():
         if conf['aws-build']['archive-size'] - 50000000 > 0:
             code_config = create_lambda_s3_item(job_name, conf)
@@ -871,7 +879,7 @@ def create_lambdas(jobs: typing.Dict[str, typing.Any]) -> None:
             conf['aws-deployed']['aws-lambda'] = client.get_function(FunctionName=conf['aws-deploy']['lambda-name'])['Configuration']
 
 def create_lambda_concurrency(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
+    client = bert_aws.client('lambda')
     for job_name, conf in jobs.items():
         if conf['aws-deploy']['concurrency-limit'] > 0:
             client.put_function_concurrency(
@@ -879,8 +887,8 @@ def create_lambda_concurrency(jobs: typing.Dict[str, typing.Any]) -> None:
                 ReservedConcurrentExecutions=conf['aws-deploy']['concurrency-limit'])
 
 def bind_lambdas_to_tables(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('lambda')
-    dynamodb_client = boto3.client('dynamodb')
+    client = bert_aws.client('lambda')
+    dynamodb_client = bert_aws.client('dynamodb')
     for job_name, conf in jobs.items():
         if conf['spaces']['parent']['noop-space'] is True:
             continue
@@ -888,7 +896,8 @@ def bind_lambdas_to_tables(jobs: typing.Dict[str, typing.Any]) -> None:
         elif conf['spaces']['pipeline-type'] == bert_constants.PipelineType.BOTTLE:
             continue
 
-        parent_table = dynamodb_client.describe_table(TableName=conf['spaces']['parent']['done-key'])
+        # Parents write into the work table of the job, a join stage has more than one
+        parent_table = dynamodb_client.describe_table(TableName=conf['aws-deploy']['work-table-name'])
         parent_table_name = parent_table['Table']['TableName']
         parent_stream_arn = parent_table['Table']['LatestStreamArn']
         logger.info(f'Mapping Lambda[{job_name}] to Work-Table[{parent_table_name}]')
@@ -902,7 +911,7 @@ def bind_lambdas_to_tables(jobs: typing.Dict[str, typing.Any]) -> None:
 
 
 def bind_events_for_bottle_functions(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('events')
+    client = bert_aws.client('events')
     for job_name, conf in jobs.items():
         if conf['spaces']['parent']['noop-space'] is False and bert_constants.PipelineType.BOTTLE == conf['spaces']['pipeline-type']:
             logger.info(f'Scheduling[{conf["bottle"]["schedule-expression"]}] Lambda[{job_name}] to Cloudwatch Events')
@@ -940,7 +949,7 @@ def bind_events_for_bottle_functions(jobs: typing.Dict[str, typing.Any]) -> None
                 conf['aws-deployed']['bottle']['schedule-expression-rule'] = client.describe_rule(Name=conf['aws-deployed']['bottle']['schedule-expression-rule-name'])
 
             # Add permissions
-            lambda_client = boto3.client('lambda')
+            lambda_client = bert_aws.client('lambda')
             lambda_client.add_permission(
                 FunctionName=conf['aws-deploy']['lambda-name'],
                 StatementId=f'{conf["aws-deployed"]["bottle"]["schedule-expression-rule-name"]}-Event',
@@ -968,7 +977,7 @@ def bind_events_for_bottle_functions(jobs: typing.Dict[str, typing.Any]) -> None
 
 
 def bind_events_for_init_function(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('events')
+    client = bert_aws.client('events')
     for job_name, conf in jobs.items():
         if conf['spaces']['parent']['noop-space'] is True and conf['events']['schedule-expression']:
             logger.info(f'Scheduling[{conf["events"]["schedule-expression"]}] Lambda[{job_name}] to Cloudwatch Events')
@@ -1005,7 +1014,7 @@ def bind_events_for_init_function(jobs: typing.Dict[str, typing.Any]) -> None:
                 conf['aws-deployed']['events']['schedule-expression-rule'] = client.describe_rule(Name=conf['aws-deployed']['events']['schedule-expression-rule-name'])
 
             # Add permissions
-            lambda_client = boto3.client('lambda')
+            lambda_client = bert_aws.client('lambda')
             lambda_client.add_permission(
                 FunctionName=conf['aws-deploy']['lambda-name'],
                 StatementId=f'{conf["aws-deployed"]["events"]["schedule-expression-rule-name"]}-Event',
@@ -1033,9 +1042,9 @@ def bind_events_for_init_function(jobs: typing.Dict[str, typing.Any]) -> None:
 
         if conf['spaces']['parent']['noop-space'] is True and conf['events']['sns-topic-arn']:
             logger.info(f'Attaching Job[{job_name}] to SNS Topic[{conf["events"]["sns-topic-arn"]}]')
-            sns_client = boto3.client('sns')
-            events_client = boto3.client('events')
-            lambda_client = boto3.client('lambda')
+            sns_client = bert_aws.client('sns')
+            events_client = bert_aws.client('events')
+            lambda_client = bert_aws.client('lambda')
 
             conf['aws-deployed']['events']['sns-topic'] = sns_client.subscribe(
                 TopicArn=conf['events']['sns-topic-arn'],
@@ -1098,7 +1107,7 @@ def bind_events_for_init_function(jobs: typing.Dict[str, typing.Any]) -> None:
                 }])
 
 def destroy_monitor() -> None:
-    lambda_client = boto3.client('lambda')
+    lambda_client = bert_aws.client('lambda')
     try:
         function = lambda_client.get_function(FunctionName=bert_reporting.MONITOR_NAME)
 
@@ -1110,8 +1119,8 @@ def destroy_monitor() -> None:
         lambda_client.delete_function(FunctionName=bert_reporting.MONITOR_NAME)
 
 def deploy_monitor(module_name: str) -> None:
-    lambda_client = boto3.client('lambda')
-    events_client = boto3.client('events')
+    lambda_client = bert_aws.client('lambda')
+    events_client = bert_aws.client('events')
     try:
         function = lambda_client.get_function(FunctionName=bert_reporting.MONITOR_NAME)
         return
@@ -1242,7 +1251,7 @@ def handle(event: typing.Any, context: typing.Any) -> None:
             }])
 
 def destroy_api_endpoints(jobs: typing.Dict[str, typing.Any]) -> None:
-    api_gateway_client = boto3.client('apigateway')
+    api_gateway_client = bert_aws.client('apigateway')
     for job_name, conf in jobs.items():
         # Delete Method
         # Delete Stage
@@ -1254,7 +1263,7 @@ def destroy_api_endpoints(jobs: typing.Dict[str, typing.Any]) -> None:
 
 
 def _find_api(name: str) -> str:
-    api_gateway_client = boto3.client('apigateway')
+    api_gateway_client = bert_aws.client('apigateway')
     for page in api_gateway_client.get_paginator('get_rest_apis').paginate():
         for item in page['items']:
             if item['name'] == name:
@@ -1263,7 +1272,7 @@ def _find_api(name: str) -> str:
     return None
 
 def _find_api_resource_id(rest_api_id: str, parent_id: str, path_part: str) -> str:
-    api_gateway_client = boto3.client('apigateway')
+    api_gateway_client = bert_aws.client('apigateway')
     assert not parent_id is None
     assert not path_part is None
     for page in api_gateway_client.get_paginator('get_resources').paginate(restApiId=rest_api_id):
@@ -1274,7 +1283,7 @@ def _find_api_resource_id(rest_api_id: str, parent_id: str, path_part: str) -> s
     return None
 
 def _create_full_api(job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
-    api_gateway_client = boto3.client('apigateway')
+    api_gateway_client = bert_aws.client('apigateway')
     logger.info(f'Creating API Deployment[{conf["api"]["name"]}]')
     rest_api_response = api_gateway_client.create_rest_api(
         name=conf['api']['name'],
@@ -1307,7 +1316,7 @@ def _create_full_api(job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
             'application/json': 'Empty'
         })
 
-    lambda_client = boto3.client('lambda')
+    lambda_client = bert_aws.client('lambda')
     lambda_arn: str = lambda_client.get_function(FunctionName=job_name)['Configuration']['FunctionArn']
     lambda_uri: str = f'arn:aws:apigateway:{region_name}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations'
     integration_response = api_gateway_client.put_integration(
@@ -1331,7 +1340,7 @@ def _create_full_api(job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
         restApiId=rest_api_response['id'],
         stageName=conf['api']['stage'])
 
-    account_id: str = boto3.client('sts').get_caller_identity().get('Account')
+    account_id: str = bert_aws.client('sts').get_caller_identity().get('Account')
     source_arn = f'arn:aws:execute-api:{region_name}:{account_id}:{rest_api_response["id"]}/*/*/{conf["api"]["path"]}'
     lambda_client.add_permission(
         FunctionName=job_name,
@@ -1342,12 +1351,12 @@ def _create_full_api(job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
 
 
 def _rebuild_api_lambda(job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
-    api_gateway_client = boto3.client('apigateway')
-    lambda_client = boto3.client('lambda')
+    api_gateway_client = bert_aws.client('apigateway')
+    lambda_client = bert_aws.client('lambda')
     rest_api_id = _find_api(conf['api']['name'])
     root_resource = [item for item in api_gateway_client.get_resources(restApiId=rest_api_id)['items'] if item['path'] == '/'][0]
-    region_name: str = boto3.session.Session().region_name
-    account_id: str = boto3.client('sts').get_caller_identity().get('Account')
+    region_name: str = bert_aws.session().region_name
+    account_id: str = bert_aws.client('sts').get_caller_identity().get('Account')
     source_arn = f'arn:aws:execute-api:{region_name}:{account_id}:{rest_api_id}/*/*/{conf["api"]["path"]}'
     lambda_arn: str = lambda_client.get_function(FunctionName=job_name)['Configuration']['FunctionArn']
     lambda_uri: str = f'arn:aws:apigateway:{region_name}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations'
@@ -1377,8 +1386,8 @@ def _rebuild_api_lambda(job_name: str, conf: typing.Dict[str, typing.Any]) -> No
 
 
 def create_api_endpoints(jobs: typing.Dict[str, typing.Any]) -> None:
-    lambda_client = boto3.client('lambda')
-    api_gateway_client = boto3.client('apigateway')
+    lambda_client = bert_aws.client('lambda')
+    api_gateway_client = bert_aws.client('apigateway')
     for job_name, conf in jobs.items():
         if conf['api']['stage'] == None:
             continue
@@ -1392,7 +1401,7 @@ def create_api_endpoints(jobs: typing.Dict[str, typing.Any]) -> None:
 
         stage: str = conf['api']['stage']
         route: str = conf['api']['path']
-        region_name: str = boto3.session.Session().region_name
+        region_name: str = bert_aws.session().region_name
         url: str = f'https://{rest_api_id}.execute-api.{region_name}.amazonaws.com/{stage}/{route}'
         logger.info(f'Deployment Execution URL[{url}]')
 
@@ -1401,7 +1410,7 @@ COGNITO_TRIGGER_KEY_MAP = {
   'pre-token-generation': 'PreTokenGeneration'
 }
 def scan_cognito_integrations(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('cognito-idp')
+    client = bert_aws.client('cognito-idp')
     for job_name, conf in jobs.items():
         user_pool_id = conf['aws-deploy']['cognito']['user_pool_id']
         conf['aws-deployed']['cognito'] = {
@@ -1414,7 +1423,7 @@ def destroy_cognito_integrations(jobs: typing.Dict[str, typing.Any]) -> None:
     pass
 
 def create_cognito_integrations(jobs: typing.Dict[str, typing.Any]) -> None:
-    client = boto3.client('cognito-idp')
+    client = bert_aws.client('cognito-idp')
     logger.info(f'Updating Cognito Trigger')
     time.sleep(2)
     for job_name, conf in jobs.items():
@@ -14,8 +14,8 @@ class IdentityEncoder(json.JSONEncoder):
         if isinstance(obj, datetime):
             return obj.strftime(constants.DATETIME_FORMAT)
 
-        elif hasattr(datum, '_payload') and datum.__class__.__name__ == 'QueueItem':
-            return super(IdentityEncoder, self).default(datum._payload)
+        elif hasattr(obj, '_payload') and obj.__class__.__name__ == 'QueueItem':
+            return obj._payload
 
         return super(IdentityEncoder, self).default(obj)
 
@@ -1,15 +1,23 @@
-import boto3
+import collections
 import hashlib
 import json
 import logging
 import os
+import threading
 import time
 import typing
 
-from bert.etl.constants import BERT_ETL_S3_PREFIX
-from bert.etl.sync_utils import upload_dataset, download_dataset
+from bert import exceptions as bert_exceptions
+from bert.etl.bloom import ScalableBloomFilter
+from bert.etl.columnar import Filter, encode_columnar
+from bert.etl.constants import BERT_ETL_S3_PREFIX, ETL_STATE_SHARD_PREFIX, ETL_TRANSFER_WORKERS, ETL_PREFETCH_PARTS, ETL_PART_ROWS, ETL_PART_BYTES, ETL_UPLOAD_WORKERS, ETL_PART_FORMAT, ETL_API_LIMITER_RECONNECT
+from bert.etl.manifest import DatasetManifest
+from bert.etl.storage import StoredObject, dataset_url, get_storage
+from bert.etl.sync_utils import upload_dataset, download_dataset, iter_records, read_dataset_bytes, resolve_codec, codec_metadata, compress_chunks, encode_record, read_part, CODEC_SUFFIXES, COLUMNAR_SUFFIX
 
-from botocore.exceptions import ClientError
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from datetime import datetime
 
 from urllib.parse import urlparse
 
@@ -18,10 +26,23 @@ logger = logging.getLogger(__name__)
 PWN = typing.TypeVar('PWN')
 ENCODING = 'utf-8'
 RESET_ETL_STATE = True if os.environ.get('RESET_ETL_STATE', '').lower() in ['t', 'true'] else False
-REQUEST_PAYER = 'requester' if os.environ.get('REQUEST_PAYER', '').lower() in ['t', 'true'] else ''
-s3_client = boto3.client('s3')
+
+def _s3_client() -> typing.Any:
+    from bert import aws as bert_aws
+    return bert_aws.client('s3')
+
+def __getattr__(name: str) -> typing.Any:
+    if name == 's3_client':
+        return _s3_client()
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 class ETLState:
+    """
+    Hashes of the items an ETL has seen. Hashes are kept in sets, sharded by their first `shard_prefix` hex characters,
+        and each shard is its own S3 object. Shards are downloaded the first time they're touched and synchronize only
+        uploads the shards that changed.
+    """
     STATE_MODEL = {
       'contains': []
     }
@@ -29,30 +50,105 @@ class ETLState:
         hashed_value = hashlib.sha256(message.encode(ENCODING)).hexdigest()
         return f'{BERT_ETL_S3_PREFIX}/etl-state/{hashed_value}.json'
 
-    def __init__(self: PWN, url: str) -> None:
+    def __init__(self: PWN, url: str, shard_prefix: int = ETL_STATE_SHARD_PREFIX) -> None:
+        # States written before sharding are a single object at _s3_key, shards live under _s3_prefix
         self._s3_key = self._generate_s3_key(url)
-        self._changed = False
+        self._s3_prefix = self._s3_key.rsplit('.json', 1)[0]
+        self._shard_prefix = shard_prefix
+        self._shards: typing.Dict[str, typing.Set[str]] = {}
+        self._remote_shards: typing.Set[str] = set()
+        self._dirty_shards: typing.Set[str] = set()
+        self._stale_s3_keys: typing.List[str] = []
+        self._changes = 0
+        self._synchronized_changes = 0
+
+    def _shard_s3_key(self: PWN, shard: str) -> str:
+        return f'{self._s3_prefix}/{shard}.json'
+
+    def _load_shard(self: PWN, shard: str) -> typing.Set[str]:
+        hashes: typing.Set[str] = self._shards.get(shard, None)
+        if hashes is None:
+            hashes = self._shards[shard] = set()
+            if shard in self._remote_shards:
+                hashes.update(download_dataset(self._shard_s3_key(shard), dataset_url(), dict)['contains'])
+
+        return hashes
+
+    def _add_hash(self: PWN, value_hash: str) -> None:
+        shard: str = value_hash[:self._shard_prefix]
+        hashes: typing.Set[str] = self._load_shard(shard)
+        if not value_hash in hashes:
+            hashes.add(value_hash)
+            self._dirty_shards.add(shard)
+            self._changes += 1
 
     def localize(self: PWN) -> PWN:
+        self._shards = {}
+        self._remote_shards = set()
+        self._dirty_shards = set()
+        self._stale_s3_keys = []
+        self._changes = 0
+        self._synchronized_changes = 0
+        other_widths: typing.List[str] = []
+        for key, size in get_storage().list(f'{self._s3_prefix}/'):
+            shard: str = key[len(self._s3_prefix) + 1:].rsplit('.json', 1)[0]
+            if len(shard) == self._shard_prefix:
+                self._remote_shards.add(shard)
+
+            else:
+                other_widths.append(key)
+
         if RESET_ETL_STATE:
+            self._stale_s3_keys = other_widths + [self._s3_key]
             self.clear()
             return self
 
-        try:
-            self._state = download_dataset(self._s3_key, os.environ['DATASET_BUCKET'], dict)
-        except ClientError:
-            self.clear()
+        # Older layouts, a single object or shards of another width, are folded into this one and removed once the
+        #   new shards are uploaded
+        legacy_s3_keys: typing.List[str] = other_widths[:]
+        if len(self._remote_shards) == 0 and len(other_widths) == 0:
+            legacy_s3_keys.append(self._s3_key)
 
-        else:
-            self._state_hash = self._generate_hash(self._state)
+        for s3_key in legacy_s3_keys:
+            try:
+                legacy_state: typing.Dict[str, typing.Any] = download_dataset(s3_key, dataset_url(), dict)
+            except bert_exceptions.DatasetKeyNotFound:
+                continue
+
+            logger.info(f'Migrating ETLState[{s3_key}] into Shards[{self._s3_prefix}]')
+            for value_hash in legacy_state['contains']:
+                self._add_hash(value_hash)
+
+            self._stale_s3_keys.append(s3_key)
 
         return self
 
     def synchronize(self: PWN) -> None:
-        state_hash = self._generate_hash(self._state)
-        # Check to see if the state hash changed
-        if state_hash != self._state_hash:
-            upload_dataset(self._state, self._s3_key, os.environ['DATASET_BUCKET'])
+        if self._changes == self._synchronized_changes and len(self._stale_s3_keys) == 0:
+            return None
+
+        dirty_shards: typing.List[str] = sorted(self._dirty_shards)
+        def _upload_shard(shard: str) -> None:
+            upload_dataset({'contains': sorted(self._shards[shard])}, self._shard_s3_key(shard), dataset_url())
+
+        if len(dirty_shards) > 0:
+            with ThreadPoolExecutor(max_workers=min(ETL_TRANSFER_WORKERS, len(dirty_shards))) as executor:
+                try:
+                    uploads: typing.List[Future] = [executor.submit(_upload_shard, shard) for shard in dirty_shards]
+                except RuntimeError:
+                    # Threads can't be started once the interpreter is shutting down, a synchronize from an exit hook
+                    #   uploads the shards one at a time instead
+                    uploads = [None for shard in dirty_shards]
+
+                for shard, upload in zip(dirty_shards, uploads):
+                    _upload_shard(shard) if upload is None else upload.result()
+
+        self._remote_shards.update(dirty_shards)
+        self._dirty_shards = set()
+        self._synchronized_changes = self._changes
+        if len(self._stale_s3_keys) > 0:
+            get_storage().delete(self._stale_s3_keys)
+            self._stale_s3_keys = []
 
     def _generate_hash(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float]) -> bool:
         if isinstance(datum, (list, dict)):
@@ -70,56 +166,265 @@ class ETLState:
 
     def contain(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> str:
         value_hash = self._generate_hash(datum)
-        if not value_hash in self._state['contains']:
-            self._state['contains'].append(value_hash)
-
+        self._add_hash(value_hash)
         return value_hash
 
     def contains(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> bool:
         value_hash = self._generate_hash(datum)
-        return value_hash in self._state['contains']
+        return value_hash in self._load_shard(value_hash[:self._shard_prefix])
 
     def clear(self: PWN) -> None:
-        self._state = self.STATE_MODEL.copy()
-        self._state_hash = self._generate_hash(self._state)
+        self._shards = {shard: set() for shard in self._remote_shards}
+        self._dirty_shards = set(self._remote_shards)
+        self._changes += 1
+
+class ProbabilisticETLState(ETLState):
+    """
+    ETLState answering from a scalable Bloom filter, a compact binary object small enough to download into a Lambda.
+        With `exact=True` a positive answer is confirmed against the exact shards, which are only downloaded on a
+        hit, and new hashes are merged into their shards on synchronize. With `exact=False` the state stores the filter
+        only and `contains` may answer True for an item never seen, at `false_positive_rate`.
+    """
+    def __init__(self: PWN, url: str, false_positive_rate: float = .001, exact: bool = True, initial_capacity: int = 100000, shard_prefix: int = ETL_STATE_SHARD_PREFIX) -> None:
+        super(ProbabilisticETLState, self).__init__(url, shard_prefix)
+        self._bloom_s3_key = f'{self._s3_prefix}.bloom'
+        self._false_positive_rate = false_positive_rate
+        self._exact = exact
+        self._initial_capacity = initial_capacity
+        self._bloom_filter = ScalableBloomFilter(false_positive_rate, initial_capacity)
+        self._bloom_changed = False
+        self._pending: typing.Dict[str, typing.Set[str]] = {}
 
-class ETLDataset:
-    def _clear_datasets(self: PWN):
-        keys = []
-        for page_idx, page in enumerate(s3_client.get_paginator('list_objects_v2').paginate(Bucket=os.environ['DATASET_BUCKET'], RequestPayer=REQUEST_PAYER, Prefix=self._prefix)):
-            keys.extend([content['Key'] for content in page.get('Contents', [])])
+    def localize(self: PWN) -> PWN:
+        self._pending = {}
+        self._bloom_changed = False
+        self._bloom_filter = None
+        if not RESET_ETL_STATE:
+            try:
+                body: typing.Union[bytes, typing.BinaryIO] = read_dataset_bytes(self._bloom_s3_key, dataset_url())
+            except bert_exceptions.DatasetKeyNotFound:
+                pass
 
-        if len(keys) > 0:
-            logger.info(f'Deleting keys[{len(keys)}] from Dataset[{self._hashed_message}]')
-            s3_client.delete_objects(
-                    Bucket=os.environ['DATASET_BUCKET'],
-                    Delete={
-                        'Objects': [{'Key': key} for key in keys]
-                    },
-                    RequestPayer=REQUEST_PAYER)
+            else:
+                self._bloom_filter = ScalableBloomFilter.Deserialize(bytes(body), self._initial_capacity)
 
-        self._state.clear()
+        if self._bloom_filter is None:
+            # No filter yet. Exact states written by ETLState, or before sharding, are folded into a new one
+            self._bloom_filter = ScalableBloomFilter(self._false_positive_rate, self._initial_capacity)
+            super(ProbabilisticETLState, self).localize()
+            for shard in sorted(self._remote_shards):
+                for value_hash in self._load_shard(shard):
+                    self._bloom_filter.add(value_hash)
 
-    def _generate_next_s3_key(self: PWN) -> str:
-        last_index = -1
-        for page_idx, page in enumerate(s3_client.get_paginator('list_objects_v2').paginate(Bucket=os.environ['DATASET_BUCKET'], RequestPayer=REQUEST_PAYER, Prefix=self._prefix)):
-            for content in page.get('Contents', []):
-                content_index = int(content['Key'].replace(self._prefix, '').strip('/').rsplit('.json', 1)[0])
-                if content_index > last_index:
-                    last_index = content_index
+                self._bloom_changed = True
+                self._changes += 1
 
-        else:
-            if last_index < 0:
-                return f'{self._prefix}/0.json'
+            # Only the filter is kept in memory. Dirty shards stay, a reset or a migration still has to write them
+            self._shards = {shard: hashes for shard, hashes in self._shards.items() if shard in self._dirty_shards}
+
+        elif self._exact:
+            super(ProbabilisticETLState, self).localize()
+
+        if not self._exact:
+            # Never remove exact state the filter was built from
+            self._stale_s3_keys = []
+
+        return self
+
+    def _add_hash(self: PWN, value_hash: str) -> None:
+        if self._bloom_filter.add(value_hash):
+            self._bloom_changed = True
+            self._changes += 1
+
+        if not self._exact:
+            return None
+
+        shard: str = value_hash[:self._shard_prefix]
+        if shard in self._shards.keys():
+            return super(ProbabilisticETLState, self)._add_hash(value_hash)
+
+        # The shard stays remote until synchronize merges the new hashes into it
+        pending: typing.Set[str] = self._pending.setdefault(shard, set())
+        if not value_hash in pending:
+            pending.add(value_hash)
+            self._dirty_shards.add(shard)
+            self._changes += 1
+
+    def contains(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> bool:
+        value_hash = self._generate_hash(datum)
+        if not value_hash in self._bloom_filter:
+            return False
+
+        if not self._exact:
+            return True
+
+        shard: str = value_hash[:self._shard_prefix]
+        return value_hash in self._pending.get(shard, ()) or value_hash in self._load_shard(shard)
+
+    def synchronize(self: PWN) -> None:
+        if self._changes == self._synchronized_changes and len(self._stale_s3_keys) == 0:
+            return None
+
+        if self._exact:
+            for shard, pending in self._pending.items():
+                self._load_shard(shard).update(pending)
+
+            self._pending = {}
+            super(ProbabilisticETLState, self).synchronize()
+
+        if self._bloom_changed:
+            get_storage().put(self._bloom_s3_key, self._bloom_filter.serialize())
+            self._bloom_changed = False
+
+        self._synchronized_changes = self._changes
+
+    def clear(self: PWN) -> None:
+        self._bloom_filter = ScalableBloomFilter(self._false_positive_rate, self._initial_capacity)
+        self._bloom_changed = True
+        self._pending = {}
+        super(ProbabilisticETLState, self).clear()
+
+class WatermarkETLState:
+    """
+    High-water marks of the sources an ETL extracts from, instead of every item it has seen. A watermark is a timestamp
+        (datetime), a sequence number (int or float) or an opaque cursor token (str). Extractors ask for the watermark,
+        or filter items with `is_after`, and `advance` it as they go. Advanced watermarks become visible to `watermark`
+        only once synchronize has written them, with a conditional write so two runs never overwrite each other.
+
+    with WatermarkETLState('https://api.example.com/v1/events') as state:
+        for event in fetch_events(since=state.watermark('events')):
+            ...
+            state.advance('events', event['created'])
+    """
+    def __init__(self: PWN, url: str) -> None:
+        hashed_value = hashlib.sha256(url.encode(ENCODING)).hexdigest()
+        self._s3_key = f'{BERT_ETL_S3_PREFIX}/etl-state/{hashed_value}.watermarks.json'
+        self._committed: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._pending: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._etag: str = None
+
+    @staticmethod
+    def _encode_watermark(value: typing.Union[datetime, int, float, str]) -> typing.Dict[str, typing.Any]:
+        if isinstance(value, datetime):
+            return {'kind': 'timestamp', 'value': value.isoformat()}
+
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            return {'kind': 'sequence', 'value': value}
+
+        elif isinstance(value, str):
+            return {'kind': 'cursor', 'value': value}
+
+        raise NotImplementedError(value.__class__)
+
+    @staticmethod
+    def _decode_watermark(watermark: typing.Dict[str, typing.Any]) -> typing.Union[datetime, int, float, str]:
+        if watermark['kind'] == 'timestamp':
+            return datetime.fromisoformat(watermark['value'])
+
+        return watermark['value']
+
+    def _merge(self: PWN, remote: typing.Dict[str, typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        merged: typing.Dict[str, typing.Dict[str, typing.Any]] = dict(remote)
+        for source, watermark in self._pending.items():
+            theirs: typing.Dict[str, typing.Any] = remote.get(source, None)
+            ours_committed: typing.Dict[str, typing.Any] = self._committed.get(source, None)
+            if theirs is None or theirs == ours_committed:
+                merged[source] = watermark
+
+            elif watermark['kind'] == 'cursor' or theirs['kind'] != watermark['kind']:
+                raise bert_exceptions.ETLStateConflict(f'Watermark[{source}] was advanced by another run')
 
             else:
-                next_index = last_index + 1
-                return f'{self._prefix}/{next_index}.json'
+                merged[source] = max([theirs, watermark], key=self._decode_watermark)
+
+        return merged
+
+    def _download(self: PWN) -> typing.Tuple[typing.Dict[str, typing.Dict[str, typing.Any]], str]:
+        try:
+            stored: StoredObject = get_storage().get(self._s3_key)
+        except bert_exceptions.DatasetKeyNotFound:
+            return {}, None
+
+        return json.loads(bytes(stored.body).decode(ENCODING))['watermarks'], stored.etag
+
+    def localize(self: PWN) -> PWN:
+        if RESET_ETL_STATE:
+            self._committed, self._etag = {}, self._download()[1]
+
+        else:
+            self._committed, self._etag = self._download()
+
+        self._pending = {}
+        return self
+
+    def synchronize(self: PWN, retries: int = 5) -> None:
+        if len(self._pending) == 0:
+            return None
+
+        remote: typing.Dict[str, typing.Dict[str, typing.Any]] = self._committed
+        for idx in range(0, retries):
+            merged: typing.Dict[str, typing.Dict[str, typing.Any]] = self._merge(remote)
+            try:
+                etag: str = get_storage().put(
+                    self._s3_key,
+                    json.dumps({'watermarks': merged}).encode(ENCODING),
+                    if_none_match=self._etag is None,
+                    if_match=self._etag)
+            except bert_exceptions.DatasetPreconditionFailed:
+                logger.info(f'Watermarks[{self._s3_key}] changed remotely, merging')
+                remote, self._etag = self._download()
+                continue
+
+            self._committed, self._etag, self._pending = merged, etag, {}
+            return None
+
+        raise bert_exceptions.ETLStateConflict(f'Unable to synchronize Watermarks[{self._s3_key}] after Retries[{retries}]')
+
+    def watermark(self: PWN, source: str, default: typing.Any = None) -> typing.Union[datetime, int, float, str]:
+        watermark: typing.Dict[str, typing.Any] = self._committed.get(source, None)
+        return default if watermark is None else self._decode_watermark(watermark)
 
-    def __init__(self: PWN, message: str) -> None:
+    def is_after(self: PWN, source: str, value: typing.Union[datetime, int, float]) -> bool:
+        watermark: typing.Any = self.watermark(source)
+        return watermark is None or value > watermark
+
+    def advance(self: PWN, source: str, value: typing.Union[datetime, int, float, str]) -> None:
+        """
+        Timestamps and sequence numbers only move forward, cursors are replaced
+        """
+        watermark: typing.Dict[str, typing.Any] = self._encode_watermark(value)
+        current: typing.Dict[str, typing.Any] = self._pending.get(source, self._committed.get(source, None))
+        if current is None or watermark['kind'] == 'cursor' or current['kind'] != watermark['kind'] or value > self._decode_watermark(current):
+            self._pending[source] = watermark
+
+    def __enter__(self: PWN) -> PWN:
+        return self.localize()
+
+    def __exit__(self: PWN, exception_type, exception_value, traceback) -> None:
+        # Watermarks only advance when the block succeeded
+        if exception_value is None:
+            self.synchronize()
+
+class ETLDataset:
+    def _clear_datasets(self: PWN):
+        keys = [key for key, size in get_storage().list(self._prefix)]
+        if len(keys) > 0:
+            logger.info(f'Deleting keys[{len(keys)}] from Dataset[{self._hashed_message}]')
+            get_storage().delete(keys)
+
+        self._state.clear()
+
+    def __init__(self: PWN, message: str, part_rows: int = ETL_PART_ROWS, part_bytes: int = ETL_PART_BYTES, upload_workers: int = ETL_UPLOAD_WORKERS, part_format: str = ETL_PART_FORMAT) -> None:
         self._state = ETLState(message)
         self._hashed_message = hashlib.sha256(message.encode(ENCODING)).hexdigest()
         self._prefix = f'{BERT_ETL_S3_PREFIX}/etl-dataset/{self._hashed_message}'
+        self._part_rows = max(1, part_rows)
+        self._part_bytes = max(1, part_bytes)
+        self._upload_workers = max(1, upload_workers)
+        if not part_format in ['ndjson', 'columnar']:
+            raise NotImplementedError(f'Unknown PartFormat[{part_format}]')
+
+        self._part_format = part_format
 
     def __enter__(self: PWN) -> PWN:
         self.localize()
@@ -128,92 +433,227 @@ class ETLDataset:
 
     def __exit__(self: PWN, one, two, three) -> None:
         self.synchronize()
-        self._state.synchronize()
 
     def localize(self: PWN) -> None:
         self._update = False
-        self._dataset = []
+        self._first_part = True
+        self._codec = resolve_codec()
+        self._lines: typing.List[bytes] = []
+        self._lines_size = 0
+        self._part_hashes: typing.List[str] = []
+        # Hashes of rows written to a part that isn't committed to ETLState yet
+        self._pending_hashes: typing.Set[str] = set()
+        self._uploads: typing.Deque[typing.Tuple[Future, typing.List[str]]] = collections.deque()
+        self._executor: ThreadPoolExecutor = None
+        self._manifest = DatasetManifest(self._prefix, dataset_url())
+
+    def _encode_part(self: PWN, lines: typing.List[bytes]) -> typing.Tuple[bytes, str, str]:
+        if self._part_format == 'columnar':
+            records: typing.List[typing.Any] = [json.loads(line) for line in lines]
+            if all([isinstance(record, dict) for record in records]):
+                return encode_columnar(records, self._codec), COLUMNAR_SUFFIX[1:], 'columnar'
+
+            logger.warning(f'Dataset[{self._hashed_message}] has rows that are not dicts, writing the part as ndjson')
+
+        return b''.join(compress_chunks(lines, self._codec)), f'ndjson{CODEC_SUFFIXES[self._codec]}', 'ndjson'
+
+    def _upload_part(self: PWN, lines: typing.List[bytes], index: int) -> typing.Dict[str, typing.Any]:
+        body, suffix, part_format = self._encode_part(lines)
+        # Each upload has its own manifest, conditional writes add the parts of concurrent uploads. The index was
+        #   reserved by flush, so parts are indexed in the order they were flushed in
+        manifest: DatasetManifest = DatasetManifest(self._prefix, dataset_url()).load()
+        return manifest.put_part(body, len(lines), hashlib.sha256(body).hexdigest(), suffix, codec_metadata(self._codec, part_format), index=index)
+
+    def _commit_parts(self: PWN, in_flight: int) -> None:
+        """
+        Commit uploaded parts to ETLState, oldest first, blocking until no more than `in_flight` uploads are left. The
+            state is synchronized after each part, so a timeout only loses the part that was in progress
+        """
+        while len(self._uploads) > 0 and (self._uploads[0][0].done() or len(self._uploads) > in_flight):
+            upload, part_hashes = self._uploads.popleft()
+            part: typing.Dict[str, typing.Any] = upload.result()
+            for value_hash in part_hashes:
+                self._state._add_hash(value_hash)
+                self._pending_hashes.discard(value_hash)
 
-    def synchronize(self: PWN) -> None:
-        if len(self._dataset) == 0:
+            logger.info(f'Uploaded Dataset[{part["key"]}] Rows[{part["rows"]}]')
+            self._state.synchronize()
+
+    def flush(self: PWN) -> None:
+        """
+        Hand the part in progress to a background upload and start a new one
+        """
+        if len(self._lines) == 0:
             return None
 
-        if self._update is True:
-            s3_key = f'{self._prefix}/0.json'
+        if self._first_part is True and self._update is True:
             self._clear_datasets()
-            upload_dataset(self._dataset, s3_key, os.environ['DATASET_BUCKET'])
+            self._manifest.reset()
 
-        else:
-            s3_key = self._generate_next_s3_key()
-            upload_dataset(self._dataset, s3_key, os.environ['DATASET_BUCKET'])
+        elif self._first_part is True:
+            self._manifest.load()
+
+        self._first_part = False
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._upload_workers)
+
+        # Parts are encoded on the upload threads too
+        index: int = self._manifest.reserve_index()
+        self._uploads.append((self._executor.submit(self._upload_part, self._lines, index), self._part_hashes))
+        self._lines, self._lines_size, self._part_hashes = [], 0, []
+        self._commit_parts(self._upload_workers)
+
+    def synchronize(self: PWN) -> None:
+        self.flush()
+        try:
+            self._commit_parts(0)
+        finally:
+            if not self._executor is None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+        self._state.synchronize()
 
     def contains(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> bool:
-        return self._state.contains(datum)
+        return self._state.contains(datum) or self._state._generate_hash(datum) in self._pending_hashes
+
+    def _append(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float]) -> None:
+        value_hash: str = self._state._generate_hash(datum)
+        line: bytes = encode_record(datum)
+        self._part_hashes.append(value_hash)
+        self._pending_hashes.add(value_hash)
+        self._lines.append(line)
+        self._lines_size += len(line)
+        if len(self._lines) >= self._part_rows or self._lines_size >= self._part_bytes:
+            self.flush()
 
     def add(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> bool:
-        self._state.contain(datum)
         self._update = False
-        self._dataset.append(datum)
+        self._append(datum)
 
     def update(self: PWN, datum: typing.Union[typing.Dict[str, typing.Any], typing.List[typing.Any], str, int, float], *hash_keys: typing.List[str]) -> bool:
         """"
-        Update takes the dataset and only manages one s3_key for the dataset. Rather than generating new s3_keys for each addition to the dataset
+        Update replaces the dataset rather than adding parts to it. The existing parts are cleared before the first part of this update is written
         """
-        self._state.contain(datum)
         self._update = True
-        self._dataset.append(datum)
+        self._append(datum)
 
 class ETLDatasetReaderIterator:
-    def __init__(self: PWN, collection: typing.List[str]) -> None:
+    """
+    Rows of the parts in `collection`, in order. The next `prefetch` parts download on a thread pool while the current
+        one is consumed, and rows are parsed one at a time as they're served. `columns` and `filters` are pushed down
+        to columnar parts and applied row by row to the others.
+    """
+    def __init__(self: PWN, collection: typing.List[str], prefetch: int = ETL_PREFETCH_PARTS, columns: typing.List[str] = None, filters: typing.List[Filter] = []) -> None:
         self._collection = collection
-        self._local_collection = []
-        self._idx = -1
-        self._max_idx = len(collection) - 1
-
-    def __iter__(self: PWN) -> str:
-        import pdb; pdb.set_trace()
+        self._columns = columns
+        self._filters = filters
+        self._prefetch = max(1, prefetch)
+        self._idx = 0
+        self._downloads: typing.Deque[Future] = collections.deque()
+        self._executor: ThreadPoolExecutor = None
+        self._rows: typing.Iterator[typing.Any] = iter(())
+
+    def __iter__(self: PWN) -> PWN:
         return self
 
+    def _schedule_downloads(self: PWN) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._prefetch)
+
+        while len(self._downloads) < self._prefetch and self._idx < len(self._collection):
+            self._downloads.append(self._executor.submit(read_part, self._collection[self._idx], dataset_url(), self._columns, self._filters))
+            self._idx += 1
+
+    def close(self: PWN) -> None:
+        for download in self._downloads:
+            download.cancel()
+
+        self._downloads.clear()
+        if not self._executor is None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
     def __next__(self: PWN) -> typing.Dict[str, typing.Any]:
         while True:
-            if len(self._local_collection) == 0:
-                self._idx += 1
-                try:
-                    s3_key = self._collection[self._idx]
-                except IndexError:
-                    raise StopIteration
+            try:
+                return next(self._rows)
+            except StopIteration:
+                pass
+
+            self._schedule_downloads()
+            if len(self._downloads) == 0:
+                self.close()
+                raise StopIteration
 
-                self._local_collection.extend(download_dataset(s3_key, os.environ['DATASET_BUCKET'], list))
+            self._rows = iter(self._downloads.popleft().result())
 
-            if len(self._local_collection) == 0:
-                raise StopIteration
 
-            return self._local_collection.pop(0)
+def shard_of(s3_key: str, shard_count: int) -> int:
+    """
+    The shard a part belongs to. Hashing its key keeps the assignment stable while parts are appended to the dataset
+    """
+    return int(hashlib.sha256(s3_key.encode(ENCODING)).hexdigest()[:8], 16) % shard_count
+
+def split_parts(parts: typing.List[typing.Dict[str, typing.Any]], count: int) -> typing.List[typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    Contiguous ranges of `parts`, in the order given, of about the same size in bytes. Ranges are never empty, so
+        there may be fewer than `count`
+    """
+    total: int = sum([part['size'] or 0 for part in parts])
+    ranges: typing.List[typing.List[typing.Dict[str, typing.Any]]] = [[]]
+    consumed: int = 0
+    for part in parts:
+        # Start the next range once the ranges so far hold their share of the bytes
+        if len(ranges[-1]) > 0 and len(ranges) < count and consumed >= total * len(ranges) / count:
+            ranges.append([])
 
+        ranges[-1].append(part)
+        consumed += part['size'] or 0
+
+    return [part_range for part_range in ranges if len(part_range) > 0]
 
 class ETLDatasetReader:
-    def __init__(self: PWN, message: str) -> None:
+    """
+    Rows of an ETLDataset. A reader can be limited to a slice of the dataset so several workers read it in parallel,
+        either with `shard_index` and `shard_count`, where each worker reads the parts whose key hashes to its index,
+        or with explicit `part_keys` from ETLReference.split. Only `columns` of rows matching every one of `filters`,
+        (column, operator, value) tuples, are read.
+    """
+    def __init__(self: PWN, message: str, shard_index: int = None, shard_count: int = None, part_keys: typing.List[str] = None, columns: typing.List[str] = None, filters: typing.List[Filter] = []) -> None:
         self._state = ETLState(message)
         self._hashed_message = hashlib.sha256(message.encode(ENCODING)).hexdigest()
         self._prefix = f'{BERT_ETL_S3_PREFIX}/etl-dataset/{self._hashed_message}'
         self._message = message
+        if not shard_count is None and not 0 <= (shard_index or 0) < shard_count:
+            raise NotImplementedError(f'Invalid Shard[{shard_index}] of ShardCount[{shard_count}]')
+
+        self._shard_index = shard_index
+        self._shard_count = shard_count
+        self._part_keys = part_keys
+        self._columns = columns
+        self._filters = filters
 
     def __enter__(self: PWN) -> PWN:
         self.consolidate()
         return self
 
     def __exit__(self: PWN, one, two, three) -> None:
-        pass
+        self._iterator.close()
 
     def consolidate(self: PWN) -> None:
-        s3_keys = []
-        for page_idx, page in enumerate(s3_client.get_paginator('list_objects_v2').paginate(Bucket=os.environ['DATASET_BUCKET'], RequestPayer=REQUEST_PAYER, Prefix=self._prefix)):
-            for content in page.get('Contents', []):
-                content_index = int(content['Key'].replace(self._prefix, '').strip('/').rsplit('.json', 1)[0])
-                s3_keys.append([content_index, content['Key']])
+        if not self._part_keys is None:
+            # A split is a snapshot of the manifest, its parts are read even if compaction has retired them since
+            self._parts = [{'key': s3_key} for s3_key in self._part_keys]
 
-        self._consolidated_s3_keys = [s3_key for s3_key_index, s3_key in sorted(s3_keys, key=lambda x: x[0], reverse=True)]
-        self._iterator = ETLDatasetReaderIterator(self._consolidated_s3_keys[:])
+        else:
+            manifest: DatasetManifest = DatasetManifest(self._prefix, dataset_url()).load()
+            self._parts = sorted(manifest.parts, key=lambda part: part['index'], reverse=True)
+            if not self._shard_count is None:
+                self._parts = [part for part in self._parts if shard_of(part['key'], self._shard_count) == (self._shard_index or 0)]
+
+        self._consolidated_s3_keys = [part['key'] for part in self._parts]
+        self._iterator = ETLDatasetReaderIterator(self._consolidated_s3_keys[:], columns=self._columns, filters=self._filters)
 
     def __iter__(self: PWN) -> typing.Any:
         return self._iterator
@@ -225,7 +665,7 @@ class ETLDatasetReader:
     @classmethod
     def Serialize(cls: '_class_type', dataset_reader: PWN) -> typing.Dict[str, str]:
         _class_path = f'{cls.__module__}.{cls.__name__}'
-        return {'message': dataset_reader._message, cls.REF_KEY: _class_path}
+        return _serialize_shard({'message': dataset_reader._message, cls.REF_KEY: _class_path}, dataset_reader)
 
     @classmethod
     def Deserialize(cls: '_class_type', datum: typing.Dict[str, str]) -> PWN:
@@ -233,22 +673,51 @@ class ETLDatasetReader:
         if datum.get(cls.REF_KEY, None) != _class_path:
             raise NotImplementedError
 
-        return cls(datum['message'])
+        return cls(datum['message'], datum.get('shard-index', None), datum.get('shard-count', None), datum.get('part-keys', None))
+
+def _serialize_shard(datum: typing.Dict[str, typing.Any], reader_or_reference: typing.Any) -> typing.Dict[str, typing.Any]:
+    # Only sliced readers carry their shard, so payloads of whole datasets are unchanged
+    if not reader_or_reference._shard_count is None:
+        datum['shard-index'] = reader_or_reference._shard_index or 0
+        datum['shard-count'] = reader_or_reference._shard_count
+
+    if not reader_or_reference._part_keys is None:
+        datum['part-keys'] = reader_or_reference._part_keys
 
+    return datum
 
 class ETLReference:
     """ We may need to track this through the process to make sure it doesn't create a memory leak """
     REF_KEY: str = '_class_path_ref'
-    def __init__(self: PWN, message: str) -> None:
+    def __init__(self: PWN, message: str, shard_index: int = None, shard_count: int = None, part_keys: typing.List[str] = None) -> None:
         self._message = message
+        self._shard_index = shard_index
+        self._shard_count = shard_count
+        self._part_keys = part_keys
 
     def resolve(self: PWN) -> ETLDataset:
-        return ETLDatasetReader(self._message)
+        return ETLDatasetReader(self._message, self._shard_index, self._shard_count, self._part_keys)
+
+    def shard(self: PWN, shard_count: int) -> typing.List['ETLReference']:
+        """
+        One reference per shard index, to fan a dataset out over `shard_count` workers without reading its manifest
+        """
+        return [self.__class__(self._message, shard_index, shard_count) for shard_index in range(0, shard_count)]
+
+    def split(self: PWN, count: int) -> typing.List['ETLReference']:
+        """
+        References to at most `count` ranges of parts of about the same size, to be put on a queue as one work item
+            each. Their part keys are fixed, so parts appended later aren't picked up by any of them
+        """
+        reader: ETLDatasetReader = self.resolve()
+        reader.consolidate()
+        reader._iterator.close()
+        return [self.__class__(self._message, part_keys=[part['key'] for part in part_range]) for part_range in split_parts(reader._parts, count)]
 
     @classmethod
     def Serialize(cls: '_class_type', reference: PWN) -> typing.Dict[str, str]:
         _class_path = f'{cls.__module__}.{cls.__name__}'
-        return {'message': reference._message, cls.REF_KEY: _class_path}
+        return _serialize_shard({'message': reference._message, cls.REF_KEY: _class_path}, reference)
 
     @classmethod
     def Deserialize(cls: '_class_type', datum: typing.Dict[str, str]) -> PWN:
@@ -256,24 +725,155 @@ class ETLReference:
         if datum.get(cls.REF_KEY, None) != _class_path:
             raise NotImplementedError
 
-        return cls(datum['message'])
+        return cls(datum['message'], datum.get('shard-index', None), datum.get('shard-count', None), datum.get('part-keys', None))
+
+
+# Reserves `requested` tokens and returns how long the caller has to wait for them. The bucket may go negative, so
+#   waiting callers queue up behind each other instead of retrying. TIME keeps every host on the Redis clock. Before
+#   Redis 5 a script may only write after TIME once it replicates its effects instead of itself, from Redis 5 on that
+#   is the default and replicate_commands does nothing
+_TOKEN_BUCKET_SCRIPT: str = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - requested
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+class LocalTokenBucket:
+    """
+    Token bucket shared by the threads of one process. APILimiter falls back to it when Redis can't be reached
+    """
+    def __init__(self: PWN, rate: float, burst: float) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self: PWN, requested: float = 1) -> float:
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + max(0, now - self._ts) * self._rate) - requested
+            self._ts = now
+            return 0 if self._tokens >= 0 else -self._tokens / self._rate
 
 
 class APILimiter:
-    def __init__(self: PWN, url: str, delay: float) -> None:
+    """
+    Rate limit calls to an API across every process and host sharing REDIS_URL. `delay` is the time between calls, so
+        the bucket refills at 1 / delay tokens per second, and `burst` is how many calls may run back to back. A
+        `delay` of 0 doesn't limit calls at all
+
+    with APILimiter('https://api.example.com/v1/', .5, burst=5) as limiter:
+        for item in work_queue:
+            limiter.delay()
+            ...
+    """
+    def __init__(self: PWN, url: str, delay: float, burst: float = 1, redis_url: str = None) -> None:
         self._delay = delay
         self._netloc = urlparse(url).netloc
+        self._rate = None if delay <= 0 else 1.0 / delay
+        self._burst = burst
+        self._redis_url = redis_url
+        self._key = f'bert-etl-api-limiter:{self._netloc}'
+        self._script = None
+        self._local = None
+        self._reconnect_at = 0.0
+        self._reconnect_delay = 1.0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._calls = 0
+
+    def _fallback(self: PWN) -> None:
+        # The local bucket is kept between reconnects, so its tokens aren't handed out again after every failed one
+        self._script = None
+        if self._local is None:
+            self._local = LocalTokenBucket(self._rate, self._burst)
+
+        self._reconnect_at = time.monotonic() + self._reconnect_delay
+        self._reconnect_delay = min(self._reconnect_delay * 2, ETL_API_LIMITER_RECONNECT)
+
+    def _connect(self: PWN) -> None:
+        from bert import constants as bert_constants, datasource as bert_datasource
+        if self._rate is None:
+            return None
+
+        try:
+            client = bert_datasource.RedisConnection.ParseURL(self._redis_url or bert_constants.REDIS_URL).client()
+            client.ping()
+            self._script = client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+        except Exception as err:
+            logger.warning(f'Unable to reach Redis for API[{self._netloc}], limiting this process only: {err}')
+            self._fallback()
 
-    def delay(self: PWN) -> None:
-        logger.info(f'Delaying[{self._delay}] api execution for API[{self._netloc}]')
-        time.sleep(self._delay)
+        else:
+            if not self._local is None:
+                logger.info(f'Reconnected to Redis for API[{self._netloc}]')
+
+            self._local = None
+            self._reconnect_delay = 1.0
+
+    def _reserve(self: PWN, requested: float) -> float:
+        if self._rate is None:
+            return 0
+
+        if self._script is None and (self._local is None or time.monotonic() >= self._reconnect_at):
+            self._connect()
+
+        if not self._script is None:
+            try:
+                return float(self._script(keys=[self._key], args=[self._rate, self._burst, requested]))
+
+            except Exception as err:
+                logger.warning(f'Lost Redis for API[{self._netloc}], limiting this process only: {err}')
+                self._fallback()
+
+        return self._local.reserve(requested)
+
+    def delay(self: PWN, requested: float = 1) -> float:
+        wait: float = self._reserve(requested)
+        self._calls += 1
+        if wait > 0:
+            logger.info(f'Delaying[{wait:.3f}] api execution for API[{self._netloc}]')
+            self._wait_count += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            time.sleep(wait)
+
+        return wait
+
+    def metrics(self: PWN) -> typing.Dict[str, typing.Any]:
+        return {
+            'netloc': self._netloc,
+            'calls': self._calls,
+            'waits': self._wait_count,
+            'wait-total': self._wait_total,
+            'wait-max': self._wait_max,
+            'wait-mean': self._wait_total / self._wait_count if self._wait_count > 0 else 0.0,
+            'distributed': not self._script is None,
+        }
 
     def __enter__(self: PWN) -> PWN:
-        # Connect to networked resources to manage across processes
+        self._connect()
         return self
 
     def __exit__(self: PWN, one, two, three) -> None:
-        # Disconnect
-        pass
-
+        metrics: typing.Dict[str, typing.Any] = self.metrics()
+        logger.info(f'API[{self._netloc}] Calls[{metrics["calls"]}] Waits[{metrics["waits"]}] Wait Total[{metrics["wait-total"]:.3f}] Wait Max[{metrics["wait-max"]:.3f}]')
 
@@ -0,0 +1,105 @@
+import math
+import struct
+import typing
+import zlib
+
+PWN = typing.TypeVar('PWN')
+_HEADER = struct.Struct('>4sBdI')
+_FILTER_HEADER = struct.Struct('>QQQId')
+_MAGIC: bytes = b'BBLM'
+_VERSION: int = 1
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over sha256 hex digests. Bit positions come from double hashing two 64 bit words of the
+        digest, so an item is hashed once no matter how many bits it sets
+    """
+    def __init__(self: PWN, capacity: int, false_positive_rate: float, count: int = 0, bits: bytearray = None) -> None:
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.count = count
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8) if bits is None else bits
+
+    def _positions(self: PWN, value_hash: str) -> typing.Iterator[int]:
+        first, second = int(value_hash[:16], 16), int(value_hash[16:32], 16) | 1
+        for idx in range(self.num_hashes):
+            yield (first + idx * second) % self.num_bits
+
+    def __contains__(self: PWN, value_hash: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value_hash))
+
+    def add(self: PWN, value_hash: str) -> None:
+        for position in self._positions(value_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    @property
+    def full(self: PWN) -> bool:
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filters chained as they fill up, after Almeida et al. Each new filter holds `growth` times more items with a
+        tighter error rate, so the combined false positive rate stays under `false_positive_rate`
+    """
+    def __init__(self: PWN, false_positive_rate: float = .001, initial_capacity: int = 100000, growth: int = 2, tightening: float = .5) -> None:
+        self.false_positive_rate = false_positive_rate
+        self.initial_capacity = initial_capacity
+        self.growth = growth
+        self.tightening = tightening
+        self.filters: typing.List[BloomFilter] = []
+
+    def __contains__(self: PWN, value_hash: str) -> bool:
+        return any(value_hash in bloom_filter for bloom_filter in self.filters)
+
+    def __len__(self: PWN) -> int:
+        return sum(bloom_filter.count for bloom_filter in self.filters)
+
+    def add(self: PWN, value_hash: str) -> bool:
+        """
+        Returns False when the value_hash was already (probably) present
+        """
+        if value_hash in self:
+            return False
+
+        if len(self.filters) == 0 or self.filters[-1].full:
+            idx: int = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * (self.growth ** idx),
+                self.false_positive_rate * (1 - self.tightening) * (self.tightening ** idx)))
+
+        self.filters[-1].add(value_hash)
+        return True
+
+    def serialize(self: PWN) -> bytes:
+        blob: typing.List[bytes] = [_HEADER.pack(_MAGIC, _VERSION, self.false_positive_rate, len(self.filters))]
+        for bloom_filter in self.filters:
+            blob.append(_FILTER_HEADER.pack(bloom_filter.capacity, bloom_filter.count, len(bloom_filter.bits), self.growth, self.tightening))
+            blob.append(bytes(bloom_filter.bits))
+
+        return zlib.compress(b''.join(blob))
+
+    @classmethod
+    def Deserialize(cls: PWN, blob: bytes, initial_capacity: int = 100000) -> PWN:
+        blob = zlib.decompress(blob)
+        magic, version, false_positive_rate, filter_count = _HEADER.unpack_from(blob, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise NotImplementedError(f'Unknown Bloom Filter Version[{version}]')
+
+        scalable_filter: ScalableBloomFilter = cls(false_positive_rate, initial_capacity)
+        offset: int = _HEADER.size
+        for idx in range(filter_count):
+            capacity, count, bits_length, growth, tightening = _FILTER_HEADER.unpack_from(blob, offset)
+            offset += _FILTER_HEADER.size
+            bits: bytearray = bytearray(blob[offset:offset + bits_length])
+            offset += bits_length
+            if idx == 0:
+                scalable_filter.initial_capacity, scalable_filter.growth, scalable_filter.tightening = capacity, growth, tightening
+
+            scalable_filter.filters.append(BloomFilter(capacity, false_positive_rate * (1 - tightening) * (tightening ** idx), count, bits))
+
+        return scalable_filter
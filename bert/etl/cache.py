@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import typing
+
+from bert import exceptions as bert_exceptions
+from bert.etl.constants import ETL_CACHE_DIR, ETL_CACHE_BYTES
+from bert.etl.storage import DatasetStorage, StoredObject
+
+logger = logging.getLogger(__name__)
+PWN = typing.TypeVar('PWN')
+ENCODING = 'utf-8'
+CHUNK_SIZE = 1024 * 1024
+CACHE: 'DatasetCache' = None
+CACHE_LOCK = threading.Lock()
+
+class DatasetCache:
+    """
+    Local copies of objects from a remote storage. Bodies are content addressed under `blobs/` by their sha256, so
+        identical objects are kept once, and `keys/` maps a storage key to its blob and the ETag it was downloaded
+        with. Every read is a conditional GET with that ETag, a 304 serves the local copy. Blobs are evicted least
+        recently used first once the directory grows past `max_bytes`. Files are written under a temporary name and
+        renamed into place, so processes and threads can share the directory.
+    """
+    def __init__(self: PWN, directory: str = ETL_CACHE_DIR, max_bytes: int = ETL_CACHE_BYTES) -> None:
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._blobs = os.path.join(directory, 'blobs')
+        self._keys = os.path.join(directory, 'keys')
+        self.hits = 0
+        self.misses = 0
+
+    def _index_path(self: PWN, storage: DatasetStorage, key: str) -> str:
+        return os.path.join(self._keys, hashlib.sha256(f'{storage.url}/{key}'.encode(ENCODING)).hexdigest())
+
+    def _replace(self: PWN, directory: str, path: str, write: typing.Callable[[typing.BinaryIO], None]) -> None:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                write(stream)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _lookup(self: PWN, storage: DatasetStorage, key: str) -> typing.Dict[str, typing.Any]:
+        try:
+            with open(self._index_path(storage, key), 'rb') as stream:
+                entry: typing.Dict[str, typing.Any] = json.loads(stream.read().decode(ENCODING))
+        except (OSError, ValueError):
+            return None
+
+        return entry if os.path.exists(os.path.join(self._blobs, entry['blob'])) else None
+
+    def _store(self: PWN, storage: DatasetStorage, key: str, stored: StoredObject) -> typing.Dict[str, typing.Any]:
+        checksum = hashlib.sha256()
+        def _copy(output: typing.BinaryIO) -> None:
+            for chunk in iter(lambda: stored.body.read(CHUNK_SIZE), b''):
+                checksum.update(chunk)
+                output.write(chunk)
+
+        os.makedirs(self._blobs, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=self._blobs)
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                _copy(output)
+
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        finally:
+            stored.body.close()
+
+        entry: typing.Dict[str, typing.Any] = {'blob': checksum.hexdigest(), 'etag': stored.etag, 'metadata': stored.metadata}
+        os.replace(temp_path, os.path.join(self._blobs, entry['blob']))
+        body: bytes = json.dumps(entry).encode(ENCODING)
+        self._replace(self._keys, self._index_path(storage, key), lambda output: output.write(body))
+        return entry
+
+    def evict(self: PWN) -> None:
+        """
+        Remove blobs larger than the whole cache, then the least recently used ones, until the cache fits in max_bytes.
+            Index entries pointing at a removed blob are misses from then on
+        """
+        try:
+            blobs: typing.List[os.DirEntry] = [entry for entry in os.scandir(self._blobs) if not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return None
+
+        stats: typing.List[typing.Tuple[float, int, str]] = []
+        for blob in blobs:
+            try:
+                stat = blob.stat()
+            except FileNotFoundError:
+                continue
+
+            stats.append((stat.st_size <= self._max_bytes, stat.st_mtime, stat.st_size, blob.path))
+
+        total: int = sum([stat[2] for stat in stats])
+        for fits, mtime, size, path in sorted(stats):
+            if total <= self._max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
+
+    def _fetch(self: PWN, storage: DatasetStorage, key: str) -> typing.Tuple[str, StoredObject]:
+        entry: typing.Dict[str, typing.Any] = self._lookup(storage, key)
+        downloaded: bool = False
+        try:
+            stored: StoredObject = storage.open(key, None if entry is None else entry['etag'])
+        except bert_exceptions.DatasetNotModified:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                entry, downloaded = self._store(storage, key, stored), True
+            except OSError as err:
+                # A full or read-only cache directory doesn't fail the read, the object is opened from storage again
+                logger.warning(f'Unable to cache {storage.url}/{key}, reading it from storage: {err}')
+                return None, storage.open(key)
+
+        path: str = os.path.join(self._blobs, entry['blob'])
+        # Touching the blob marks it as recently used. One evicted since the lookup is downloaded again
+        try:
+            os.utime(path)
+            stream: typing.BinaryIO = open(path, 'rb')
+        except OSError:
+            return None, storage.open(key)
+
+        if downloaded:
+            # Evicting after opening, a blob larger than the cache is still served once
+            self.evict()
+
+        return path, StoredObject(stream, entry['metadata'], entry['etag'])
+
+    def open(self: PWN, storage: DatasetStorage, key: str) -> StoredObject:
+        return self._fetch(storage, key)[1]
+
+    def get(self: PWN, storage: DatasetStorage, key: str) -> StoredObject:
+        """
+        The object with its local copy memory-mapped as `body`
+        """
+        path, stored = self._fetch(storage, key)
+        with stored.body as stream:
+            if path is None or os.fstat(stream.fileno()).st_size == 0:
+                return stored._replace(body=stream.read())
+
+            return stored._replace(body=mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+def get_cache(storage: DatasetStorage) -> DatasetCache:
+    """
+    The cache for objects of `storage`, None when the cache is disabled or the storage is already local
+    """
+    if not storage.remote or ETL_CACHE_BYTES <= 0:
+        return None
+
+    global CACHE
+    with CACHE_LOCK:
+        if CACHE is None:
+            CACHE = DatasetCache(ETL_CACHE_DIR, ETL_CACHE_BYTES)
+
+        return CACHE
@@ -0,0 +1,288 @@
+"""
+Columnar ETLDataset parts. Rows are split into row groups, and each column of a row group is stored as its own
+    compressed chunk, typed and with min/max statistics kept in the footer,
+
+    [chunk][chunk]...[footer json][footer length, u32][BCOL]
+
+A reader fetches the footer with one ranged GET from the end of the part, skips row groups whose statistics rule
+    out its filters, and fetches only the byte ranges of the columns it projects or filters on. Chunks less than
+    COALESCE_GAP bytes apart are fetched with one ranged GET.
+
+Filters are (column, operator, value) tuples, all of which must hold. Operators are ==, !=, <, <=, >, >= and in.
+"""
+import array
+import json
+import struct
+import sys
+import typing
+import zlib
+
+from bert import exceptions as bert_exceptions
+from bert.etl.constants import ETL_COLUMNAR_ROW_GROUP
+from bert.etl.storage import DatasetStorage
+
+PWN = typing.TypeVar('PWN')
+ENCODING = 'utf-8'
+MAGIC: bytes = b'BCOL'
+VERSION: int = 1
+FOOTER_TAIL = struct.Struct('<I4s')
+CHUNK_HEADER = struct.Struct('<I')
+# The first read from the end of a part, enough for the footer of most parts
+FOOTER_GUESS: int = 64 * 1024
+# Wanted chunks closer than this are fetched in one range, reading the bytes between them is cheaper than another GET
+COALESCE_GAP: int = 64 * 1024
+Filter = typing.Tuple[str, str, typing.Any]
+OPERATORS: typing.Dict[str, typing.Callable[[typing.Any, typing.Any], bool]] = {
+    '==': lambda value, other: value == other,
+    '!=': lambda value, other: value != other,
+    '<': lambda value, other: value < other,
+    '<=': lambda value, other: value <= other,
+    '>': lambda value, other: value > other,
+    '>=': lambda value, other: value >= other,
+    'in': lambda value, other: value in other,
+}
+_MISSING = object()
+
+def _compress(body: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(body)
+
+    elif codec == 'gzip':
+        return zlib.compress(body, 6)
+
+    return body
+
+def _decompress(body: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(body)
+
+    elif codec == 'gzip':
+        return zlib.decompress(body)
+
+    return body
+
+def _column_type(values: typing.List[typing.Any]) -> str:
+    if all([isinstance(value, bool) for value in values]):
+        return 'bool'
+
+    elif all([isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63 for value in values]):
+        return 'int'
+
+    elif all([isinstance(value, float) for value in values]):
+        return 'float'
+
+    elif all([isinstance(value, str) for value in values]):
+        return 'str'
+
+    return 'json'
+
+def _encode_chunk(column: str, records: typing.List[typing.Dict[str, typing.Any]], codec: str) -> typing.Tuple[bytes, typing.Dict[str, typing.Any]]:
+    values: typing.List[typing.Any] = []
+    nulls: typing.List[int] = []
+    missing: typing.List[int] = []
+    for idx, record in enumerate(records):
+        value: typing.Any = record.get(column, _MISSING)
+        if value is _MISSING:
+            missing.append(idx)
+
+        elif value is None:
+            nulls.append(idx)
+
+        else:
+            values.append(value)
+
+    column_type: str = _column_type(values)
+    if column_type in ['int', 'float', 'bool']:
+        payload: array.array = array.array({'int': 'q', 'float': 'd', 'bool': 'B'}[column_type], values)
+        if sys.byteorder != 'little':
+            payload.byteswap()
+
+        payload: bytes = payload.tobytes()
+
+    else:
+        payload: bytes = json.dumps(values).encode(ENCODING)
+
+    header: bytes = json.dumps({'nulls': nulls, 'missing': missing}).encode(ENCODING)
+    stats: typing.Dict[str, typing.Any] = {'type': column_type, 'count': len(values), 'nulls': len(nulls), 'missing': len(missing)}
+    numbers: bool = all([isinstance(value, (int, float)) and not isinstance(value, bool) for value in values])
+    if len(values) > 0 and (numbers or column_type == 'str'):
+        stats['min'], stats['max'] = min(values), max(values)
+
+    return _compress(CHUNK_HEADER.pack(len(header)) + header + payload, codec), stats
+
+def _decode_chunk(body: bytes, stats: typing.Dict[str, typing.Any], rows: int, codec: str) -> typing.List[typing.Any]:
+    body = _decompress(body, codec)
+    header_length: int = CHUNK_HEADER.unpack_from(body)[0]
+    header: typing.Dict[str, typing.List[int]] = json.loads(body[CHUNK_HEADER.size:CHUNK_HEADER.size + header_length].decode(ENCODING))
+    payload: bytes = body[CHUNK_HEADER.size + header_length:]
+    if stats['type'] in ['int', 'float', 'bool']:
+        values: array.array = array.array({'int': 'q', 'float': 'd', 'bool': 'B'}[stats['type']])
+        values.frombytes(payload)
+        if sys.byteorder != 'little':
+            values.byteswap()
+
+        values: typing.List[typing.Any] = [bool(value) for value in values] if stats['type'] == 'bool' else values.tolist()
+
+    else:
+        values: typing.List[typing.Any] = json.loads(payload.decode(ENCODING))
+
+    column: typing.List[typing.Any] = [None] * rows
+    skipped: typing.Set[int] = set(header['nulls'])
+    for idx in header['missing']:
+        column[idx] = _MISSING
+        skipped.add(idx)
+
+    values_iter: typing.Iterator[typing.Any] = iter(values)
+    for idx in range(0, rows):
+        if not idx in skipped:
+            column[idx] = next(values_iter)
+
+    return column
+
+def encode_columnar(records: typing.List[typing.Dict[str, typing.Any]], codec: str = 'gzip', row_group_rows: int = ETL_COLUMNAR_ROW_GROUP) -> bytes:
+    """
+    A columnar part holding `records`, which have to be dicts. Columns are the union of their keys
+    """
+    chunks: typing.List[bytes] = []
+    offset: int = 0
+    row_groups: typing.List[typing.Dict[str, typing.Any]] = []
+    for start in range(0, len(records), max(1, row_group_rows)):
+        group: typing.List[typing.Dict[str, typing.Any]] = records[start:start + max(1, row_group_rows)]
+        columns: typing.Dict[str, typing.Any] = {}
+        for column in sorted(set([key for record in group for key in record.keys()])):
+            chunk, stats = _encode_chunk(column, group, codec)
+            columns[column] = dict(stats, offset=offset, length=len(chunk))
+            chunks.append(chunk)
+            offset += len(chunk)
+
+        row_groups.append({'rows': len(group), 'columns': columns})
+
+    footer: bytes = json.dumps({'version': VERSION, 'codec': codec, 'rows': len(records), 'row-groups': row_groups}).encode(ENCODING)
+    return b''.join(chunks) + footer + FOOTER_TAIL.pack(len(footer), MAGIC)
+
+def matches(record: typing.Dict[str, typing.Any], filters: typing.List[Filter]) -> bool:
+    for column, operator, other in filters:
+        value: typing.Any = record.get(column, None)
+        try:
+            if not OPERATORS[operator](value, other):
+                return False
+        except TypeError:
+            # None, or values of another type, never match an ordering
+            return False
+
+    return True
+
+def project(record: typing.Dict[str, typing.Any], columns: typing.List[str]) -> typing.Dict[str, typing.Any]:
+    return {column: record[column] for column in columns if column in record}
+
+def may_match(row_group: typing.Dict[str, typing.Any], filters: typing.List[Filter]) -> bool:
+    """
+    False when the statistics of the row group prove no row in it matches `filters`
+    """
+    for column, operator, other in filters:
+        if other is None or (operator == 'in' and None in other):
+            # Missing values read as None, statistics can't rule those out
+            continue
+
+        stats: typing.Dict[str, typing.Any] = row_group['columns'].get(column, None)
+        if stats is None or stats['count'] == 0:
+            # Every value is None or missing, which only != can match
+            if operator != '!=':
+                return False
+
+            continue
+
+        if not 'min' in stats:
+            continue
+
+        low, high = stats['min'], stats['max']
+        try:
+            if operator == '==' and not low <= other <= high:
+                return False
+
+            elif operator == '<' and not low < other:
+                return False
+
+            elif operator == '<=' and not low <= other:
+                return False
+
+            elif operator == '>' and not high > other:
+                return False
+
+            elif operator == '>=' and not high >= other:
+                return False
+
+            elif operator == 'in' and not any([low <= value <= high for value in other]):
+                return False
+
+            elif operator == '!=' and low == high == other and stats['nulls'] + stats['missing'] == 0:
+                return False
+
+        except TypeError:
+            continue
+
+    return True
+
+class ColumnarPart:
+    def __init__(self: PWN, storage: DatasetStorage, s3_key: str) -> None:
+        self._storage = storage
+        self._s3_key = s3_key
+        self.footer: typing.Dict[str, typing.Any] = None
+
+    def load_footer(self: PWN) -> typing.Dict[str, typing.Any]:
+        tail: bytes = self._storage.read_range(self._s3_key, -FOOTER_GUESS)
+        if len(tail) < FOOTER_TAIL.size or tail[-len(MAGIC):] != MAGIC:
+            raise bert_exceptions.DatasetFormatError(f'Dataset[{self._s3_key}] is not a columnar part')
+
+        footer_length, magic = FOOTER_TAIL.unpack(tail[-FOOTER_TAIL.size:])
+        if footer_length + FOOTER_TAIL.size > len(tail):
+            tail = self._storage.read_range(self._s3_key, -(footer_length + FOOTER_TAIL.size))
+
+        self.footer = json.loads(tail[-(footer_length + FOOTER_TAIL.size):-FOOTER_TAIL.size].decode(ENCODING))
+        return self.footer
+
+    def _read_columns(self: PWN, row_group: typing.Dict[str, typing.Any], columns: typing.List[str]) -> typing.Dict[str, typing.List[typing.Any]]:
+        wanted: typing.List[str] = sorted([column for column in columns if column in row_group['columns']], key=lambda column: row_group['columns'][column]['offset'])
+        if len(wanted) == 0:
+            return {}
+
+        # Runs of chunks less than COALESCE_GAP apart share a ranged GET, chunks further apart get their own
+        ranges: typing.List[typing.List[typing.Any]] = []
+        for column in wanted:
+            stats: typing.Dict[str, typing.Any] = row_group['columns'][column]
+            if len(ranges) > 0 and stats['offset'] - ranges[-1][1] <= COALESCE_GAP:
+                ranges[-1][1] = max(ranges[-1][1], stats['offset'] + stats['length'])
+                ranges[-1][2].append(column)
+
+            else:
+                ranges.append([stats['offset'], stats['offset'] + stats['length'], [column]])
+
+        decoded: typing.Dict[str, typing.List[typing.Any]] = {}
+        for start, end, range_columns in ranges:
+            body: bytes = self._storage.read_range(self._s3_key, start, end - start)
+            for column in range_columns:
+                stats: typing.Dict[str, typing.Any] = row_group['columns'][column]
+                decoded[column] = _decode_chunk(body[stats['offset'] - start:stats['offset'] - start + stats['length']], stats, row_group['rows'], self.footer['codec'])
+
+        return decoded
+
+    def read(self: PWN, columns: typing.List[str] = None, filters: typing.List[Filter] = []) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        if self.footer is None:
+            self.load_footer()
+
+        for row_group in self.footer['row-groups']:
+            if not may_match(row_group, filters):
+                continue
+
+            wanted: typing.List[str] = list(row_group['columns'].keys()) if columns is None else list(set(columns) | set([column for column, operator, value in filters]))
+            decoded: typing.Dict[str, typing.List[typing.Any]] = self._read_columns(row_group, wanted)
+            for idx in range(0, row_group['rows']):
+                record: typing.Dict[str, typing.Any] = {}
+                for column, values in decoded.items():
+                    if not values[idx] is _MISSING:
+                        record[column] = values[idx]
+
+                if matches(record, filters):
+                    yield record if columns is None else project(record, columns)
@@ -0,0 +1,107 @@
+"""
+Compaction of ETLDataset parts. Scheduled jobs append a small part on every run, and a reader pays one request per
+    part, so runs of consecutive small parts are merged into parts of about `target_bytes`.
+
+    1. Retired parts that have been out of the manifest longer than `grace_period` are deleted
+    2. Each run of small parts is read, concatenated in the order readers see it and written as one new part
+    3. The manifest swaps the run for the new part in one conditional write, the old parts become retired
+
+Readers that loaded the manifest before the swap keep reading the old parts, which is why they're only deleted by a
+    later compaction, after the grace period.
+"""
+import hashlib
+import logging
+import time
+import typing
+
+from bert import exceptions as bert_exceptions
+from bert.etl.constants import BERT_ETL_S3_PREFIX, ETL_COMPACTION_TARGET_BYTES, ETL_COMPACTION_GRACE
+from bert.etl.manifest import DatasetManifest
+from bert.etl.storage import DatasetStorage, dataset_url, get_storage
+from bert.etl.columnar import encode_columnar
+from bert.etl.sync_utils import read_part, encode_record, compress_chunks, resolve_codec, codec_metadata, CODEC_SUFFIXES, COLUMNAR_SUFFIX
+
+logger = logging.getLogger(__name__)
+ENCODING = 'utf-8'
+
+def plan_compaction(parts: typing.List[typing.Dict[str, typing.Any]], target_bytes: int, small_bytes: int) -> typing.List[typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    Runs of consecutive small parts, by index, each adding up to about `target_bytes`. Runs of a single part are left
+        alone
+    """
+    runs: typing.List[typing.List[typing.Dict[str, typing.Any]]] = [[]]
+    for part in sorted(parts, key=lambda part: part['index']):
+        run: typing.List[typing.Dict[str, typing.Any]] = runs[-1]
+        if part['size'] >= small_bytes or sum([run_part['size'] for run_part in run]) + part['size'] > target_bytes:
+            runs.append([])
+
+        if part['size'] < small_bytes:
+            runs[-1].append(part)
+
+    return [run for run in runs if len(run) > 1]
+
+def _merge_run(storage: DatasetStorage, prefix: str, run: typing.List[typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.Any]:
+    codec: str = resolve_codec()
+    # Readers go through parts newest first, the merged part keeps that order
+    records: typing.List[typing.Any] = []
+    for part in sorted(run, key=lambda part: part['index'], reverse=True):
+        records.extend(read_part(part['key'], storage.url))
+
+    # A run of columnar parts stays columnar, anything else is merged into ndjson
+    if all([part['key'].endswith(COLUMNAR_SUFFIX) for part in run]):
+        body, suffix, part_format = encode_columnar(records, codec), COLUMNAR_SUFFIX, 'columnar'
+
+    else:
+        body, suffix, part_format = b''.join(compress_chunks([encode_record(record) for record in records], codec)), f'.ndjson{CODEC_SUFFIXES[codec]}', 'ndjson'
+
+    checksum: str = hashlib.sha256(body).hexdigest()
+    first, last = min([part['index'] for part in run]), max([part['index'] for part in run])
+    # Named after its content, so a compaction that died before the manifest swap leaves a key the next one reuses
+    key: str = f'{prefix}/{first}-{last}.{checksum[:16]}{suffix}'
+    try:
+        storage.put(key, body, codec_metadata(codec, part_format), if_none_match=True)
+    except bert_exceptions.DatasetPreconditionFailed:
+        pass
+
+    return {'key': key, 'index': last, 'size': len(body), 'rows': len(records), 'checksum': checksum}
+
+def purge_retired(manifest: DatasetManifest, grace_period: int = ETL_COMPACTION_GRACE, dry_run: bool = False) -> typing.List[str]:
+    expired: typing.List[str] = [part['key'] for part in manifest.retired if part['retired-at'] + grace_period < time.time()]
+    if len(expired) > 0 and dry_run is False:
+        logger.info(f'Deleting retired Parts[{len(expired)}]')
+        get_storage(dataset_url()).delete(expired)
+        manifest.forget_retired(expired)
+
+    return expired
+
+def compact_dataset(message: str, target_bytes: int = ETL_COMPACTION_TARGET_BYTES, small_bytes: int = None, grace_period: int = ETL_COMPACTION_GRACE, dry_run: bool = False) -> typing.Dict[str, typing.Any]:
+    """
+    Compact the ETLDataset for `message`, returning what was, or with `dry_run` would be, merged and deleted
+    """
+    small_bytes = target_bytes // 2 if small_bytes is None else small_bytes
+    prefix: str = f'{BERT_ETL_S3_PREFIX}/etl-dataset/{hashlib.sha256(message.encode(ENCODING)).hexdigest()}'
+    storage: DatasetStorage = get_storage(dataset_url())
+    manifest: DatasetManifest = DatasetManifest(prefix, dataset_url()).load()
+    summary: typing.Dict[str, typing.Any] = {
+        'dataset': message,
+        'parts': len(manifest.parts),
+        'deleted': purge_retired(manifest, grace_period, dry_run),
+        'merged': [],
+    }
+    for run in plan_compaction(manifest.parts, target_bytes, small_bytes):
+        keys: typing.List[str] = [part['key'] for part in run]
+        if dry_run is True:
+            summary['merged'].append({'parts': keys, 'key': None})
+            continue
+
+        merged: typing.Dict[str, typing.Any] = _merge_run(storage, prefix, run)
+        if manifest.replace_parts(keys, [merged]):
+            logger.info(f'Compacted Parts[{len(keys)}] into Dataset[{merged["key"]}] Rows[{merged["rows"]}]')
+            summary['merged'].append({'parts': keys, 'key': merged['key']})
+
+        else:
+            logger.info(f'Parts of Dataset[{merged["key"]}] changed during compaction, skipping')
+            if not merged['key'] in [part['key'] for part in manifest.parts]:
+                storage.delete([merged['key']])
+
+    return summary
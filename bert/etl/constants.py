@@ -1 +1,49 @@
+import os
+import tempfile
+
 BERT_ETL_S3_PREFIX = 'bert-etl-data-cache'
+REQUEST_PAYER = 'requester' if os.environ.get('REQUEST_PAYER', '').lower() in ['t', 'true'] else ''
+# Hex characters of an item hash that pick its ETLState shard, 2 gives 256 shards
+ETL_STATE_SHARD_PREFIX = int(os.environ.get('BERT_ETL_STATE_SHARD_PREFIX', 2))
+# Threads uploading or downloading the parts of one state or dataset at a time
+ETL_TRANSFER_WORKERS = int(os.environ.get('BERT_ETL_TRANSFER_WORKERS', 16))
+# Parts an ETLDatasetReader downloads ahead of the one being read
+ETL_PREFETCH_PARTS = int(os.environ.get('BERT_ETL_PREFETCH_PARTS', 4))
+# Compression for datasets written to S3: none, gzip or zstd, zstd needs the zstandard package
+BERT_ETL_CODEC = os.environ.get('BERT_ETL_CODEC', 'gzip').lower()
+# An ETLDataset rolls over to a new part once the part in progress reaches either limit
+ETL_PART_ROWS = int(os.environ.get('BERT_ETL_PART_ROWS', 100000))
+ETL_PART_BYTES = int(os.environ.get('BERT_ETL_PART_BYTES', 64 * 1024 * 1024))
+# Finished parts an ETLDataset uploads in the background before add blocks on the oldest one
+ETL_UPLOAD_WORKERS = int(os.environ.get('BERT_ETL_UPLOAD_WORKERS', 2))
+# Map local dataset files into memory instead of reading them, for file:// storage
+ETL_LOCAL_MMAP = True if os.environ.get('BERT_ETL_LOCAL_MMAP', '').lower() in ['t', 'true'] else False
+# Local copies of downloaded datasets, revalidated with their ETag and evicted least recently used first. A size of 0
+#   disables the cache
+ETL_CACHE_DIR = os.environ.get('BERT_ETL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'bert-etl-cache'))
+ETL_CACHE_BYTES = int(os.environ.get('BERT_ETL_CACHE_BYTES', 256 * 1024 * 1024))
+# Compaction merges runs of parts smaller than half the target into parts of about ETL_COMPACTION_TARGET_BYTES, and
+#   deletes the parts it replaced once they've been out of the manifest for ETL_COMPACTION_GRACE seconds
+ETL_COMPACTION_TARGET_BYTES = int(os.environ.get('BERT_ETL_COMPACTION_TARGET_BYTES', 32 * 1024 * 1024))
+ETL_COMPACTION_GRACE = int(os.environ.get('BERT_ETL_COMPACTION_GRACE', 3600))
+# Format of new ETLDataset parts: ndjson, or columnar for readers that project columns and filter rows
+ETL_PART_FORMAT = os.environ.get('BERT_ETL_PART_FORMAT', 'ndjson').lower()
+# Rows per row group of a columnar part, each row group has min/max statistics for every column
+ETL_COLUMNAR_ROW_GROUP = int(os.environ.get('BERT_ETL_COLUMNAR_ROW_GROUP', 10000))
+# cache_function_results keeps up to ETL_MEMO_SIZE results in process for ETL_MEMO_TTL seconds, reloads its ETLState
+#   every ETL_FUNCTOOLS_STATE_TTL seconds, and synchronizes it once ETL_FUNCTOOLS_SYNC_BATCH results are new or
+#   ETL_FUNCTOOLS_SYNC_INTERVAL seconds have passed
+ETL_MEMO_SIZE = int(os.environ.get('BERT_ETL_MEMO_SIZE', 1024))
+ETL_MEMO_TTL = float(os.environ.get('BERT_ETL_MEMO_TTL', 300))
+# Results held in process are deep-copied when they're stored and on every hit, so callers can mutate them. Large
+#   results that callers only read can skip the copies with BERT_ETL_MEMO_COPY=false
+ETL_MEMO_COPY = False if os.environ.get('BERT_ETL_MEMO_COPY', 'true').lower() in ['f', 'false', 'no'] else True
+ETL_FUNCTOOLS_STATE_TTL = float(os.environ.get('BERT_ETL_FUNCTOOLS_STATE_TTL', 60))
+ETL_FUNCTOOLS_SYNC_BATCH = int(os.environ.get('BERT_ETL_FUNCTOOLS_SYNC_BATCH', 100))
+ETL_FUNCTOOLS_SYNC_INTERVAL = float(os.environ.get('BERT_ETL_FUNCTOOLS_SYNC_INTERVAL', 30))
+# Seconds a single-flight lock is held before it expires, so a worker that died doesn't block other callers for good
+ETL_SINGLE_FLIGHT_LEASE = float(os.environ.get('BERT_ETL_SINGLE_FLIGHT_LEASE', 300))
+# Threads recording the outputs of memoized stages, see bert.etl.memo
+ETL_STAGE_MEMO_WORKERS = int(os.environ.get('BERT_ETL_STAGE_MEMO_WORKERS', 4))
+# An APILimiter that lost Redis tries to reconnect after 1 second, doubling the wait up to ETL_API_LIMITER_RECONNECT
+ETL_API_LIMITER_RECONNECT = float(os.environ.get('BERT_ETL_API_LIMITER_RECONNECT', 30))
@@ -0,0 +1,43 @@
+#!/usr/env/bin python
+
+import argparse
+import json
+import logging
+import typing
+
+from bert.etl.constants import ETL_COMPACTION_TARGET_BYTES, ETL_COMPACTION_GRACE
+
+logger = logging.getLogger(__name__)
+
+def capture_options() -> typing.Any:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    compact = subparsers.add_parser('compact', help='Merge the small parts of ETLDatasets')
+    compact.add_argument('-d', '--dataset', required=True, action='append', help='Message the ETLDataset was opened with, repeatable')
+    compact.add_argument('-t', '--target-bytes', default=ETL_COMPACTION_TARGET_BYTES, type=int)
+    compact.add_argument('-s', '--small-bytes', default=None, type=int, help='Parts below this size are merged, half of --target-bytes by default')
+    compact.add_argument('-g', '--grace-period', default=ETL_COMPACTION_GRACE, type=int, help='Seconds a replaced part is kept for readers still using it')
+    compact.add_argument('-o', '--dry-run-off', default=False, action='store_true')
+    return parser.parse_args()
+
+def run_compaction(options: argparse.Namespace) -> None:
+    from bert.etl.compaction import compact_dataset
+    for message in options.dataset:
+        summary: typing.Dict[str, typing.Any] = compact_dataset(message, options.target_bytes, options.small_bytes, options.grace_period, not options.dry_run_off)
+        if options.dry_run_off is False:
+            logger.info(f'Dry run, pass --dry-run-off to compact Dataset[{message}]')
+
+        print(json.dumps(summary, indent=2))
+
+def run_from_cli():
+    import sys, os
+    sys.path.append(os.getcwd())
+    options = capture_options()
+    if options.command == 'compact':
+        run_compaction(options)
+
+    else:
+        raise NotImplementedError(options.command)
+
+if __name__ in ['__main__']:
+    run_from_cli()
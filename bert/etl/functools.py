@@ -1,14 +1,26 @@
-import boto3
+import collections
+import contextlib
+import copy
+import datetime
 import hashlib
 import inspect
+import logging
+import multiprocessing.util
 import os
+import threading
+import time
 import types
 import typing
+import uuid
 
 import functools as python_functools
 
+from bert import encoders as bert_encoders, exceptions as bert_exceptions
+from bert.encoders import base as base_encoders
 from bert.etl import ETLState
-from bert.etl.constants import BERT_ETL_S3_PREFIX
+from bert.etl.constants import BERT_ETL_S3_PREFIX, ETL_MEMO_SIZE, ETL_MEMO_TTL, ETL_MEMO_COPY, ETL_FUNCTOOLS_STATE_TTL, \
+    ETL_FUNCTOOLS_SYNC_BATCH, ETL_FUNCTOOLS_SYNC_INTERVAL, ETL_SINGLE_FLIGHT_LEASE
+from bert.etl.storage import dataset_url
 from bert.etl.sync_utils import upload_dataset, download_dataset
 
 """
@@ -19,8 +31,248 @@ cache_function_results
       to happen. Allowing for more complex data-types to be cached and returned
 """
 
+logger = logging.getLogger(__name__)
 ENCODING = 'utf-8'
 PWN = typing.TypeVar('PWN')
+LOCAL_LOCKS: int = 64
+_MISSING = object()
+
+class MemoCache:
+    """
+    Results held in this process, in front of the storage. Entries expire `ttl` seconds after they're stored and the
+        least recently used are evicted past `max_size`. With `copy_results`, results are deep-copied when stored
+        and on every hit, so mutating a result doesn't change the cached one. The copy costs about as much as
+        building the result again from its json, callers that only read large results can turn it off
+    """
+    def __init__(self: PWN, max_size: int = ETL_MEMO_SIZE, ttl: float = ETL_MEMO_TTL, copy_results: bool = ETL_MEMO_COPY) -> None:
+        self._max_size = max_size
+        self._ttl = ttl
+        self._copy = copy.deepcopy if copy_results else lambda value: value
+        self._entries: typing.Dict[str, typing.Tuple[float, typing.Any]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self: PWN, key: str) -> typing.Any:
+        """
+        The result stored under `key`, or _MISSING
+        """
+        with self._lock:
+            expires, value = self._entries.get(key, (None, _MISSING))
+            if value is _MISSING or expires < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return _MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return self._copy(value)
+
+    def put(self: PWN, key: str, value: typing.Any) -> None:
+        if self._max_size <= 0:
+            return None
+
+        value = self._copy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self: PWN) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Deletes the lock only while it still holds this caller's token, a lock that expired and was taken by another
+#   caller is left alone
+_RELEASE_SCRIPT: str = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class SingleFlight:
+    """
+    One caller at a time per key, across every process and host sharing REDIS_URL. The others wait for the lock and
+        then find the result the first caller stored. Locks expire after `lease` seconds, and when Redis can't be
+        reached only the threads of this process are kept apart
+    """
+    def __init__(self: PWN, namespace: str, lease: float = ETL_SINGLE_FLIGHT_LEASE, redis_url: str = None) -> None:
+        self._namespace = namespace
+        self._lease = lease
+        self._redis_url = redis_url
+        self._client = None
+        self._script = None
+        self._connected = False
+        self._connect_lock = threading.Lock()
+        self._local_locks: typing.List[threading.Lock] = [threading.Lock() for idx in range(0, LOCAL_LOCKS)]
+
+    def _connect(self: PWN) -> None:
+        from bert import constants as bert_constants, datasource as bert_datasource
+        with self._connect_lock:
+            if self._connected is True:
+                return None
+
+            self._connected = True
+            try:
+                self._client = bert_datasource.RedisConnection.ParseURL(self._redis_url or bert_constants.REDIS_URL).client()
+                self._client.ping()
+                self._script = self._client.register_script(_RELEASE_SCRIPT)
+
+            except Exception as err:
+                logger.warning(f'Unable to reach Redis for SingleFlight[{self._namespace}], locking this process only: {err}')
+                self._client = None
+
+    def _acquire(self: PWN, key: str, token: str) -> bool:
+        from bert import constants as bert_constants
+        lease_ms: int = int(self._lease * 1000)
+        while True:
+            try:
+                if self._client.set(key, token, nx=True, px=lease_ms):
+                    return True
+
+            except Exception as err:
+                logger.warning(f'Lost Redis for SingleFlight[{self._namespace}], locking this process only: {err}')
+                self._client = None
+                return False
+
+            time.sleep(bert_constants.DELAY)
+
+    @contextlib.contextmanager
+    def hold(self: PWN, key: str) -> typing.Iterator[None]:
+        if self._connected is False:
+            self._connect()
+
+        token: str = str(uuid.uuid4())
+        redis_key: str = f'bert-etl-single-flight:{self._namespace}:{key}'
+        if not self._client is None and self._acquire(redis_key, token):
+            try:
+                yield None
+
+            finally:
+                try:
+                    self._script(keys=[redis_key], args=[token])
+                except Exception as err:
+                    logger.warning(f'Unable to release SingleFlight[{redis_key}], it expires in Lease[{self._lease}]: {err}')
+
+            return None
+
+        with self._local_locks[int(hashlib.sha256(key.encode(ENCODING)).hexdigest()[:8], 16) % LOCAL_LOCKS]:
+            yield None
+
+
+def _hash_value(digest: 'hashlib._Hash', value: typing.Any) -> None:
+    """
+    Feed `value` into `digest` tagged with its type, so equal values hash the same from one process to the next and
+        1, '1' and True don't collide. Dicts and sets are hashed independent of their order, ndarrays from their
+        dtype, shape and buffer, and anything else through the identity encoders
+    """
+    def _write(tag: bytes, body: bytes) -> None:
+        digest.update(tag + str(len(body)).encode(ENCODING) + b':' + body)
+
+    if value is None:
+        _write(b'n', b'')
+
+    elif isinstance(value, bool):
+        _write(b'b', b'1' if value else b'0')
+
+    elif isinstance(value, int):
+        _write(b'i', str(value).encode(ENCODING))
+
+    elif isinstance(value, float):
+        _write(b'f', value.hex().encode(ENCODING))
+
+    elif isinstance(value, str):
+        _write(b's', value.encode(ENCODING))
+
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        _write(b'y', bytes(value))
+
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        _write(b't', value.isoformat().encode(ENCODING))
+
+    elif isinstance(value, (list, tuple)):
+        _write(b'l' if isinstance(value, list) else b'u', str(len(value)).encode(ENCODING))
+        for item in value:
+            _hash_value(digest, item)
+
+    elif isinstance(value, dict):
+        _write(b'd', b''.join(sorted([_hash_of(key) + _hash_of(item) for key, item in value.items()])))
+
+    elif isinstance(value, (set, frozenset)):
+        _write(b'e', b''.join(sorted([_hash_of(item) for item in value])))
+
+    elif hasattr(value, 'dtype') and hasattr(value, 'shape') and hasattr(value, 'tobytes'):
+        # numpy arrays and scalars, without importing numpy
+        _write(b'a', f'{value.dtype.str}{value.shape}'.encode(ENCODING))
+        digest.update(value.tobytes(order='C'))
+
+    elif hasattr(value, '_payload') and value.__class__.__name__ == 'QueueItem':
+        _hash_value(digest, value._payload)
+
+    elif hasattr(value.__class__, 'Serialize'):
+        # ETLReference and ETLDatasetReader
+        _write(b'r', f'{value.__class__.__module__}.{value.__class__.__name__}'.encode(ENCODING))
+        _hash_value(digest, value.__class__.Serialize(value))
+
+    else:
+        _write(b'o', f'{value.__class__.__module__}.{value.__class__.__name__}'.encode(ENCODING))
+        _write(b'j', bert_encoders.encode_identity_object(value).encode(ENCODING))
+
+def _hash_of(value: typing.Any) -> bytes:
+    digest = hashlib.sha256()
+    _hash_value(digest, value)
+    return digest.digest()
+
+def hash_value(value: typing.Any) -> str:
+    """
+    The canonical hash of `value`, see _hash_value. Raises BertIdentityEncoderError for objects nothing can encode
+    """
+    return _hash_of(value).hex()
+
+def hash_arguments(signature: inspect.Signature, args: typing.Tuple[typing.Any], kwargs: typing.Dict[str, typing.Any]) -> str:
+    """
+    A key for a call of the function with `signature`. Arguments are bound to their parameter names and defaults are
+        filled in, so f(1), f(a=1) and f() with a default of 1 get the same key
+    """
+    bound: inspect.BoundArguments = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return _hash_of(list(bound.arguments.items())).hex()
+
+# Raised by encoders for results they have no encoding for
+ENCODE_ERRORS: typing.Tuple[typing.Type[Exception], ...] = (NotImplementedError, TypeError, ValueError, bert_exceptions.BertEncoderError)
+
+def _as_lists(value: typing.Any) -> typing.Any:
+    # A copy of `value` with tuples turned into lists, as json has always stored them. Encoders change containers in place
+    if isinstance(value, dict):
+        return {key: _as_lists(item) for key, item in value.items()}
+
+    elif isinstance(value, (list, tuple)):
+        return [_as_lists(item) for item in value]
+
+    return copy.deepcopy(value)
+
+def encode_result(result: typing.Any) -> typing.Dict[str, typing.Any]:
+    """
+    `result` serialized with the queue encoders, so anything a job can put on a queue can be cached. Raises one of
+        ENCODE_ERRORS when no encoder handles it
+    """
+    datum: typing.Dict[str, typing.Any] = {'result': _as_lists(result)}
+    if len(bert_encoders.QUEUE_ENCODERS) == 0:
+        return base_encoders.encode_aws_object(datum)
+
+    return bert_encoders.encode_object(datum)
+
+def decode_result(encoded: typing.Dict[str, typing.Any]) -> typing.Any:
+    if len(bert_encoders.QUEUE_DECODERS) == 0:
+        return base_encoders.decode_aws_object({'M': encoded})['result']
+
+    return bert_encoders.decode_object({'M': encoded})['result']
+
+
 class cache_function_results:
     _setup: False
     def __init__(self: PWN, func_or_prefix: typing.Union[str, types.FunctionType]) -> None:
@@ -37,65 +289,116 @@ class cache_function_results:
         else:
             raise NotImplementedError
 
-    def _hash_inputs(self: PWN, *args, **kwargs) -> str:
-        properties = []
-        for arg in args:
-            if not isinstance(arg, str):
-                properties.append(str(arg))
-
-            else:
-                properties.append(arg)
-
     def _setup_func(self: PWN, func: types.FunctionType) -> None:
+        self._setup = True
         func_spec = inspect.getfullargspec(func)
-        # Only supports data-types that can be converted into strs right now
-        # func_args_spec = ''.join([str(value) for value in func_spec.args[:]])
-        # func_annotation_spec = ''.join([':'.join([key, str(value)]) for key, value in func_spec.annotations.items()])
-        # func_default_spec = ''.join([str(value) for value in func_spec.defaults[:]])
-        # func_kword_spec = ''.join([str(value) for value in func_spec.kwonlyargs[:]])
+        func_signature: inspect.Signature = inspect.signature(func)
+        self._state: ETLState = None
+        self._state_lock = threading.RLock()
+        self._localized_at: float = 0
+        self._synchronized_at: float = time.monotonic()
+        self._pending: int = 0
+        self._memo = MemoCache()
+        self._single_flight = SingleFlight(self._prefix)
+        # Defaults aren't part of the spec, they're bound into the arguments of every call
         func_spec_key = ''.join([
             ''.join([str(value) for value in func_spec.args[:]]),
             ''.join([':'.join([key, str(value)]) for key, value in func_spec.annotations.items()]),
-            ''.join([str(value) for value in func_spec.defaults[:]]),
             ''.join([str(value) for value in func_spec.kwonlyargs[:]]),
         ])
         etl_state_key = hashlib.sha256(func_spec_key.encode(ENCODING)).hexdigest()
-        etl_state = ETLState(etl_state_key)
+        self._state = ETLState(etl_state_key)
+        # Results added since the last synchronize are written out when the process exits, bert-runner.py workers
+        #   included, which exit without running atexit hooks
+        multiprocessing.util.Finalize(self, self.synchronize, exitpriority=10)
 
-        # A question now rises in my mind. Do we want to pull down and maintain a global state from the __init__
-        #  method? Or is it better to run this logic in the function invocation?
         @python_functools.wraps(func)
         def _wrapper(*args, **kwargs) -> typing.Any:
-            func_invocation_key = ''.join([
-                ''.join([str(arg) for arg in args]),
-                ''.join([':'.join([key, value]) for key, value in kwargs.items()]),
-            ])
+            try:
+                func_invocation_key = hash_arguments(func_signature, args, kwargs)
+            except bert_exceptions.BertIdentityEncoderError as err:
+                logger.warning(f'Unable to hash the arguments of Function[{self._prefix}], calling it uncached: {err}')
+                return func(*args, **kwargs)
 
             s3_key = ''.join([self._prefix, func_spec_key, func_invocation_key])
             s3_key = hashlib.sha256(s3_key.encode(ENCODING)).hexdigest()
             s3_key = f'{self._prefix}/{s3_key}'
-            etl_state.localize()
-            if etl_state.contains(s3_key) is True:
-                func_result = download_dataset(s3_key, os.environ['DATASET_BUCKET'], dict)
+            func_result = self._memo.get(s3_key)
+            if not func_result is _MISSING:
                 return func_result
 
-            else:
-                func_result = func(*args, **kwargs)
-                # We'll need to expand the followirg logic so that caching can cache more than simple python datatypes
-                upload_dataset(func_result, s3_key, os.environ['DATASET_BUCKET'])
-                # Add to etl_state after the upload, incase an error occurs during upload
-                etl_state.contain(s3_key)
-                etl_state.synchronize()
-                return func_result
+            if self._contains(s3_key) is True:
+                func_result = self._download(s3_key)
+                if not func_result is _MISSING:
+                    self._memo.put(s3_key, func_result)
+                    return func_result
+
+            # Callers with the same arguments wait here for the first one, then read its result instead of computing
+            with self._single_flight.hold(s3_key):
+                func_result = self._download(s3_key)
+                if func_result is _MISSING:
+                    func_result = func(*args, **kwargs)
+                    try:
+                        encoded: typing.Dict[str, typing.Any] = encode_result(func_result)
+                    except ENCODE_ERRORS as err:
+                        logger.warning(f'Unable to encode the result of Function[{self._prefix}], returning it uncached: {err!r}')
+                        return func_result
+
+                    upload_dataset(encoded, s3_key, dataset_url())
+
+            # Add to etl_state after the upload, incase an error occurs during upload
+            self._contain(s3_key)
+            self._memo.put(s3_key, func_result)
+            return func_result
 
         self._wrapped_func = _wrapper
         return _wrapper
 
-    def __call__(self: PWN, func: types.FunctionType, *rest, **kwargs) -> typing.Any:
-        if isinstance(func, types.FunctionType):
-            return self._setup_func(func)
+    def _download(self: PWN, s3_key: str) -> typing.Any:
+        try:
+            return decode_result(download_dataset(s3_key, dataset_url(), dict))
+        except bert_exceptions.DatasetKeyNotFound:
+            return _MISSING
+
+    def _localized_state(self: PWN) -> ETLState:
+        # Called with _state_lock held. Pending results are synchronized before localize drops them
+        if time.monotonic() - self._localized_at > ETL_FUNCTOOLS_STATE_TTL:
+            self.synchronize()
+            self._state.localize()
+            self._localized_at = time.monotonic()
+
+        return self._state
+
+    def _contains(self: PWN, s3_key: str) -> bool:
+        with self._state_lock:
+            return self._localized_state().contains(s3_key)
+
+    def _contain(self: PWN, s3_key: str) -> None:
+        with self._state_lock:
+            state: ETLState = self._localized_state()
+            if state.contains(s3_key) is True:
+                return None
+
+            state.contain(s3_key)
+            self._pending += 1
+            if self._pending >= ETL_FUNCTOOLS_SYNC_BATCH or time.monotonic() - self._synchronized_at > ETL_FUNCTOOLS_SYNC_INTERVAL:
+                self.synchronize()
+
+    def synchronize(self: PWN) -> None:
+        """
+        Upload the results added to the ETLState since it was last synchronized
+        """
+        with self._state_lock:
+            if self._pending > 0:
+                self._state.synchronize()
+                self._pending = 0
+
+            self._synchronized_at = time.monotonic()
+
+    def __call__(self: PWN, *args, **kwargs) -> typing.Any:
+        # @cache_function_results('prefix') is handed the function once, after that functions are arguments like any other
+        if self._setup is False and len(args) == 1 and isinstance(args[0], types.FunctionType):
+            return self._setup_func(args[0])
 
-        first_arg = func,
-        func_args = first_arg + rest
-        return self._wrapped_func(*func_args, **kwargs)
+        return self._wrapped_func(*args, **kwargs)
 
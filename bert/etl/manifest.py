@@ -0,0 +1,175 @@
+import json
+import logging
+import time
+import typing
+
+from bert import exceptions as bert_exceptions
+from bert.etl.storage import DatasetStorage, get_storage
+
+logger = logging.getLogger(__name__)
+PWN = typing.TypeVar('PWN')
+ENCODING = 'utf-8'
+MANIFEST_NAME: str = 'manifest.json'
+MANIFEST_VERSION: int = 1
+
+class DatasetManifest:
+    """
+    Index of the parts of an ETLDataset, kept next to them at `prefix/manifest.json`. Each part is listed with its
+        index, size, row count and sha256 checksum. Writers update it with conditional puts, so appending a part and
+        opening a dataset take a single GET instead of listing the prefix. Parts replaced by compaction are kept in
+        `retired`, with the time they left the manifest, until readers that loaded an older manifest are done.
+    """
+    def __init__(self: PWN, prefix: str, storage_url: str = None) -> None:
+        self._prefix = prefix
+        self._storage: DatasetStorage = get_storage(storage_url)
+        self._s3_key = f'{prefix}/{MANIFEST_NAME}'
+        self._etag: str = None
+        self.parts: typing.List[typing.Dict[str, typing.Any]] = []
+        self.retired: typing.List[typing.Dict[str, typing.Any]] = []
+        self.next_index = 0
+
+    def _list_parts(self: PWN) -> typing.List[typing.Dict[str, typing.Any]]:
+        # Datasets written before manifests existed, only listed once to build their manifest
+        parts: typing.List[typing.Dict[str, typing.Any]] = []
+        for key, size in self._storage.list(f'{self._prefix}/'):
+            part_name: str = key[len(self._prefix) + 1:].split('.', 1)[0]
+            if part_name.isdigit():
+                parts.append({'key': key, 'index': int(part_name), 'size': size, 'rows': None, 'checksum': None})
+
+        return sorted(parts, key=lambda part: part['index'])
+
+    def load(self: PWN) -> PWN:
+        try:
+            stored = self._storage.get(self._s3_key)
+        except bert_exceptions.DatasetKeyNotFound:
+            self._etag = None
+            self.retired = []
+            self.parts = self._list_parts()
+            self.next_index = max([part['index'] for part in self.parts] + [-1]) + 1
+            return self
+
+        manifest: typing.Dict[str, typing.Any] = json.loads(bytes(stored.body).decode(ENCODING))
+        self._etag = stored.etag
+        self.parts = manifest['parts']
+        self.retired = manifest.get('retired', [])
+        self.next_index = manifest['next-index']
+        return self
+
+    def _save(self: PWN) -> None:
+        self._etag = self._storage.put(
+            self._s3_key,
+            json.dumps({'version': MANIFEST_VERSION, 'next-index': self.next_index, 'parts': self.parts, 'retired': self.retired}).encode(ENCODING),
+            if_none_match=self._etag is None,
+            if_match=self._etag)
+
+    def reserve_index(self: PWN, retries: int = 10) -> int:
+        """
+        Take the next index for a part that is yet to be uploaded, so a writer's parts are indexed in the order it
+            reserved them rather than the order their uploads finish
+        """
+        for idx in range(0, retries):
+            index: int = self.next_index
+            self.next_index += 1
+            try:
+                self._save()
+            except bert_exceptions.DatasetPreconditionFailed:
+                self.load()
+                continue
+
+            return index
+
+        raise bert_exceptions.ManifestConflict(f'Unable to update Manifest[{self._s3_key}] after Retries[{retries}]')
+
+    def put_part(self: PWN, body: bytes, rows: int, checksum: str, suffix: str = 'ndjson', metadata: typing.Dict[str, str] = {}, retries: int = 10, index: int = None) -> typing.Dict[str, typing.Any]:
+        """
+        Upload `body` as the part at `index`, from reserve_index, or as the next part, and add it to the manifest. The
+            part is written with If-None-Match, so two writers never overwrite each other's part, and the manifest
+            with If-Match, reloading it on a conflict
+        """
+        part: typing.Dict[str, typing.Any] = None
+        reserved: int = index
+        for idx in range(0, retries):
+            if part is None:
+                index: int = self.next_index if reserved is None else reserved
+                reserved = None
+                try:
+                    self._storage.put(f'{self._prefix}/{index}.{suffix}', body, metadata, if_none_match=True)
+                except bert_exceptions.DatasetPreconditionFailed:
+                    self.load()
+                    self.next_index = max(self.next_index, index + 1)
+                    continue
+
+                part = {'key': f'{self._prefix}/{index}.{suffix}', 'index': index, 'size': len(body), 'rows': rows, 'checksum': checksum}
+
+            # A writer that opened the dataset by listing it may already have saved the part, without its rows
+            keys: typing.List[str] = [existing['key'] for existing in self.parts]
+            if part['key'] in keys:
+                self.parts[keys.index(part['key'])] = part
+
+            else:
+                self.parts.append(part)
+
+            self.next_index = max(self.next_index, part['index'] + 1)
+
+            try:
+                self._save()
+            except bert_exceptions.DatasetPreconditionFailed:
+                logger.info(f'Manifest[{self._s3_key}] changed remotely, reloading')
+                self.load()
+                continue
+
+            return part
+
+        raise bert_exceptions.ManifestConflict(f'Unable to update Manifest[{self._s3_key}] after Retries[{retries}]')
+
+    def reset(self: PWN) -> None:
+        """
+        Forget every part, after the dataset was cleared
+        """
+        self.parts = []
+        self.retired = []
+        self.next_index = 0
+        self._etag = None
+
+    def replace_parts(self: PWN, removed: typing.List[str], added: typing.List[typing.Dict[str, typing.Any]], retries: int = 10) -> bool:
+        """
+        Swap the parts at the keys in `removed` for `added` in one conditional write, so readers see either the old
+            parts or the new ones. The removed parts are retired rather than deleted. Returns False, without changing
+            anything, if one of them has left the manifest since
+        """
+        for idx in range(0, retries):
+            keys: typing.List[str] = [part['key'] for part in self.parts]
+            if not all([key in keys for key in removed]):
+                return False
+
+            retired_at: float = time.time()
+            parts: typing.List[typing.Dict[str, typing.Any]] = self.parts
+            retired: typing.List[typing.Dict[str, typing.Any]] = self.retired
+            self.parts = [part for part in parts if not part['key'] in removed] + added
+            self.retired = retired + [{'key': key, 'retired-at': retired_at} for key in removed]
+            try:
+                self._save()
+            except bert_exceptions.DatasetPreconditionFailed:
+                logger.info(f'Manifest[{self._s3_key}] changed remotely, reloading')
+                self.load()
+                continue
+
+            return True
+
+        raise bert_exceptions.ManifestConflict(f'Unable to update Manifest[{self._s3_key}] after Retries[{retries}]')
+
+    def forget_retired(self: PWN, keys: typing.List[str], retries: int = 10) -> None:
+        """
+        Drop retired parts from the manifest once they were deleted
+        """
+        for idx in range(0, retries):
+            self.retired = [part for part in self.retired if not part['key'] in keys]
+            try:
+                self._save()
+            except bert_exceptions.DatasetPreconditionFailed:
+                self.load()
+                continue
+
+            return None
+
+        raise bert_exceptions.ManifestConflict(f'Unable to update Manifest[{self._s3_key}] after Retries[{retries}]')
@@ -0,0 +1,131 @@
+"""
+Stage memoization for stages bound with `binding.follow(..., memoize=True)`. The outputs a stage puts on its done queue
+    while it works on an item are recorded against the hash of that item, under a prefix named after the source of
+    the stage and the encoders it runs with. A later run answers the items it has a record for from the record, and
+    the stage only sees items that are new or changed. Changing the stage or its encoders starts a new prefix.
+"""
+import collections
+import hashlib
+import inspect
+import logging
+import threading
+import types
+import typing
+
+from bert import encoders as bert_encoders, exceptions as bert_exceptions
+from bert.etl.constants import BERT_ETL_S3_PREFIX, ETL_STAGE_MEMO_WORKERS
+from bert.etl.functools import hash_value, encode_result, decode_result, ENCODE_ERRORS
+from bert.etl.storage import dataset_url
+from bert.etl.sync_utils import upload_dataset, download_dataset
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+PWN = typing.TypeVar('PWN')
+ENCODING = 'utf-8'
+
+def stage_hash(func: types.FunctionType) -> str:
+    """
+    Hash of the source of `func` and of the encoders and decoders loaded in this process
+    """
+    try:
+        source: str = inspect.getsource(func)
+    except (OSError, TypeError):
+        source: str = inspect.unwrap(func).__code__.co_code.hex()
+
+    encoders: typing.List[str] = [
+        f'{encoder.__module__}.{encoder.__name__}'
+        for encoder in bert_encoders.IDENTITY_ENCODERS + bert_encoders.QUEUE_ENCODERS + bert_encoders.QUEUE_DECODERS]
+    return hashlib.sha256('\n'.join([source] + encoders).encode(ENCODING)).hexdigest()
+
+class StageMemo:
+    """
+    Records of the outputs of one stage. Records are looked up ahead of the stage and uploaded while it moves on to
+        its next item, both on a thread pool of `workers` threads. `flush` waits for the uploads.
+    """
+    def __init__(self: PWN, func: types.FunctionType, workers: int = ETL_STAGE_MEMO_WORKERS) -> None:
+        self._stage_hash = stage_hash(func)
+        self._prefix = f'{BERT_ETL_S3_PREFIX}/stage-memo/{func.func_space}/{self._stage_hash[:16]}'
+        self._workers = max(1, workers)
+        self._executor: ThreadPoolExecutor = None
+        self._uploads: typing.Deque[Future] = collections.deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def workers(self: PWN) -> int:
+        return self._workers
+
+    def _pool(self: PWN) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+
+        return self._executor
+
+    def key(self: PWN, item: typing.Any) -> str:
+        """
+        Where the record of `item` is kept, None when the item can't be hashed and is never memoized
+        """
+        try:
+            return f'{self._prefix}/{hash_value(item)}'
+        except bert_exceptions.BertIdentityEncoderError as err:
+            logger.warning(f'Unable to hash an Item of Stage[{self._prefix}], it will not be memoized: {err}')
+            return None
+
+    def lookup(self: PWN, s3_key: str) -> typing.List[typing.Any]:
+        """
+        The outputs recorded for the item at `s3_key`, None when there's no record
+        """
+        if s3_key is None:
+            return None
+
+        try:
+            outputs: typing.List[typing.Any] = decode_result(download_dataset(s3_key, dataset_url(), dict))
+        except bert_exceptions.DatasetKeyNotFound:
+            with self._lock:
+                self.misses += 1
+
+            return None
+
+        with self._lock:
+            self.hits += 1
+
+        return outputs
+
+    def lookup_async(self: PWN, s3_key: str) -> Future:
+        """
+        `lookup` on the thread pool, so the records of the next items download while the stage works on this one
+        """
+        if s3_key is None:
+            future: Future = Future()
+            future.set_result(None)
+            return future
+
+        return self._pool().submit(self.lookup, s3_key)
+
+    def record(self: PWN, s3_key: str, outputs: typing.List[typing.Any]) -> None:
+        if s3_key is None:
+            return None
+
+        # Encoders work in-place, so the record is encoded here while the stage can't touch the outputs anymore
+        try:
+            encoded: typing.Dict[str, typing.Any] = encode_result(outputs)
+        except ENCODE_ERRORS as err:
+            logger.warning(f'Unable to encode the outputs of an Item of Stage[{self._prefix}], it will not be memoized: {err!r}')
+            return None
+
+        while len(self._uploads) >= self._workers * 2:
+            self._uploads.popleft().result()
+
+        self._uploads.append(self._pool().submit(upload_dataset, encoded, s3_key, dataset_url()))
+
+    def flush(self: PWN) -> None:
+        while len(self._uploads) > 0:
+            self._uploads.popleft().result()
+
+        if not self._executor is None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        logger.info(f'Stage[{self._prefix}] Hits[{self.hits}] Misses[{self.misses}]')
@@ -0,0 +1,340 @@
+"""
+Where bert.etl keeps its state, datasets and cached function results. A storage is picked by URL,
+
+    s3://bucket/optional/prefix     objects in S3, the default, built from DATASET_BUCKET
+    file:///path/to/directory       files in a local directory, for offline runs, backfills and benchmarks
+
+Set DATASET_URL to switch every ETLState, ETLDataset, ETLDatasetReader and cache_function_results at once. Keys are
+    the same relative paths on every backend.
+"""
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import typing
+
+from urllib.parse import urlparse
+
+from bert import aws as bert_aws, exceptions as bert_exceptions
+from bert.etl.constants import REQUEST_PAYER, ETL_LOCAL_MMAP
+
+logger = logging.getLogger(__name__)
+PWN = typing.TypeVar('PWN')
+ENCODING = 'utf-8'
+S3_CONFLICT_CODES: typing.List[str] = ['PreconditionFailed', 'ConditionalRequestConflict']
+S3_MISSING_CODES: typing.List[str] = ['NoSuchKey', '404', 'NotFound']
+S3_NOT_MODIFIED_CODES: typing.List[str] = ['304', 'NotModified']
+S3_DELETE_BATCH: int = 1000
+LOCAL_METADATA_SUFFIX: str = '.bert-metadata'
+LOCAL_TEMP_PREFIX: str = '.bert-tmp-'
+STORAGES: typing.Dict[str, 'DatasetStorage'] = {}
+STORAGES_LOCK = threading.Lock()
+
+class StoredObject(typing.NamedTuple):
+    body: typing.Any
+    metadata: typing.Dict[str, str]
+    etag: str
+
+class DatasetStorage:
+    url: str
+    # Objects of remote storages are worth keeping in the local DatasetCache
+    remote: bool = False
+    def get(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        """
+        The whole object. Raises DatasetKeyNotFound, or DatasetNotModified when it still has the etag `if_none_match`
+        """
+        raise NotImplementedError
+
+    def open(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        """
+        As get, with `body` as a readable stream to be closed by the caller
+        """
+        raise NotImplementedError
+
+    def read_range(self: PWN, key: str, start: int, length: int = None) -> bytes:
+        """
+        `length` bytes from `start`, or to the end without a length. A negative `start` counts from the end
+        """
+        raise NotImplementedError
+
+    def put(self: PWN, key: str, body: bytes, metadata: typing.Dict[str, str] = {}, if_none_match: bool = False, if_match: str = None) -> str:
+        """
+        Write `body` and return its etag. With `if_none_match` the key must not exist yet, with `if_match` it must
+            still have that etag, otherwise DatasetPreconditionFailed is raised and nothing is written
+        """
+        raise NotImplementedError
+
+    def upload(self: PWN, key: str, stream: typing.BinaryIO, metadata: typing.Dict[str, str] = {}, acl: str = None) -> None:
+        """
+        Write the rest of `stream`, without holding all of it in memory
+        """
+        raise NotImplementedError
+
+    def list(self: PWN, prefix: str) -> typing.Iterator[typing.Tuple[str, int]]:
+        """
+        Key and size of every object whose key starts with `prefix`
+        """
+        raise NotImplementedError
+
+    def delete(self: PWN, keys: typing.List[str]) -> None:
+        raise NotImplementedError
+
+class S3Storage(DatasetStorage):
+    remote: bool = True
+    def __init__(self: PWN, bucket_name: str, prefix: str = '') -> None:
+        self._bucket_name = bucket_name
+        self._prefix = prefix.strip('/')
+        self.url = f's3://{bucket_name}/{self._prefix}'.rstrip('/')
+
+    def _key(self: PWN, key: str) -> str:
+        return f'{self._prefix}/{key}' if self._prefix else key
+
+    def _raise_for(self: PWN, err: Exception, key: str) -> None:
+        code: str = err.response['Error']['Code']
+        if code in S3_MISSING_CODES:
+            raise bert_exceptions.DatasetKeyNotFound(f'{self.url}/{key}') from err
+
+        elif code in S3_CONFLICT_CODES:
+            raise bert_exceptions.DatasetPreconditionFailed(f'{self.url}/{key}') from err
+
+        elif code in S3_NOT_MODIFIED_CODES:
+            raise bert_exceptions.DatasetNotModified(f'{self.url}/{key}') from err
+
+        raise err
+
+    def open(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        from botocore.exceptions import ClientError
+        condition: typing.Dict[str, str] = {} if if_none_match is None else {'IfNoneMatch': if_none_match}
+        try:
+            response: typing.Dict[str, typing.Any] = bert_aws.client('s3').get_object(Bucket=self._bucket_name, Key=self._key(key), RequestPayer=REQUEST_PAYER, **condition)
+        except ClientError as err:
+            self._raise_for(err, key)
+
+        return StoredObject(response['Body'], response.get('Metadata', {}), response['ETag'])
+
+    def get(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        stored: StoredObject = self.open(key, if_none_match)
+        try:
+            return stored._replace(body=stored.body.read())
+        finally:
+            stored.body.close()
+
+    def read_range(self: PWN, key: str, start: int, length: int = None) -> bytes:
+        from botocore.exceptions import ClientError
+        if start < 0:
+            byte_range: str = f'bytes={start}'
+
+        else:
+            byte_range: str = f'bytes={start}-' if length is None else f'bytes={start}-{start + length - 1}'
+
+        try:
+            response: typing.Dict[str, typing.Any] = bert_aws.client('s3').get_object(Bucket=self._bucket_name, Key=self._key(key), Range=byte_range, RequestPayer=REQUEST_PAYER)
+        except ClientError as err:
+            self._raise_for(err, key)
+
+        with response['Body'] as body:
+            return body.read()
+
+    def put(self: PWN, key: str, body: bytes, metadata: typing.Dict[str, str] = {}, if_none_match: bool = False, if_match: str = None) -> str:
+        from botocore.exceptions import ClientError
+        condition: typing.Dict[str, str] = {}
+        if if_none_match:
+            condition['IfNoneMatch'] = '*'
+
+        if not if_match is None:
+            condition['IfMatch'] = if_match
+
+        try:
+            return bert_aws.client('s3').put_object(Bucket=self._bucket_name, Key=self._key(key), Body=body, Metadata=metadata, **condition)['ETag']
+        except ClientError as err:
+            self._raise_for(err, key)
+
+    def upload(self: PWN, key: str, stream: typing.BinaryIO, metadata: typing.Dict[str, str] = {}, acl: str = None) -> None:
+        extra_args: typing.Dict[str, typing.Any] = {'Metadata': metadata}
+        if acl:
+            extra_args['ACL'] = acl
+
+        bert_aws.client('s3').upload_fileobj(stream, self._bucket_name, self._key(key), ExtraArgs=extra_args)
+
+    def list(self: PWN, prefix: str) -> typing.Iterator[typing.Tuple[str, int]]:
+        paginator = bert_aws.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket_name, RequestPayer=REQUEST_PAYER, Prefix=self._key(prefix)):
+            for content in page.get('Contents', []):
+                yield content['Key'][len(self._key('')):], content['Size']
+
+    def delete(self: PWN, keys: typing.List[str]) -> None:
+        for idx in range(0, len(keys), S3_DELETE_BATCH):
+            bert_aws.client('s3').delete_objects(
+                Bucket=self._bucket_name,
+                Delete={
+                    'Objects': [{'Key': self._key(key)} for key in keys[idx:idx + S3_DELETE_BATCH]]
+                },
+                RequestPayer=REQUEST_PAYER)
+
+class LocalStorage(DatasetStorage):
+    """
+    Objects are files under `root`, written to a temporary file and renamed into place so readers never see a partial
+        object. Metadata and etags live in a hidden file next to each object. Conditional writes hold a lock file
+        while they compare etags, which is enough for processes on one host. With BERT_ETL_LOCAL_MMAP, `get` maps
+        the file instead of reading it
+    """
+    def __init__(self: PWN, root: str) -> None:
+        self._root = os.path.abspath(root)
+        self.url = f'file://{self._root}'
+
+    def _path(self: PWN, key: str) -> str:
+        path: str = os.path.abspath(os.path.join(self._root, key))
+        if not path.startswith(self._root + os.sep):
+            raise NotImplementedError(f'Key[{key}] is outside of Storage[{self.url}]')
+
+        return path
+
+    def _metadata_path(self: PWN, path: str) -> str:
+        dirname, filename = os.path.split(path)
+        return os.path.join(dirname, f'.{filename}{LOCAL_METADATA_SUFFIX}')
+
+    def _read_metadata(self: PWN, path: str) -> typing.Dict[str, typing.Any]:
+        try:
+            with open(self._metadata_path(path), 'rb') as stream:
+                return json.loads(stream.read().decode(ENCODING))
+        except FileNotFoundError:
+            stat = os.stat(path)
+            return {'metadata': {}, 'etag': f'"{stat.st_mtime_ns}-{stat.st_size}"'}
+
+    def _write_file(self: PWN, path: str, write: typing.Callable[[typing.BinaryIO], None]) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=LOCAL_TEMP_PREFIX, dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as stream:
+            write(stream)
+
+        return temp_path
+
+    def _commit(self: PWN, path: str, temp_path: str, metadata: typing.Dict[str, str], etag: str) -> str:
+        # Callers hold the lock, so readers never pair the metadata of one write with the body of another
+        metadata_body: bytes = json.dumps({'metadata': metadata, 'etag': etag}).encode(ENCODING)
+        temp_metadata_path: str = self._write_file(path, lambda stream: stream.write(metadata_body))
+        os.replace(temp_metadata_path, self._metadata_path(path))
+        os.replace(temp_path, path)
+        return etag
+
+    def _lock(self: PWN, path: str, operation: int) -> typing.BinaryIO:
+        import fcntl
+        lock: typing.BinaryIO = open(f'{self._metadata_path(path)}.lock', 'ab')
+        fcntl.flock(lock.fileno(), operation)
+        return lock
+
+    def open(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        import fcntl
+        path: str = self._path(key)
+        try:
+            # Shares the lock of writes, so the etag is the etag of the body that was opened. Otherwise a writer could
+            #   read an old body with the etag of a newer one and overwrite it with If-Match
+            with self._lock(path, fcntl.LOCK_SH):
+                stream: typing.BinaryIO = open(path, 'rb')
+                stored: typing.Dict[str, typing.Any] = self._read_metadata(path)
+
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError) as err:
+            raise bert_exceptions.DatasetKeyNotFound(f'{self.url}/{key}') from err
+
+        if not if_none_match is None and stored['etag'] == if_none_match:
+            stream.close()
+            raise bert_exceptions.DatasetNotModified(f'{self.url}/{key}')
+
+        return StoredObject(stream, stored['metadata'], stored['etag'])
+
+    def get(self: PWN, key: str, if_none_match: str = None) -> StoredObject:
+        stored: StoredObject = self.open(key, if_none_match)
+        with stored.body as stream:
+            if ETL_LOCAL_MMAP and os.fstat(stream.fileno()).st_size > 0:
+                # The mapping outlives the file descriptor, pages are read as the body is consumed
+                return stored._replace(body=mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+            return stored._replace(body=stream.read())
+
+    def read_range(self: PWN, key: str, start: int, length: int = None) -> bytes:
+        with self.open(key).body as stream:
+            stream.seek(max(0, os.fstat(stream.fileno()).st_size + start) if start < 0 else start)
+            return stream.read() if length is None else stream.read(length)
+
+    def put(self: PWN, key: str, body: bytes, metadata: typing.Dict[str, str] = {}, if_none_match: bool = False, if_match: str = None) -> str:
+        import fcntl
+        path: str = self._path(key)
+        etag: str = f'"{hashlib.md5(body).hexdigest()}"'
+        temp_path: str = self._write_file(path, lambda stream: stream.write(body))
+        with self._lock(path, fcntl.LOCK_EX):
+            exists: bool = os.path.exists(path)
+            if (if_none_match and exists) or (not if_match is None and (not exists or self._read_metadata(path)['etag'] != if_match)):
+                os.remove(temp_path)
+                raise bert_exceptions.DatasetPreconditionFailed(f'{self.url}/{key}')
+
+            return self._commit(path, temp_path, metadata, etag)
+
+    def upload(self: PWN, key: str, stream: typing.BinaryIO, metadata: typing.Dict[str, str] = {}, acl: str = None) -> None:
+        import fcntl
+        path: str = self._path(key)
+        checksum = hashlib.md5()
+        def _copy(output: typing.BinaryIO) -> None:
+            for chunk in iter(lambda: stream.read(io.DEFAULT_BUFFER_SIZE * 64), b''):
+                checksum.update(chunk)
+                output.write(chunk)
+
+        temp_path: str = self._write_file(path, _copy)
+        with self._lock(path, fcntl.LOCK_EX):
+            self._commit(path, temp_path, metadata, f'"{checksum.hexdigest()}"')
+
+    def list(self: PWN, prefix: str) -> typing.Iterator[typing.Tuple[str, int]]:
+        # Prefixes are matched against whole keys like S3, so the walk starts at the deepest directory they name
+        directory: str = os.path.join(self._root, os.path.dirname(prefix))
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith('.'):
+                    continue
+
+                key: str = os.path.relpath(os.path.join(dirpath, filename), self._root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key, os.path.getsize(os.path.join(dirpath, filename))
+
+    def delete(self: PWN, keys: typing.List[str]) -> None:
+        for key in keys:
+            path: str = self._path(key)
+            for filepath in [path, self._metadata_path(path), f'{self._metadata_path(path)}.lock']:
+                try:
+                    os.remove(filepath)
+                except FileNotFoundError:
+                    pass
+
+def dataset_url() -> str:
+    if os.environ.get('DATASET_URL', None):
+        return os.environ['DATASET_URL']
+
+    return f's3://{os.environ["DATASET_BUCKET"]}'
+
+def get_storage(url: str = None) -> DatasetStorage:
+    """
+    Storage for `url`, DATASET_URL by default. A bare name is taken to be an S3 bucket, as DATASET_BUCKET was
+    """
+    url = url or dataset_url()
+    with STORAGES_LOCK:
+        storage: DatasetStorage = STORAGES.get(url, None)
+        if storage is None:
+            parsed = urlparse(url)
+            if parsed.scheme == 's3':
+                storage = S3Storage(parsed.netloc, parsed.path)
+
+            elif parsed.scheme == 'file':
+                storage = LocalStorage(parsed.netloc + parsed.path)
+
+            elif parsed.scheme == '':
+                storage = S3Storage(url)
+
+            else:
+                raise NotImplementedError(f'Unsupported Storage[{url}]')
+
+            storage = STORAGES[url] = storage
+
+        return storage
@@ -1,41 +1,235 @@
-import boto3
-import enum
+import gzip
+import io
+import itertools
 import logging
 import json
-import os
-import tempfile
 import typing
+import zlib
 
+from bert.etl.constants import BERT_ETL_CODEC
 from bert.etl.security import AccessLevel
+from bert.etl.cache import DatasetCache, get_cache
+from bert.etl.columnar import ColumnarPart, Filter, matches, project
+from bert.etl.storage import DatasetStorage, StoredObject, get_storage
 
 ENCODING = 'utf-8'
+CHUNK_SIZE = 1024 * 1024
+CODECS: typing.List[str] = ['none', 'gzip', 'zstd']
+CODEC_SUFFIXES: typing.Dict[str, str] = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+COLUMNAR_SUFFIX = '.bcol'
+CODEC_METADATA_KEY = 'bert-codec'
+FORMAT_METADATA_KEY = 'bert-format'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
 logger = logging.getLogger(__name__)
-def upload_dataset(dataset: typing.Any, s3_key: str, bucket_name: str, access_level: AccessLevel = None) -> None:
-    filepath = tempfile.NamedTemporaryFile().name
-    with open(filepath, 'wb') as stream:
-        stream.write(json.dumps(dataset).encode(ENCODING))
 
-    logger.info(f'Uploading Dataset[{s3_key}]')
-    s3_client = boto3.client('s3')
-    if access_level:
-        s3_client.upload_file(filepath, bucket_name, s3_key, ExtraArgs={'ACL': access_level.value})
+def resolve_codec(codec: str = None) -> str:
+    codec = (codec or BERT_ETL_CODEC).lower()
+    if not codec in CODECS:
+        raise NotImplementedError(f'Unknown Codec[{codec}]')
+
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning('zstandard is not installed, falling back to Codec[gzip]')
+            return 'gzip'
+
+    return codec
+
+def sniff_codec(head: bytes) -> str:
+    if head[:2] == GZIP_MAGIC:
+        return 'gzip'
+
+    elif head[:4] == ZSTD_MAGIC:
+        return 'zstd'
+
+    return 'none'
+
+def codec_metadata(codec: str, data_format: str) -> typing.Dict[str, str]:
+    return {CODEC_METADATA_KEY: codec, FORMAT_METADATA_KEY: data_format}
+
+def compress_chunks(chunks: typing.Iterable[bytes], codec: str) -> typing.Iterator[bytes]:
+    if codec == 'none':
+        yield from chunks
+        return None
+
+    elif codec == 'gzip':
+        # wbits 31 writes the gzip container, the same bytes gzip.compress produces
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    elif codec == 'zstd':
+        import zstandard
+        compressor = zstandard.ZstdCompressor().compressobj()
 
     else:
-        s3_client.upload_file(filepath, bucket_name, s3_key)
+        raise NotImplementedError(f'Unknown Codec[{codec}]')
+
+    for chunk in chunks:
+        compressed: bytes = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+def decompress_stream(stream: typing.BinaryIO, codec: str) -> typing.BinaryIO:
+    if codec == 'none':
+        return stream
+
+    elif codec == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+
+    elif codec == 'zstd':
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream), CHUNK_SIZE)
+
+    raise NotImplementedError(f'Unknown Codec[{codec}]')
+
+class ChunkStream(io.RawIOBase):
+    """
+    Readable file object over an iterator of bytes, so generated data can be handed to boto3 or a decompressor
+        without joining it into one buffer first
+    """
+    def __init__(self, chunks: typing.Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf: typing.Any) -> int:
+        while len(self._buffer) == 0:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size: int = min(len(buf), len(self._buffer))
+        buf[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def _open_stream(read: typing.Callable[[int], bytes], codec: str = None) -> typing.BinaryIO:
+    head: bytes = read(4)
+    chunks: typing.Iterator[bytes] = itertools.chain([head], iter(lambda: read(CHUNK_SIZE), b''))
+    return decompress_stream(io.BufferedReader(ChunkStream(chunks), CHUNK_SIZE), codec or sniff_codec(head))
+
+def encode_record(record: typing.Any) -> bytes:
+    return json.dumps(record).encode(ENCODING) + b'\n'
 
-def download_dataset(s3_key: str, bucket_name: str, expected_datastructure: typing.Any = list) -> typing.Any:
-    filepath = tempfile.NamedTemporaryFile().name
+def _encode_records(records: typing.Iterable[typing.Any]) -> typing.Iterator[bytes]:
+    for record in records:
+        yield encode_record(record)
+
+def data_format(s3_key: str, metadata: typing.Dict[str, str]) -> str:
+    """
+    `ndjson` or `json`, from the bert metadata of the object. Objects written without it are `ndjson` only when their
+        key says so, `.json` datasets of older releases are a single JSON document
+    """
+    recorded: str = metadata.get(FORMAT_METADATA_KEY, None)
+    if recorded is None:
+        return 'ndjson' if '.ndjson' in s3_key.rsplit('/', 1)[-1] else 'json'
+
+    return recorded
+
+def _iter_stream(stream: typing.BinaryIO, stream_format: str = 'ndjson') -> typing.Iterator[typing.Any]:
+    # Rows can be JSON arrays themselves, so a single JSON array is only ever told apart by the format
+    if stream_format == 'json':
+        yield from json.loads(stream.read().decode(ENCODING))
+        return None
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+def dump_records(records: typing.Iterable[typing.Any], codec: str = 'none') -> bytes:
+    """
+    Newline-delimited JSON, one record per line, so readers can parse a part one record at a time
+    """
+    return b''.join(compress_chunks(_encode_records(records), codec))
+
+def iter_records(body: typing.Union[bytes, typing.BinaryIO], stream_format: str = 'ndjson') -> typing.Iterator[typing.Any]:
+    # Memory-mapped parts are read in place rather than copied into a BytesIO
+    stream: typing.BinaryIO = body if hasattr(body, 'read') else io.BytesIO(body)
+    yield from _iter_stream(_open_stream(stream.read), stream_format)
+
+def _open_object(s3_key: str, storage_url: str) -> StoredObject:
+    storage: DatasetStorage = get_storage(storage_url)
+    cache: DatasetCache = get_cache(storage)
+    return storage.open(s3_key) if cache is None else cache.open(storage, s3_key)
+
+def read_dataset_bytes(s3_key: str, storage_url: str) -> typing.Union[bytes, typing.BinaryIO]:
+    """
+    The body of the object, memory-mapped from the local cache when the storage is remote
+    """
+    return _read_dataset(s3_key, storage_url).body
+
+def _read_dataset(s3_key: str, storage_url: str) -> StoredObject:
     logger.info(f'Downloading Dataset[{s3_key}]')
-    s3_client = boto3.client('s3')
-    s3_client.download_file(bucket_name, s3_key, filepath)
-    if expected_datastructure in [list, dict]:
-        with open(filepath, 'rb') as stream:
-            result = json.loads(stream.read().decode(ENCODING))
-            if isinstance(result, expected_datastructure):
-                return result
-            else:
-                raise NotImplementedError(f'Expected Datatype[{expected_datastructure}] miss-match')
+    storage: DatasetStorage = get_storage(storage_url)
+    cache: DatasetCache = get_cache(storage)
+    return storage.get(s3_key) if cache is None else cache.get(storage, s3_key)
+
+def read_part(s3_key: str, storage_url: str, columns: typing.List[str] = None, filters: typing.List[Filter] = []) -> typing.Iterable[typing.Any]:
+    """
+    Rows of an ETLDataset part, only those matching `filters` and only their `columns`. Columnar parts are read
+        with ranged GETs and materialized, so the fetching happens in the caller's thread. Other parts are
+        downloaded whole and parsed lazily
+    """
+    if s3_key.endswith(COLUMNAR_SUFFIX):
+        logger.info(f'Reading Dataset[{s3_key}] Columns[{columns}]')
+        return list(ColumnarPart(get_storage(storage_url), s3_key).read(columns, filters))
+
+    stored: StoredObject = _read_dataset(s3_key, storage_url)
+    rows: typing.Iterator[typing.Any] = iter_records(stored.body, data_format(s3_key, stored.metadata))
+    if columns is None and len(filters) == 0:
+        return rows
+
+    return (row if columns is None else project(row, columns) for row in rows if matches(row, filters))
+
+def upload_dataset(dataset: typing.Any, s3_key: str, storage_url: str, access_level: AccessLevel = None, codec: str = None) -> None:
+    """
+    Lists are written as newline-delimited JSON and everything else as one JSON document. Either way the bytes are
+        compressed as they're generated and streamed into the storage, a multipart upload on S3, and the codec is
+        recorded in the object metadata. `storage_url` is a storage URL or, as before, the name of an S3 bucket
+    """
+    codec = resolve_codec(codec)
+    if isinstance(dataset, list):
+        data_format: str = 'ndjson'
+        chunks: typing.Iterator[bytes] = _encode_records(dataset)
 
     else:
+        data_format: str = 'json'
+        chunks: typing.Iterator[bytes] = iter([json.dumps(dataset).encode(ENCODING)])
+
+    logger.info(f'Uploading Dataset[{s3_key}] Codec[{codec}]')
+    stream: typing.BinaryIO = io.BufferedReader(ChunkStream(compress_chunks(chunks, codec)), CHUNK_SIZE)
+    get_storage(storage_url).upload(s3_key, stream, codec_metadata(codec, data_format), access_level.value if access_level else None)
+
+def download_dataset(s3_key: str, storage_url: str, expected_datastructure: typing.Any = list) -> typing.Any:
+    """
+    Reads the object through its streaming body. Objects without bert metadata, such as `.json` datasets written by
+        older releases, have their codec sniffed from the leading bytes
+    """
+    if not expected_datastructure in [list, dict]:
         raise NotImplementedError(f'Unexpeceted DataStructure[{expected_datastructure}]')
 
+    logger.info(f'Downloading Dataset[{s3_key}]')
+    stored: StoredObject = _open_object(s3_key, storage_url)
+    metadata: typing.Dict[str, str] = stored.metadata
+    stream: typing.BinaryIO = _open_stream(stored.body.read, metadata.get(CODEC_METADATA_KEY, None))
+    try:
+        if data_format(s3_key, metadata) == 'ndjson':
+            result: typing.Any = list(_iter_stream(stream))
+
+        else:
+            result: typing.Any = json.load(stream)
+
+    finally:
+        stored.body.close()
+
+    if isinstance(result, expected_datastructure):
+        return result
+
+    raise NotImplementedError(f'Expected Datatype[{expected_datastructure}] miss-match')
+
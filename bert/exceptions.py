@@ -21,3 +21,21 @@ class AWSError(BertException):
 
 class BertIdentityEncoderError(BertException):
     pass
+
+class ETLStateConflict(BertException):
+    pass
+
+class DatasetKeyNotFound(BertException):
+    pass
+
+class DatasetPreconditionFailed(BertException):
+    pass
+
+class DatasetNotModified(BertException):
+    pass
+
+class DatasetFormatError(BertException):
+    pass
+
+class ManifestConflict(BertException):
+    pass
@@ -1,13 +1,20 @@
-import boto3
+import collections
 import copy
 import hashlib
 import logging
 import json
+import os
+import queue
+import random
+import socket
+import threading
 import time
 import typing
 import uuid
+import zlib
 
 from bert import \
+    aws as bert_aws, \
     encoders as bert_encoders, \
     datasource as bert_datasource, \
     constants as bert_constants
@@ -17,6 +24,17 @@ from datetime import datetime, timedelta
 logger = logging.getLogger(__name__)
 PWN = typing.TypeVar('PWN')
 DELAY: int = 15
+# FusedQueues active in this process, keyed by the work_key/done_key they stand in for
+FUSED_QUEUES: typing.Dict[str, 'FusedQueue'] = {}
+_FUSED_STOP: object = object()
+
+class PartitionSpec(typing.NamedTuple):
+    shards: int
+    # Name of the field, or a function of the item, that items are partitioned on. Items without a key are spread randomly
+    key: typing.Union[str, typing.Callable[[typing.Any], typing.Any], None] = None
+
+# Work keys read by partitioned stages, registered through `binding.follow(..., partitions=N)`
+PARTITIONED_QUEUES: typing.Dict[str, PartitionSpec] = {}
 
 class QueueItem:
     __slots__ = ('_payload', '_identity')
@@ -97,7 +115,7 @@ class DynamodbQueue(BaseQueue):
     _dynamodb_client: 'boto3.client("dynamodb")'
     def __init__(self: PWN, table_name: str) -> None:
         super(DynamodbQueue, self).__init__(table_name)
-        self._dynamodb_client = boto3.client('dynamodb')
+        self._dynamodb_client = bert_aws.client('dynamodb')
 
     def _destroy(self: PWN, queue_item: QueueItem, confirm_delete: bool = False) -> None:
         if confirm_delete:
@@ -179,7 +197,16 @@ class RedisQueue(BaseQueue):
             # if self._cache_backend.has(value):
             #     return self._cache_backend.obtain(value)
 
-            return bert_encoders.decode_object(json.loads(value)['datum'])
+            return self._decode_value(value)
+
+    def _decode_value(self: PWN, value: str) -> typing.Any:
+        return bert_encoders.decode_object(json.loads(value)['datum'])
+
+    def _encode_value(self: PWN, value: typing.Any) -> bytes:
+        return json.dumps(bert_encoders.encode_object({
+            'identity': 'local-queue',
+            'datum': value
+        })).encode(bert_constants.ENCODING)
 
     async def get_async(self: PWN, prefetch: int = 1) -> typing.List[QueueItem]:
         await self._resolve_connection()
@@ -187,26 +214,193 @@ class RedisQueue(BaseQueue):
         batch = await self._redis_client_async.execute('lrange', self._table_name, 0, prefetch - 1)
         if batch:
             await self._redis_client_async.execute('ltrim', self._table_name, len(batch), list_len)
-            return [bert_encoders.decode_object(json.loads(value.decode(bert_constants.ENCODING))['datum']) for value in batch]
+            return [self._decode_value(value.decode(bert_constants.ENCODING)) for value in batch]
 
         return []
 
     def put(self: PWN, value: typing.Dict[str, typing.Any]) -> None:
-        encoded_value = json.dumps(bert_encoders.encode_object({
-            'identity': 'local-queue',
-            'datum': value
-        })).encode(bert_constants.ENCODING)
+        encoded_value = self._encode_value(value)
         # self._cache_backend.store(encoded_value)
         self._redis_client.rpush(self._table_name, encoded_value)
 
     async def put_async(self: PWN, values: typing.List[typing.Dict[str, typing.Any]]) -> None:
         await self._resolve_connection()
-        encoded_values = [json.dumps(bert_encoders.encode_object({
-            'identity': 'local-queue',
-            'datum': value,
-        })).encode(bert_constants.ENCODING) for value in values]
+        encoded_values = [self._encode_value(value) for value in values]
         await self._redis_client_async.execute('rpush', self._table_name, *encoded_values)
 
+# Take the lease of a shard, or extend it when this worker already holds it
+_ACQUIRE_LEASE_SCRIPT: str = """
+local owner = redis.call('get', KEYS[1])
+if owner == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+elseif owner == false then
+    redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT: str = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class ShardedRedisQueue(RedisQueue):
+    """
+    Work queue of a stage bound with `binding.follow(..., partitions=N)`. `put` hashes the partition key of each item
+        into one of N shard lists, so one hot list no longer caps throughput and items sharing a key stay in order.
+        Shard keys use hash tags, `{table_name:shard}`, which lets Redis Cluster place each shard on a different node.
+
+    Workers register with a heartbeat and split the shards between them. Each worker holds a lease on the shards it
+        consumes, so only one worker pops from a shard at a time. Shards move to other workers as workers come and go.
+        A thread renews the heartbeat and the leases while the stage works on an item, so a slow item doesn't cost
+        the worker its shards.
+    """
+    _partition_spec: PartitionSpec
+    _worker_id: str
+    _owned_shards: typing.List[int]
+    _last_balance: float
+    _heartbeat: threading.Event
+    def __init__(self: PWN, table_name: str, partition_spec: PartitionSpec) -> None:
+        super(ShardedRedisQueue, self).__init__(table_name)
+        self._partition_spec = partition_spec
+        self._worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4()}'
+        self._owned_shards = []
+        self._shard_offset = 0
+        self._last_balance = None
+        self._heartbeat = None
+        self._lease_lock = threading.Lock()
+        self._acquire_lease = self._redis_client.register_script(_ACQUIRE_LEASE_SCRIPT)
+        self._release_lease = self._redis_client.register_script(_RELEASE_LEASE_SCRIPT)
+
+    def _shard_key(self: PWN, shard: int) -> str:
+        return f'{{{self._table_name}:{shard}}}:queue'
+
+    def _lease_key(self: PWN, shard: int) -> str:
+        return f'{{{self._table_name}:{shard}}}:lease'
+
+    def _workers_key(self: PWN) -> str:
+        return f'{self._table_name}:workers'
+
+    def calc_shard(self: PWN, value: typing.Any) -> int:
+        partition_key: typing.Any = self._partition_spec.key
+        if partition_key is None:
+            return random.randrange(self._partition_spec.shards)
+
+        elif callable(partition_key):
+            partition_value: typing.Any = partition_key(value)
+
+        else:
+            partition_value: typing.Any = value.get(partition_key, None)
+
+        # python's hash() is salted per process, crc32 puts the same key in the same shard on every host
+        return zlib.crc32(str(partition_value).encode(bert_constants.ENCODING)) % self._partition_spec.shards
+
+    def _rebalance(self: PWN) -> None:
+        with self._lease_lock:
+            self._rebalance_shards()
+
+        if self._heartbeat is None:
+            self._heartbeat = threading.Event()
+            threading.Thread(target=self._renew_leases, args=(self._heartbeat, ), daemon=True).start()
+
+    def _rebalance_shards(self: PWN) -> None:
+        now: float = time.time()
+        lease_ms: int = int(bert_constants.PARTITION_LEASE * 1000)
+        self._redis_client.zadd(self._workers_key(), {self._worker_id: now})
+        self._redis_client.zremrangebyscore(self._workers_key(), '-inf', now - bert_constants.PARTITION_LEASE)
+        # Sorted by id, not by heartbeat, so the assignment only changes when workers come or go
+        workers: typing.List[str] = sorted([worker.decode(bert_constants.ENCODING) for worker in self._redis_client.zrange(self._workers_key(), 0, -1)])
+        worker_idx: int = workers.index(self._worker_id)
+        wanted: typing.List[int] = [shard for shard in range(self._partition_spec.shards) if shard % len(workers) == worker_idx]
+        for shard in self._owned_shards:
+            if not shard in wanted:
+                self._release_lease(keys=[self._lease_key(shard)], args=[self._worker_id])
+
+        owned_shards: typing.List[int] = [shard for shard in wanted if self._acquire_lease(keys=[self._lease_key(shard)], args=[self._worker_id, lease_ms]) == 1]
+        if owned_shards != self._owned_shards:
+            logger.info(f'Worker[{self._worker_id}] owns Shards[{",".join([str(shard) for shard in owned_shards])}] of Queue[{self._table_name}]')
+
+        self._owned_shards = owned_shards
+        self._last_balance = now
+
+    def _renew_leases(self: PWN, stopped: threading.Event) -> None:
+        # Runs until release, three renewals fit in a lease so one slow round trip to Redis doesn't lose the shards
+        while not stopped.wait(bert_constants.PARTITION_LEASE / 3):
+            lease_ms: int = int(bert_constants.PARTITION_LEASE * 1000)
+            try:
+                with self._lease_lock:
+                    if stopped.is_set():
+                        break
+
+                    self._redis_client.zadd(self._workers_key(), {self._worker_id: time.time()})
+                    self._owned_shards = [shard for shard in self._owned_shards if self._acquire_lease(keys=[self._lease_key(shard)], args=[self._worker_id, lease_ms]) == 1]
+
+            except Exception as err:
+                logger.warning(f'Worker[{self._worker_id}] failed to renew its leases of Queue[{self._table_name}]: {err}')
+
+    def release(self: PWN) -> None:
+        with self._lease_lock:
+            if not self._heartbeat is None:
+                self._heartbeat.set()
+                self._heartbeat = None
+
+            for shard in self._owned_shards:
+                self._release_lease(keys=[self._lease_key(shard)], args=[self._worker_id])
+
+            self._redis_client.zrem(self._workers_key(), self._worker_id)
+            self._owned_shards = []
+            self._last_balance = None
+
+    def size(self: PWN) -> int:
+        pipeline = self._redis_client.pipeline(transaction=False)
+        for shard in range(self._partition_spec.shards):
+            pipeline.llen(self._shard_key(shard))
+
+        return sum([int(length) for length in pipeline.execute()])
+
+    async def size_async(self: PWN) -> int:
+        await self._resolve_connection()
+        return sum([int(await self._redis_client_async.execute('llen', self._shard_key(shard))) for shard in range(self._partition_spec.shards)])
+
+    def get(self: PWN) -> QueueItem:
+        while True:
+            if self._last_balance is None or time.time() - self._last_balance > bert_constants.PARTITION_REBALANCE:
+                self._rebalance()
+
+            # The heartbeat replaces the list when a lease is lost, it's never changed in place
+            owned_shards: typing.List[int] = self._owned_shards
+            for idx in range(0, len(owned_shards)):
+                shard: int = owned_shards[self._shard_offset % len(owned_shards)]
+                self._shard_offset += 1
+                value: bytes = self._redis_client.lpop(self._shard_key(shard))
+                if not value is None:
+                    return self._decode_value(value.decode(bert_constants.ENCODING))
+
+            # The shards of other workers, or shards whose lease hasn't expired yet, may still hold items. The worker
+            #   waits for those to drain or move to it, and only stops once every shard is empty
+            if self.size() == 0:
+                self.release()
+                return 'STOP'
+
+            time.sleep(bert_constants.DELAY)
+            self._last_balance = None
+
+    async def get_async(self: PWN, prefetch: int = 1) -> typing.List[QueueItem]:
+        raise NotImplementedError(f'Partitioned Queue[{self._table_name}] only supports `get`')
+
+    def put(self: PWN, value: typing.Dict[str, typing.Any]) -> None:
+        # Encoders work in-place, the shard is calculated from the item before it's encoded
+        shard: int = self.calc_shard(value)
+        self._redis_client.rpush(self._shard_key(shard), self._encode_value(value))
+
+    async def put_async(self: PWN, values: typing.List[typing.Dict[str, typing.Any]]) -> None:
+        await self._resolve_connection()
+        for value in values:
+            shard: int = self.calc_shard(value)
+            await self._redis_client_async.execute('rpush', self._shard_key(shard), self._encode_value(value))
+
 class StreamingQueue(DynamodbQueue):
     """
     When deploying functions to AWS Lambda, auto-invocation is available as an option to run the functions. With StreamingQueue, we want to push local objects into
@@ -263,3 +457,185 @@ class LocalQueue(DynamodbQueue):
         else:
             return value
 
+
+class BroadcastQueue(BaseQueue):
+    """
+    Done queue of a stage followed by more than one stage, or feeding a join stage. Each item put is copied into the
+        work queue of every child.
+    """
+    _queues: typing.List[BaseQueue]
+    def __init__(self: PWN, table_name: str, queues: typing.List[BaseQueue]) -> None:
+        super(BroadcastQueue, self).__init__(table_name)
+        self._queues = queues
+
+    def _destroy(self: PWN, queue_item: typing.Any) -> None:
+        pass
+
+    def size(self: PWN) -> int:
+        return sum([queue.size() for queue in self._queues])
+
+    def put(self: PWN, value: typing.Any) -> None:
+        # Encoders work in-place, every queue gets its own copy
+        for queue in self._queues[:-1]:
+            queue.put(copy.deepcopy(value))
+
+        self._queues[-1].put(value)
+
+    async def put_async(self: PWN, values: typing.List[typing.Any]) -> None:
+        for queue in self._queues[:-1]:
+            await queue.put_async(copy.deepcopy(values))
+
+        await self._queues[-1].put_async(values)
+
+class FusedQueue(BaseQueue):
+    """
+    Stages bound with `binding.follow(..., fuse=True)` run in the same process as their parent. FusedQueue stands in for
+        the queue between two fused stages and hands items over as plain python objects, skipping the encoders and the
+        round trip through Redis or Dynamodb. The queue is bounded, so a fast producer waits on a slow consumer.
+    """
+    _queue: queue.Queue
+    _aborted: bool
+    def __init__(self: PWN, table_name: str, maxsize: int = bert_constants.FUSED_QUEUE_SIZE) -> None:
+        super(FusedQueue, self).__init__(table_name)
+        self._queue = queue.Queue(maxsize)
+        self._aborted = False
+
+    def _destroy(self: PWN, queue_item: typing.Any) -> None:
+        pass
+
+    def size(self: PWN) -> int:
+        return self._queue.qsize()
+
+    def get(self: PWN) -> typing.Any:
+        value: typing.Any = self._queue.get()
+        if value is _FUSED_STOP:
+            # Leave the marker in place, so every later `get` stops as well
+            self._queue.put(_FUSED_STOP)
+            return 'STOP'
+
+        return value
+
+    def put(self: PWN, value: typing.Any) -> None:
+        while not self._aborted:
+            try:
+                self._queue.put(value, timeout=bert_constants.DELAY)
+            except queue.Full:
+                continue
+
+            else:
+                break
+
+    def close(self: PWN) -> None:
+        """
+        Called once the upstream stage returns. Consumers drain what is left and then stop iterating
+        """
+        self._queue.put(_FUSED_STOP)
+
+    def abort(self: PWN) -> None:
+        """
+        Called when the downstream stage fails, so the upstream stage doesn't block forever on a full queue
+        """
+        self._aborted = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+_NO_ITEM: object = object()
+
+class MemoWorkQueue(BaseQueue):
+    """
+    Work queue of a stage bound with `binding.follow(..., memoize=True)`. Items with a record from an earlier run have
+        their recorded outputs put on the done queue and are skipped, the stage only sees the others. Whatever the
+        stage puts on the MemoDoneQueue while it works on an item is recorded once it asks for the next item, or once
+        the queue runs dry, so an item the stage failed on is never recorded. The records of the next `memo.workers`
+        items are looked up while the stage works, those items are taken off the work queue early. See
+        bert.etl.memo.StageMemo
+    """
+    _queue: BaseQueue
+    _done_queue: BaseQueue
+    def __init__(self: PWN, work_queue: BaseQueue, done_queue: BaseQueue, memo: 'bert.etl.memo.StageMemo') -> None:
+        super(MemoWorkQueue, self).__init__(work_queue._table_name)
+        self._queue = work_queue
+        self._done_queue = done_queue
+        self._memo = memo
+        self._key: str = None
+        self._item: typing.Any = _NO_ITEM
+        self._outputs: typing.List[typing.Any] = []
+        self._ahead: typing.Deque[typing.Tuple[typing.Any, str, 'concurrent.futures.Future']] = collections.deque()
+        self._exhausted = False
+
+    def _destroy(self: PWN, queue_item: typing.Any) -> None:
+        pass
+
+    def size(self: PWN) -> int:
+        return self._queue.size() + len(self._ahead)
+
+    def put(self: PWN, value: typing.Any) -> None:
+        # Seeding the work queue, invoke args for example, goes straight through
+        self._queue.put(value)
+
+    def local_put(self: PWN, record: typing.Any) -> None:
+        self._queue.local_put(record)
+
+    def capture(self: PWN, value: typing.Any) -> None:
+        if not self._item is _NO_ITEM:
+            self._outputs.append(copy.deepcopy(value))
+
+    def _record(self: PWN) -> None:
+        if not self._item is _NO_ITEM:
+            self._memo.record(self._key, self._outputs)
+
+        self._key, self._item, self._outputs = None, _NO_ITEM, []
+
+    def _prefetch(self: PWN) -> None:
+        while not self._exhausted and len(self._ahead) < self._memo.workers:
+            try:
+                item: typing.Any = next(self._queue)
+            except StopIteration:
+                self._exhausted = True
+                break
+
+            # Hashed before the stage sees the item, stages often change their items in place
+            key: str = self._memo.key(item)
+            self._ahead.append((item, key, self._memo.lookup_async(key)))
+
+    def __next__(self: PWN) -> typing.Any:
+        self._record()
+        while True:
+            self._prefetch()
+            if len(self._ahead) == 0:
+                self._exhausted = False
+                self._memo.flush()
+                raise StopIteration
+
+            item, key, lookup = self._ahead.popleft()
+            outputs: typing.List[typing.Any] = lookup.result()
+            if outputs is None:
+                self._key, self._item = key, item
+                return item
+
+            for output in outputs:
+                self._done_queue.put(output)
+
+class MemoDoneQueue(BaseQueue):
+    """
+    Done queue of a memoized stage, hands a copy of every output to its MemoWorkQueue before putting it
+    """
+    _queue: BaseQueue
+    _work_queue: MemoWorkQueue
+    def __init__(self: PWN, done_queue: BaseQueue, work_queue: MemoWorkQueue) -> None:
+        super(MemoDoneQueue, self).__init__(done_queue._table_name)
+        self._queue = done_queue
+        self._work_queue = work_queue
+
+    def _destroy(self: PWN, queue_item: typing.Any) -> None:
+        pass
+
+    def size(self: PWN) -> int:
+        return self._queue.size()
+
+    def put(self: PWN, value: typing.Any) -> None:
+        self._work_queue.capture(value)
+        self._queue.put(value)
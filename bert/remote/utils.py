@@ -18,7 +18,7 @@ class RemoteConfig(collections.namedtuple('RemoteConfig', constants.REMOTE_CONFI
     conn: bert_datasource.RedisConnection = bert_datasource.RedisConnection.ParseURL(constants.REDIS_URL)
     config: typing.Dict[str, str] = {}
     for key in constants.REMOTE_CONFIG_KEYS:
-      config[key] = conn.client.hget(constants.REMOTE_CONFIG_SPACE, key) or None
+      config[key] = conn.client().hget(constants.REMOTE_CONFIG_SPACE, key) or None
       if config[key]:
         config[key] = config[key].decode(constants.ENCODING)
 
@@ -26,7 +26,7 @@ class RemoteConfig(collections.namedtuple('RemoteConfig', constants.REMOTE_CONFI
       if not key in constants.REMOTE_CONFIG_KEYS:
         raise NotImplementedError(f'Key not allowed[{key}]')
 
-      conn.client.hset(constants.REMOTE_CONFIG_SPACE, key, updates[key])
+      conn.client().hset(constants.REMOTE_CONFIG_SPACE, key, updates[key])
       config[key] = updates[key]
 
     return cls(**config)
@@ -36,7 +36,7 @@ class RemoteConfig(collections.namedtuple('RemoteConfig', constants.REMOTE_CONFI
     conn: bert_datasource.RedisConnection = bert_datasource.RedisConnection.ParseURL(constants.REDIS_URL)
     config: typing.Dict[str, str] = {}
     for key in constants.REMOTE_CONFIG_KEYS:
-      config[key] = conn.client.hget(constants.REMOTE_CONFIG_SPACE, key) or None
+      config[key] = conn.client().hget(constants.REMOTE_CONFIG_SPACE, key) or None
       if config[key]:
         config[key] = config[key].decode(constants.ENCODING)
 
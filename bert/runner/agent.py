@@ -0,0 +1,205 @@
+#!/usr/env/bin python
+
+"""
+Worker-agent mode for bert-runner.py. Any number of hosts run `bert-runner.py -m module --agent` against the same
+    REDIS_URL. Each agent registers with a heartbeat, one of them holds the coordinator lease and publishes which jobs
+    may run, and every agent starts workers for those jobs on its own cores. Jobs move to the next level of the
+    pipeline once every live agent has drained them, which is recorded in Redis so any agent can take over as
+    coordinator.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import typing
+import uuid
+
+from bert import \
+    utils as bert_utils, \
+    constants as bert_constants, \
+    encoders as bert_encoders, \
+    datasource as bert_datasource
+
+from bert.runner import manager as runner_manager
+
+logger = logging.getLogger(__name__)
+PWN = typing.TypeVar('PWN')
+AGENT_SPACE: str = 'bert-etl-agent'
+STOP_AGENT: bool = False
+# Take the coordinator lease, or extend it when this agent already holds it. 2 when taken, 1 when extended
+_COORDINATOR_LEASE_SCRIPT: str = """
+local owner = redis.call('get', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return 1
+elseif owner == false then
+    redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 2
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT: str = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def handle_signal(sig, frame):
+    # SIGTERM stops the agent after its current round, run() then leaves the run and releases its lease
+    global STOP_AGENT
+    STOP_AGENT = True
+
+def _run_job_worker(conf: typing.Dict[str, typing.Any]) -> None:
+    # Workers are forked from the agent, they die on SIGTERM rather than inherit its handler
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    runner_manager.run_job_worker(conf)
+
+class Agent:
+    _jobs: typing.Dict[str, typing.Any]
+    _agent_id: str
+    _space: str
+    _processes: typing.Dict[str, typing.List[multiprocessing.Process]]
+    def __init__(self: PWN, options: argparse.Namespace, jobs: typing.Dict[str, typing.Any]) -> None:
+        self._options = options
+        self._jobs = jobs
+        self._agent_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4()}'
+        self._space = f'{AGENT_SPACE}:{options.module_name}:{options.agent_run_id}'
+        self._client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
+        self._lease_script = self._client.register_script(_COORDINATOR_LEASE_SCRIPT)
+        self._release_script = self._client.register_script(_RELEASE_LEASE_SCRIPT)
+        self._processes = {}
+        self._finished: typing.List[str] = []
+
+    def _key(self: PWN, *parts: typing.List[str]) -> str:
+        return ':'.join([self._space] + list(parts))
+
+    def heartbeat(self: PWN) -> typing.List[str]:
+        now: float = time.time()
+        self._client.zadd(self._key('agents'), {self._agent_id: now})
+        self._client.zremrangebyscore(self._key('agents'), '-inf', now - bert_constants.AGENT_LEASE)
+        return [agent_id.decode(bert_constants.ENCODING) for agent_id in self._client.zrange(self._key('agents'), 0, -1)]
+
+    def is_coordinator(self: PWN) -> bool:
+        lease_ms: int = int(bert_constants.AGENT_LEASE * 1000)
+        # Checked and extended in one script, so a lease that expired and was taken by another agent is never extended
+        leased: int = int(self._lease_script(keys=[self._key('coordinator')], args=[self._agent_id, lease_ms]))
+        if leased == 2:
+            logger.info(f'Agent[{self._agent_id}] is now the coordinator')
+
+        return leased > 0
+
+    def coordinate(self: PWN, agents: typing.List[str]) -> None:
+        completed: typing.List[str] = [job_name.decode(bert_constants.ENCODING) for job_name in self._client.smembers(self._key('completed'))]
+        for level in bert_utils.job_levels(self._jobs):
+            pending: typing.List[str] = []
+            for job_name in level:
+                conf: typing.Dict[str, typing.Any] = self._jobs[job_name]
+                if conf['spaces']['fused'] or job_name in completed:
+                    continue
+
+                finished: typing.List[str] = [agent_id.decode(bert_constants.ENCODING) for agent_id in self._client.smembers(self._key('finished', job_name))]
+                work_queue, done_queue, ologger = bert_utils.comm_binders(conf['job'])
+                if self._client.sismember(self._key('assigned'), job_name) and all([agent_id in finished for agent_id in agents]) and work_queue.size() == 0:
+                    logger.info(f'Job[{job_name}] completed by Agents[{len(finished)}]')
+                    self._client.sadd(self._key('completed'), job_name)
+                    continue
+
+                pending.append(job_name)
+
+            if len(pending) > 0:
+                for job_name in pending:
+                    if self._client.sadd(self._key('assigned'), job_name) == 1:
+                        self.seed(job_name)
+
+                self._client.set(self._key('assignment'), json.dumps({'jobs': pending, 'complete': False}))
+                return None
+
+        self._client.set(self._key('assignment'), json.dumps({'jobs': [], 'complete': True}))
+
+    def seed(self: PWN, job_name: str) -> None:
+        # Invoke args are put into the work queue once, by the coordinator, no matter how many agents are running
+        conf: typing.Dict[str, typing.Any] = self._jobs[job_name]
+        bert_encoders.clear_encoding()
+        bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
+        bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
+        bert_encoders.load_queue_decoders(conf['encoding']['queue_decoders'])
+        work_queue, done_queue, ologger = bert_utils.comm_binders(conf['job'])
+        for invoke_arg in conf['aws-deploy']['invoke-args']:
+            work_queue.put(invoke_arg)
+
+    def assignment(self: PWN) -> typing.Dict[str, typing.Any]:
+        assignment: bytes = self._client.get(self._key('assignment'))
+        if assignment is None:
+            return {'jobs': [], 'complete': False}
+
+        return json.loads(assignment.decode(bert_constants.ENCODING))
+
+    def start_workers(self: PWN, job_name: str) -> None:
+        conf: typing.Dict[str, typing.Any] = self._jobs[job_name]
+        runner_manager.print_begin_log_info(self._options, job_name, conf)
+        self._processes[job_name] = []
+        for idx in range(0, conf['job'].workers):
+            proc: multiprocessing.Process = multiprocessing.Process(target=_run_job_worker, args=(conf,))
+            proc.daemon = True
+            proc.start()
+            self._processes[job_name].append(proc)
+
+    def record_finished_jobs(self: PWN) -> None:
+        for job_name, processes in self._processes.items():
+            if job_name in self._finished or any([proc.is_alive() for proc in processes]):
+                continue
+
+            logger.info(f'Agent[{self._agent_id}] finished Job[{job_name}]')
+            self._client.sadd(self._key('finished', job_name), self._agent_id)
+            self._finished.append(job_name)
+
+    def run(self: PWN) -> None:
+        logger.info(f'Starting Agent[{self._agent_id}] in Space[{self._space}]')
+        while not STOP_AGENT:
+            agents: typing.List[str] = self.heartbeat()
+            if self.is_coordinator():
+                self.coordinate(agents)
+
+            assignment: typing.Dict[str, typing.Any] = self.assignment()
+            if assignment['complete'] is True:
+                logger.info(f'All Jobs completed, stopping Agent[{self._agent_id}]')
+                break
+
+            for job_name in assignment['jobs']:
+                if not job_name in self._processes.keys():
+                    self.start_workers(job_name)
+
+            self.record_finished_jobs()
+            time.sleep(bert_constants.DELAY * 10)
+
+        self.stop()
+
+    def stop(self: PWN) -> None:
+        for job_name, processes in self._processes.items():
+            for proc in processes:
+                if proc.is_alive():
+                    proc.terminate()
+
+            for proc in processes:
+                proc.join()
+
+        # Another agent takes over the coordinator lease on its next round instead of waiting for it to expire
+        self._release_script(keys=[self._key('coordinator')], args=[self._agent_id])
+        self._client.zrem(self._key('agents'), self._agent_id)
+
+def reset_agents(options: argparse.Namespace) -> None:
+    client = bert_datasource.RedisConnection.ParseURL(bert_constants.REDIS_URL).client()
+    keys: typing.List[bytes] = client.keys(f'{AGENT_SPACE}:{options.module_name}:{options.agent_run_id}:*')
+    if len(keys) > 0:
+        logger.info(f'Clearing Agent state for Run[{options.agent_run_id}]')
+        client.delete(*keys)
+
+def run_agent(options: argparse.Namespace, jobs: typing.Dict[str, typing.Any]) -> None:
+    signal.signal(signal.SIGTERM, handle_signal)
+    Agent(options, jobs).run()
@@ -40,6 +40,11 @@ def capture_options() -> typing.Any:
     parser.add_argument('-n', '--replay-function-name', type=str, default=None, help='Which function to focus on?')
     parser.add_argument('-c', '--replay-fill-count', type=int, default=0, help='Fill Cache Count for Replay API?')
     parser.add_argument('-s', '--stop-after-function', action='store_true', default=False, help='Stop after replaying function?')
+
+    # Agent API
+    parser.add_argument('-a', '--agent', action='store_true', default=False, help='Run as one of many agents sharing REDIS_URL')
+    parser.add_argument('--agent-run-id', type=str, default='default', help='Agents with the same run id work on the same run')
+    parser.add_argument('--agent-reset', action='store_true', default=False, help='Clear the shared state of the agent run before starting')
     return parser.parse_args()
 
 
@@ -80,6 +85,20 @@ def test_cognito_event(options: argparse.Namespace) -> None:
     manager.validate_options(options, jobs)
     manager.run_jobs(options, jobs)
 
+def start_agent(options: argparse.Namespace) -> None:
+    if options.flush_db:
+        bert_utils.flush_db()
+
+    jobs = bert_utils.scan_jobs(options.module_name)
+    jobs = bert_utils.map_jobs(jobs, options.module_name)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    from bert.runner import agent
+    if options.agent_reset:
+        agent.reset_agents(options)
+
+    agent.run_agent(options, jobs)
+
 def start_service(options: argparse.Namespace) -> None:
     if options.flush_db:
         bert_utils.flush_db()
@@ -102,6 +121,9 @@ def run_from_cli():
     elif options.cognito:
         test_cognito_event(options)
 
+    elif options.agent:
+        start_agent(options)
+
     else:
         start_service(options)
 
@@ -90,6 +90,10 @@ def handle_job_cache__work_queue(options: argparse.Namespace, job_name: str, job
 def run_jobs(options: argparse.Namespace, jobs: typing.Dict[str, types.FunctionType]):
     if bert_constants.DEBUG:
         for idx, (job_name, conf) in enumerate(jobs.items()):
+            if conf['spaces']['fused']:
+                logger.info(f'Job[{job_name}] is fused into its parent, skipping')
+                continue
+
             if handle_replay_api__begin_function_invocation_okay(options, job_name, conf, jobs) is False:
                 continue
 
@@ -113,132 +117,143 @@ def run_jobs(options: argparse.Namespace, jobs: typing.Dict[str, types.FunctionT
 
             if execution_role_arn is None:
                 with bert_datasource.ENVVars(conf['runner']['environment']):
-                    conf['job']()
+                    bert_utils.run_fused_chain(conf['job'])
 
             else:
                 with bert_aws.assume_role(execution_role_arn):
                     with bert_datasource.ENVVars(conf['runner']['environment']):
-                        conf['job']()
+                        bert_utils.run_fused_chain(conf['job'])
 
             # handle_job_cache__done_queue(options, job_name, conf)
 
     else:
-        for idx, (job_name, conf) in enumerate(jobs.items()):
-            if handle_replay_api__begin_function_invocation_okay(options, job_name, conf, jobs) is False:
-                continue
+        # Jobs within a level don't depend on each other, independent branches of the pipeline run side by side
+        for level in bert_utils.job_levels(jobs):
+            processes: typing.Dict[str, typing.List[multiprocessing.Process]] = {}
+            for job_name in level:
+                conf: typing.Dict[str, typing.Any] = jobs[job_name]
+                if conf['spaces']['fused']:
+                    logger.info(f'Job[{job_name}] is fused into its parent, skipping')
+                    continue
+
+                if handle_replay_api__begin_function_invocation_okay(options, job_name, conf, jobs) is False:
+                    continue
+
+                handle_job_cache__work_queue(options, job_name, conf)
+
+                bert_encoders.clear_encoding()
+                bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
+                print_begin_log_info(options, job_name, conf)
+                bert_encoders.clear_encoding()
+                bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
+                bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
+                bert_encoders.load_queue_decoders(conf['encoding']['queue_decoders'])
+
+                job_worker_queue, job_done_queue, job_logger = bert_utils.comm_binders(conf['job'])
+                if options.cognito is True:
+                    job_worker_queue.put({
+                        'cognito-event': inject_cognito_event(conf)
+                    })
+
+                for invoke_arg in conf['aws-deploy']['invoke-args']:
+                    job_worker_queue.put(invoke_arg)
+
+                processes[job_name] = []
+                for idx in range(0, conf['job'].workers):
+                    proc: multiprocessing.Process = multiprocessing.Process(target=run_job_worker, args=(conf,))
+                    proc.daemon = True
+                    proc.start()
+                    processes[job_name].append(proc)
+
+            supervise_job_workers(jobs, processes)
 
-            handle_job_cache__work_queue(options, job_name, conf)
-
-            bert_encoders.clear_encoding()
-            bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
-
-            def print_begin_log_info(options: argparse.Namespace, job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
-                work_queue, done_queue, ologger = bert_utils.comm_binders(conf['job'])
-                work_unit_count = work_queue.size()
-                pipeline_type = conf['job'].pipeline_type.value
-                logger.info(f'Running Job[{job_name}] - {pipeline_type} - Work Unit Count[{work_unit_count}]')
-                logger.info(f'Job worker count[{conf["job"].workers}]')
-
-            print_begin_log_info(options, job_name, conf)
-            processes: typing.List[multiprocessing.Process] = []
+            # handle_job_cache__done_queue(options, job_name, conf)
             bert_encoders.clear_encoding()
-            bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
-            bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
-            bert_encoders.load_queue_decoders(conf['encoding']['queue_decoders'])
 
-            job_worker_queue, job_done_queue, job_logger = bert_utils.comm_binders(conf['job'])
-            if options.cognito is True:
-                job_worker_queue.put({
-                    'cognito-event': inject_cognito_event(conf)
-                })
-
-            for invoke_arg in conf['aws-deploy']['invoke-args']:
-                job_worker_queue.put(invoke_arg)
+def print_begin_log_info(options: argparse.Namespace, job_name: str, conf: typing.Dict[str, typing.Any]) -> None:
+    work_queue, done_queue, ologger = bert_utils.comm_binders(conf['job'])
+    work_unit_count = work_queue.size()
+    pipeline_type = conf['job'].pipeline_type.value
+    logger.info(f'Running Job[{job_name}] - {pipeline_type} - Work Unit Count[{work_unit_count}]')
+    logger.info(f'Job worker count[{conf["job"].workers}]')
+
+def run_job_worker(conf: typing.Dict[str, typing.Any]) -> None:
+    with bert_datasource.ENVVars({'BERT_MULTIPROCESSING': 't'}):
+        bert_encoders.clear_encoding()
+        bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
+        bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
+        bert_encoders.load_queue_decoders(conf['encoding']['queue_decoders'])
+        execution_role_arn: str = conf['iam'].get('execution-role-arn', None)
+        job_restart_count: int = 0
+        job_work_queue, job_done_queue, ologger = bert_utils.comm_binders(conf['job'])
+        while job_restart_count < conf['runner']['max-retries']:
+            try:
+                if execution_role_arn is None:
+                    with bert_datasource.ENVVars(conf['runner']['environment']):
+                        while True:
+                            bert_utils.run_fused_chain(conf['job'])
+                            time.sleep(bert_constants.LONG_DELAY)
+                            if job_work_queue.size() > 0:
+                                continue
 
-            @functools.wraps(conf['job'])
-            def _job_runner(*args, **kwargs) -> None:
-                with bert_datasource.ENVVars({'BERT_MULTIPROCESSING': 't'}):
-                    bert_encoders.clear_encoding()
-                    bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
-                    bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
-                    bert_encoders.load_queue_decoders(conf['encoding']['queue_decoders'])
-                    execution_role_arn: str = conf['iam'].get('execution-role-arn', None)
-                    job_restart_count: int = 0
-                    job_work_queue, job_done_queue, ologger = bert_utils.comm_binders(conf['job'])
-                    while job_restart_count < conf['runner']['max-retries']:
-                        try:
-                            if execution_role_arn is None:
-                                with bert_datasource.ENVVars(conf['runner']['environment']):
-                                    while True:
-                                        conf['job']()
-                                        time.sleep(bert_constants.LONG_DELAY)
-                                        if job_work_queue.size() > 0:
-                                            continue
-
-                                        break
-
-                                    sys.exit(0)
-                            else:
-                                with bert_aws.assume_role(execution_role_arn):
-                                    with bert_datasource.ENVVars(conf['runner']['environment']):
-                                        while True:
-                                            conf['job']()
-                                            time.sleep(bert_constants.LONG_DELAY)
-                                            if job_work_queue.size() > 0:
-                                                continue
-
-                                            break
-
-                                        sys.exit(0)
-
-                        except Exception as err:
-                            if LOG_ERROR_ONLY:
-                                logger.exception(err)
-
-                            else:
-                                raise err
-                        else:
                             break
 
-                        job_restart_count += 1
-
-                    else:
-                        logger.exception(f'Job[{conf["job"].func_space}] failed {job_restart_count} times')
+                        sys.exit(0)
+                else:
+                    with bert_aws.assume_role(execution_role_arn):
+                        with bert_datasource.ENVVars(conf['runner']['environment']):
+                            while True:
+                                bert_utils.run_fused_chain(conf['job'])
+                                time.sleep(bert_constants.LONG_DELAY)
+                                if job_work_queue.size() > 0:
+                                    continue
 
-            for idx in range(0, conf['job'].workers):
-                proc: multiprocessing.Process = multiprocessing.Process(target=_job_runner, args=())
-                proc.daemon = True
-                proc.start()
-                processes.append(proc)
+                                break
 
-            else:
-                active_job_count = len([proc for proc in processes if proc.is_alive()])
-                last_pulse = datetime.utcnow()
-                while not STOP_DAEMON and any([proc.is_alive() for proc in processes]):
-                    count = len([proc for proc in processes if proc.is_alive()])
-                    if count != active_job_count:
-                        active_job_count = count
-                        logger.info(f'Active Job Count[{count}]')
-
-                    pulse_diff = datetime.utcnow() - last_pulse
-                    if pulse_diff > timedelta(seconds=bert_constants.SUPER_LONG_DELAY):
-                        logger.info(f'Active Job Count[{count}]')
-                        last_pulse = datetime.utcnow()
+                            sys.exit(0)
 
-                        job_work_queue, job_done_queue, ologger = bert_utils.comm_binders(conf['job'])
-                        work_count = job_work_queue.size()
-                        if work_count > 0:
-                            logging.info(f'Work amount left[{work_count}]')
+            except Exception as err:
+                if LOG_ERROR_ONLY:
+                    logger.exception(err)
 
-                        else:
-                            logger.info('All work consumed')
+                else:
+                    raise err
+            else:
+                break
 
-                    time.sleep(bert_constants.DELAY)
+            job_restart_count += 1
 
-            # handle_job_cache__done_queue(options, job_name, conf)
-            bert_encoders.clear_encoding()
-            bert_encoders.load_identity_encoders(conf['encoding']['identity_encoders'])
-            bert_encoders.load_queue_encoders(conf['encoding']['queue_encoders'])
+        else:
+            logger.exception(f'Job[{conf["job"].func_space}] failed {job_restart_count} times')
+
+def supervise_job_workers(jobs: typing.Dict[str, typing.Any], processes: typing.Dict[str, typing.List[multiprocessing.Process]]) -> None:
+    all_processes: typing.List[multiprocessing.Process] = [proc for job_processes in processes.values() for proc in job_processes]
+    active_job_count = len([proc for proc in all_processes if proc.is_alive()])
+    last_pulse = datetime.utcnow()
+    while not STOP_DAEMON and any([proc.is_alive() for proc in all_processes]):
+        count = len([proc for proc in all_processes if proc.is_alive()])
+        if count != active_job_count:
+            active_job_count = count
+            logger.info(f'Active Job Count[{count}]')
+
+        pulse_diff = datetime.utcnow() - last_pulse
+        if pulse_diff > timedelta(seconds=bert_constants.SUPER_LONG_DELAY):
+            logger.info(f'Active Job Count[{count}]')
+            last_pulse = datetime.utcnow()
+
+            for job_name, job_processes in processes.items():
+                if not any([proc.is_alive() for proc in job_processes]):
+                    continue
+
+                job_work_queue, job_done_queue, ologger = bert_utils.comm_binders(jobs[job_name]['job'])
+                work_count = job_work_queue.size()
+                if work_count > 0:
+                    logger.info(f'Job[{job_name}] Work amount left[{work_count}]')
+
+                else:
+                    logger.info(f'Job[{job_name}] All work consumed')
+
+        time.sleep(bert_constants.DELAY)
 
 def validate_options(options: argparse.Namespace, jobs: typing.Dict[str, typing.Any]) -> None:
     if options.replay_enabled:
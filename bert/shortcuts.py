@@ -1,4 +1,3 @@
-import boto3
 import collections
 import importlib
 import json
@@ -11,8 +10,6 @@ import yaml
 from bert import \
     exceptions as bert_exceptions
 
-from botocore.errorfactory import ClientError
-
 from json.decoder import JSONDecodeError
 
 logger = logging.getLogger(__name__)
@@ -21,7 +18,9 @@ def head_bucket_for_existance(bucket_name: str) -> None:
     if bucket_name is None:
         return None
 
-    client = boto3.client('s3')
+    from bert import aws as bert_aws
+    from botocore.errorfactory import ClientError
+    client = bert_aws.client('s3')
     try:
         client.head_bucket(Bucket=bucket_name)
     except ClientError as err:
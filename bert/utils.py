@@ -1,14 +1,17 @@
 import collections
 import importlib
+import inspect
 import logging
 import multiprocessing
 import os
 import subprocess
+import threading
 import time
 import types
 import typing
 
 from bert import \
+    aws as bert_aws, \
     queues as bert_queues, \
     constants as bert_constants, \
     shortcuts as bert_shortcuts, \
@@ -41,26 +44,52 @@ def scan_jobs(module_name: str) -> typing.Dict[str, typing.Any]:
 
         jobs[member_name] = member
 
-    # Order the jobs correctly
-    ordered = collections.OrderedDict()
-    while len(ordered.keys()) != len(jobs.keys()):
-        if len(ordered.keys()) == 0:
-            for job_name, job in jobs.items():
-                if job.parent_func == 'noop':
-                    ordered[job_name] = job
-                    break
+    # Order the jobs so every job comes after its parents. Ties are broken by where the job is defined, which is the
+    #   order binding.follow registered them in and keeps work_key assignment the same in generated lambda handlers
+    def _source_line(job: types.FunctionType) -> int:
+        try:
+            return inspect.getsourcelines(job)[1]
+        except (OSError, TypeError):
+            return 0
 
-            else:
-                raise NotImplementedError(f'NoopSpace not found')
+    ordered = collections.OrderedDict()
+    pending: typing.List[typing.Tuple[int, str]] = sorted([(_source_line(job), job_name) for job_name, job in jobs.items()])
+    while len(pending) > 0:
+        for idx, (line, job_name) in enumerate(pending):
+            parents: typing.List[types.FunctionType] = getattr(jobs[job_name], 'parent_func_list', [])
+            if all([parent in ordered.values() or not parent in jobs.values() for parent in parents]):
+                ordered[job_name] = jobs[job_name]
+                pending.pop(idx)
+                break
 
         else:
-            latest: types.FunctionType = [item for item in ordered.values()][-1]
-            for job_name, job in jobs.items():
-                if job.parent_func == latest:
-                    ordered[job_name] = job
-                    break
+            raise NotImplementedError(f'Unable to resolve parents for Jobs[{", ".join([job_name for line, job_name in pending])}]')
+
+    if not any([job.parent_func == 'noop' for job in ordered.values()]):
+        raise NotImplementedError(f'NoopSpace not found')
+
     return ordered
 
+def job_levels(jobs: typing.Dict[str, typing.Any]) -> typing.List[typing.List[str]]:
+    """
+    Group ordered jobs into levels. Jobs within a level don't depend on each other and can run at the same time
+    """
+    levels: typing.List[typing.List[str]] = []
+    job_level: typing.Dict[str, int] = {}
+    spaces: typing.Dict[str, str] = {}
+    for job_name, conf in jobs.items():
+        job: types.FunctionType = conf['job'] if isinstance(conf, dict) else conf
+        spaces[job.func_space] = job_name
+        parent_names: typing.List[str] = [spaces[parent.func_space] for parent in getattr(job, 'parent_func_list', []) if parent.func_space in spaces]
+        level: int = max([job_level[parent_name] + 1 for parent_name in parent_names] or [0])
+        job_level[job_name] = level
+        while len(levels) <= level:
+            levels.append([])
+
+        levels[level].append(job_name)
+
+    return levels
+
 def map_jobs(jobs: typing.Dict[str, typing.Any], module_name: str) -> None:
     confs: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
     bert_configuration = bert_shortcuts.load_configuration() or {}
@@ -237,7 +266,8 @@ def map_jobs(jobs: typing.Dict[str, typing.Any], module_name: str) -> None:
                     'handler': job_handler,
                     'lambda-name': job_name,
                     'work-table-name': job.work_key,
-                    'done-table-name': job.done_key,
+                    # Fused stages write to the done queue of the last stage in the chain
+                    'done-table-name': fused_chain(job)[-1].done_key,
                     'environment': env_vars,
                     'cognito': cognito,
                     'batch-size': batch_size,
@@ -285,10 +315,13 @@ def map_jobs(jobs: typing.Dict[str, typing.Any], module_name: str) -> None:
                     'func_space': job.func_space,
                     'work-key': job.work_key,
                     'done-key': job.done_key,
+                    'done-keys': getattr(job, 'done_keys', None) or [job.done_key],
                     'pipeline-type': job.pipeline_type,
                     'workers': job.workers,
                     'scheme': job.schema,
+                    'fused': getattr(job, 'fused', False),
                     'parent': {
+                        'names': [parent.__name__ for parent in getattr(job, 'parent_func_list', [])],
                         'noop-space': job.parent_noop_space,
                         'space': job.parent_space,
                         'work-key': job.parent_func_work_key,
@@ -322,24 +355,144 @@ def run_command(cmd: str, allow_error: typing.List[int] = [0]) -> str:
     return proc.stdout.read().decode(bert_constants.ENCODING)
 
 
-def comm_binders(func: types.FunctionType) -> typing.Tuple['QueueType', 'QueueType', 'ologger']:
-    ologger = logging.getLogger('.'.join([func.__name__, multiprocessing.current_process().name]))
-    ologger.debug(f'Bert Queue Type[{bert_constants.QueueType}]')
+def _queue_type() -> typing.Type[bert_queues.BaseQueue]:
     if bert_constants.QueueType is bert_constants.QueueTypes.Dynamodb:
-        return bert_queues.DynamodbQueue(func.work_key), bert_queues.DynamodbQueue(func.done_key), ologger
+        return bert_queues.DynamodbQueue
 
     elif bert_constants.QueueType is bert_constants.QueueTypes.StreamingQueue:
-        return bert_queues.StreamingQueue(func.work_key), bert_queues.StreamingQueue(func.done_key), ologger
+        return bert_queues.StreamingQueue
 
     elif bert_constants.QueueType is bert_constants.QueueTypes.LocalQueue:
-        return bert_queues.LocalQueue(func.work_key), bert_queues.LocalQueue(func.done_key), ologger
+        return bert_queues.LocalQueue
 
     elif bert_constants.QueueType is bert_constants.QueueTypes.Redis:
-        return bert_queues.RedisQueue(func.work_key), bert_queues.RedisQueue(func.done_key), ologger
+        return bert_queues.RedisQueue
 
     else:
         raise NotImplementedError(f'Unsupported QueueType[{bert_constants.QueueType}]')
 
+# Queues built by comm_binders, keyed by thread, queue type, key and the credentials they were built with. Queues hold
+#   iteration state, so threads don't share them, and their clients carry credentials, so a queue built before
+#   assume_role isn't used inside it. Emptied when the PID changes, so a forked worker builds its own clients. Threads
+#   that end evict their queues, see evict_thread_queues
+QUEUE_CACHE: typing.Dict[typing.Tuple[int, typing.Type[bert_queues.BaseQueue], str, typing.Tuple[str, str, str]], bert_queues.BaseQueue] = {}
+QUEUE_CACHE_PID: int = os.getpid()
+
+def clear_queue_cache() -> None:
+    global QUEUE_CACHE_PID
+    QUEUE_CACHE.clear()
+    QUEUE_CACHE_PID = os.getpid()
+
+def evict_thread_queues() -> None:
+    """
+    Forget the queues the calling thread built. Thread idents are reused once a thread ends, so a thread calls this
+        before it ends, or a later thread would pick up its queues halfway through their iteration
+    """
+    ident: int = threading.get_ident()
+    for cache_key in [cache_key for cache_key in list(QUEUE_CACHE) if cache_key[0] == ident]:
+        QUEUE_CACHE.pop(cache_key, None)
+
+def _build_queue(queue_type: typing.Type[bert_queues.BaseQueue], key: str) -> bert_queues.BaseQueue:
+    # Fused stages talk to each other in-process, see run_fused_chain
+    if key in bert_queues.FUSED_QUEUES.keys():
+        return bert_queues.FUSED_QUEUES[key]
+
+    if QUEUE_CACHE_PID != os.getpid():
+        clear_queue_cache()
+
+    cache_key: typing.Tuple[int, typing.Type[bert_queues.BaseQueue], str, typing.Tuple[str, str, str]] = (threading.get_ident(), queue_type, key, bert_aws.credential_context())
+    queue: bert_queues.BaseQueue = QUEUE_CACHE.get(cache_key, None)
+    if queue is None:
+        if queue_type is bert_queues.RedisQueue and key in bert_queues.PARTITIONED_QUEUES.keys():
+            queue = bert_queues.ShardedRedisQueue(key, bert_queues.PARTITIONED_QUEUES[key])
+
+        else:
+            queue = queue_type(key)
+
+        QUEUE_CACHE[cache_key] = queue
+
+    return queue
+
+def comm_binders(func: types.FunctionType) -> typing.Tuple['QueueType', 'QueueType', 'ologger']:
+    ologger = logging.getLogger('.'.join([func.__name__, multiprocessing.current_process().name]))
+    ologger.debug(f'Bert Queue Type[{bert_constants.QueueType}]')
+    queue_type: typing.Type[bert_queues.BaseQueue] = _queue_type()
+    work_queue = _build_queue(queue_type, func.work_key)
+    done_keys: typing.List[str] = getattr(func, 'done_keys', None) or [func.done_key]
+    if len(done_keys) == 1:
+        done_queue = _build_queue(queue_type, done_keys[0])
+
+    else:
+        done_queue = bert_queues.BroadcastQueue(func.done_key, [_build_queue(queue_type, done_key) for done_key in done_keys])
+
+    if getattr(func, 'memoize', False) is True:
+        from bert.etl.memo import StageMemo
+        work_queue = bert_queues.MemoWorkQueue(work_queue, done_queue, StageMemo(func))
+        done_queue = bert_queues.MemoDoneQueue(done_queue, work_queue)
+
+    return work_queue, done_queue, ologger
+
+def fused_chain(func: types.FunctionType) -> typing.List[types.FunctionType]:
+    chain: typing.List[types.FunctionType] = [func]
+    while getattr(chain[-1], 'fused_func', None) is not None:
+        chain.append(chain[-1].fused_func)
+
+    return chain
+
+def run_fused_chain(func: types.FunctionType) -> typing.Any:
+    """
+    Run `func` along with every stage fused to it. The first stage runs in the calling thread and each fused stage in
+        its own thread, connected through FusedQueues. Only the last stage writes to a real done queue.
+    """
+    chain: typing.List[types.FunctionType] = fused_chain(func)
+    if len(chain) == 1:
+        return func()
+
+    fused_queues: typing.List[bert_queues.FusedQueue] = []
+    for job in chain[:-1]:
+        fused_queue: bert_queues.FusedQueue = bert_queues.FusedQueue(job.done_key)
+        bert_queues.FUSED_QUEUES[job.done_key] = fused_queue
+        fused_queues.append(fused_queue)
+
+    errors: typing.List[Exception] = []
+    def _run_stage(job: types.FunctionType, work_queue: bert_queues.FusedQueue, done_queue: bert_queues.FusedQueue) -> None:
+        try:
+            job()
+        except Exception as err:
+            logger.exception(f'Fused Job[{job.__name__}] failed')
+            errors.append(err)
+
+        finally:
+            if not work_queue is None:
+                work_queue.abort()
+
+            if not done_queue is None:
+                done_queue.close()
+
+    def _run_thread(job: types.FunctionType, work_queue: bert_queues.FusedQueue, done_queue: bert_queues.FusedQueue) -> None:
+        try:
+            _run_stage(job, work_queue, done_queue)
+        finally:
+            evict_thread_queues()
+
+    threads: typing.List[threading.Thread] = []
+    for idx, job in enumerate(chain[1:], 1):
+        done_queue: bert_queues.FusedQueue = fused_queues[idx] if idx < len(fused_queues) else None
+        thread: threading.Thread = threading.Thread(target=_run_thread, args=(job, fused_queues[idx - 1], done_queue), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    try:
+        _run_stage(chain[0], None, fused_queues[0])
+        for thread in threads:
+            thread.join()
+
+    finally:
+        for job in chain[:-1]:
+            bert_queues.FUSED_QUEUES.pop(job.done_key, None)
+
+    if len(errors) > 0:
+        raise errors[0]
 
 def flush_db():
     if bert_constants.QueueType in [
@@ -0,0 +1,195 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+import pytest
+
+AGENT_ITEMS = 60
+
+@pytest.fixture
+def agent_redis(monkeypatch):
+  # One Redis shared by every agent process, the same way agents on separate hosts share REDIS_URL
+  import fakeredis
+  from bert import constants
+
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+
+  server = fakeredis.TcpFakeServer(('127.0.0.1', port), server_type='redis')
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  monkeypatch.setattr(constants, 'REDIS_URL', f'redis://127.0.0.1:{port}/0')
+  monkeypatch.setattr(constants, 'QueueType', constants.QueueTypes.Redis)
+  monkeypatch.setattr(constants, 'AGENT_LEASE', 1.0)
+  monkeypatch.setattr(constants, 'DELAY', .05)
+  monkeypatch.setattr(constants, 'LONG_DELAY', .1)
+  # TcpFakeServer drops a connection on any error reply, so the scripts are loaded up front instead of after NOSCRIPT
+  from bert import datasource
+  from bert.runner import agent
+  client = datasource.RedisConnection.ParseURL(constants.REDIS_URL).client()
+  for script in [agent._COORDINATOR_LEASE_SCRIPT, agent._RELEASE_LEASE_SCRIPT]:
+    client.script_load(script)
+
+  yield constants.REDIS_URL
+  server.shutdown()
+  server.server_close()
+
+def _agent_jobs():
+  from bert import binding, constants, datasource, utils
+
+  @binding.follow('noop', workers=2)
+  def agent_extract():
+    work_queue, done_queue, ologger = utils.comm_binders(agent_extract)
+    for details in work_queue:
+      done_queue.put(details)
+
+  @binding.follow(agent_extract, workers=2)
+  def agent_load():
+    client = datasource.RedisConnection.ParseURL(constants.REDIS_URL).client()
+    work_queue, done_queue, ologger = utils.comm_binders(agent_load)
+    for details in work_queue:
+      time.sleep(.02)
+      client.rpush('agent-test-results', details['idx'])
+
+  jobs = {}
+  for job in [agent_extract, agent_load]:
+    jobs[job.__name__] = {
+      'job': job,
+      'spaces': {'fused': False},
+      'encoding': {
+        'identity_encoders': ['bert.encoders.base.IdentityEncoder'],
+        'queue_encoders': ['bert.encoders.base.encode_aws_object'],
+        'queue_decoders': ['bert.encoders.base.decode_aws_object'],
+      },
+      'aws-deploy': {'invoke-args': [{'idx': idx} for idx in range(0, AGENT_ITEMS)] if job is agent_extract else []},
+      'iam': {},
+      'runner': {'max-retries': 1, 'environment': {}},
+    }
+
+  return jobs
+
+def _start_agent(options, jobs):
+  from bert.runner import agent
+
+  def _run():
+    # Own process group, so a test can kill an agent along with its workers like losing a host
+    os.setpgid(0, 0)
+    agent.run_agent(options, jobs)
+
+  proc = multiprocessing.Process(target=_run)
+  proc.start()
+  return proc
+
+def _coordinator_pid(client, space):
+  coordinator = client.get(f'{space}:coordinator')
+  if coordinator is None:
+    return None
+
+  return int(coordinator.decode('utf-8').rsplit('-', 6)[-6])
+
+def _wait_for(condition, timeout=30.0):
+  stop_time = time.time() + timeout
+  while time.time() < stop_time:
+    if condition():
+      return True
+
+    time.sleep(.05)
+
+  return False
+
+def _redis_client():
+  from bert import constants, datasource
+  return datasource.RedisConnection.ParseURL(constants.REDIS_URL).client()
+
+def test_agents_complete_run(agent_redis):
+  from bert.runner import agent
+  jobs = _agent_jobs()
+  options = argparse.Namespace(module_name='bert_tests', agent_run_id=str(uuid.uuid4()))
+  space = f'{agent.AGENT_SPACE}:bert_tests:{options.agent_run_id}'
+  procs = [_start_agent(options, jobs) for idx in range(0, 3)]
+  for proc in procs:
+    proc.join(60)
+    assert proc.exitcode == 0
+
+  client = _redis_client()
+  assert sorted(int(idx) for idx in client.lrange('agent-test-results', 0, -1)) == list(range(0, AGENT_ITEMS))
+  assert {job_name.decode('utf-8') for job_name in client.smembers(f'{space}:completed')} == set(jobs.keys())
+  assert json.loads(client.get(f'{space}:assignment')) == {'jobs': [], 'complete': True}
+  # Every agent left the run and gave up the lease
+  assert client.zcard(f'{space}:agents') == 0
+  assert client.get(f'{space}:coordinator') is None
+
+def test_agents_coordinator_failover(agent_redis):
+  from bert.runner import agent
+  jobs = _agent_jobs()
+  options = argparse.Namespace(module_name='bert_tests', agent_run_id=str(uuid.uuid4()))
+  space = f'{agent.AGENT_SPACE}:bert_tests:{options.agent_run_id}'
+  client = _redis_client()
+  procs = {}
+  for idx in range(0, 2):
+    proc = _start_agent(options, jobs)
+    procs[proc.pid] = proc
+
+  assert _wait_for(lambda: client.exists(f'{space}:assignment') and _coordinator_pid(client, space) in procs)
+  coordinator_pid = _coordinator_pid(client, space)
+  # Killed outright, the lease is never released and has to expire before the other agent takes over
+  os.killpg(coordinator_pid, signal.SIGKILL)
+  procs.pop(coordinator_pid).join()
+  assert _wait_for(lambda: _coordinator_pid(client, space) in procs)
+
+  survivor = list(procs.values())[0]
+  survivor.join(60)
+  assert survivor.exitcode == 0
+  assert {job_name.decode('utf-8') for job_name in client.smembers(f'{space}:completed')} == set(jobs.keys())
+  assert json.loads(client.get(f'{space}:assignment')) == {'jobs': [], 'complete': True}
+  # Items the killed workers had popped are lost with them, every other item is loaded once
+  results = [int(idx) for idx in client.lrange('agent-test-results', 0, -1)]
+  assert len(results) == len(set(results))
+  assert len(results) >= AGENT_ITEMS - 2 * jobs['agent_load']['job'].workers
+
+def test_agent_sigterm(agent_redis):
+  from bert import binding, utils
+  from bert.runner import agent
+
+  @binding.follow('noop', workers=1)
+  def agent_idle():
+    work_queue, done_queue, ologger = utils.comm_binders(agent_idle)
+    for details in work_queue:
+      time.sleep(60)
+
+  # The worker is still busy with its one item when the agent is told to stop
+  jobs = _agent_jobs()
+  jobs = {'agent_idle': dict(jobs['agent_extract'], job=agent_idle, **{'aws-deploy': {'invoke-args': [{'idx': 0}]}})}
+  options = argparse.Namespace(module_name='bert_tests', agent_run_id=str(uuid.uuid4()))
+  space = f'{agent.AGENT_SPACE}:bert_tests:{options.agent_run_id}'
+  client = _redis_client()
+  proc = _start_agent(options, jobs)
+  assert _wait_for(lambda: client.exists(f'{space}:assignment') and _coordinator_pid(client, space) == proc.pid)
+  os.kill(proc.pid, signal.SIGTERM)
+  proc.join(30)
+  assert proc.exitcode == 0
+  assert client.get(f'{space}:coordinator') is None
+  assert client.zcard(f'{space}:agents') == 0
+
+def test_agent_lease_is_not_taken_over(agent_redis):
+  from bert.runner import agent
+  options = argparse.Namespace(module_name='bert_tests', agent_run_id=str(uuid.uuid4()))
+  first = agent.Agent(options, {})
+  second = agent.Agent(options, {})
+  assert first.is_coordinator() is True
+  assert second.is_coordinator() is False
+  assert first.is_coordinator() is True
+
+  # An expired lease is taken by the next agent and can't be extended by its old owner
+  client = _redis_client()
+  client.delete(first._key('coordinator'))
+  assert second.is_coordinator() is True
+  assert first.is_coordinator() is False
+  assert client.get(first._key('coordinator')).decode('utf-8') == second._agent_id
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+@pytest.fixture
+def limiter_redis(monkeypatch):
+  import fakeredis
+  from bert import datasource
+
+  server = fakeredis.FakeServer()
+  monkeypatch.setattr(datasource.RedisConnection, 'client', lambda self: fakeredis.FakeRedis(server=server))
+  monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+  return server
+
+def test_api_limiter_burst(limiter_redis):
+  from bert.etl import APILimiter
+
+  with APILimiter('https://api.example.com/v1/', .5, burst=3) as limiter:
+    waits = [limiter.delay() for idx in range(0, 5)]
+
+  assert waits[:3] == [0, 0, 0]
+  # The bucket is empty, each call waits for one more token at 2 tokens per second
+  assert 0.4 < waits[3] <= 0.5
+  assert 0.9 < waits[4] <= 1.0
+  assert limiter.metrics()['waits'] == 2
+  assert limiter.metrics()['distributed'] is True
+
+def test_api_limiter_shared_bucket(limiter_redis):
+  from bert.etl import APILimiter
+
+  # Limiters of different workers share the bucket of the netloc
+  first = APILimiter('https://api.example.com/v1/users', 1, burst=2)
+  second = APILimiter('https://api.example.com/v2/orders', 1, burst=2)
+  assert first.delay() == 0
+  assert first.delay() == 0
+  assert second.delay() > 0
+  other = APILimiter('https://other.example.com/', 1, burst=2)
+  assert other.delay() == 0
+
+def test_api_limiter_unlimited(monkeypatch):
+  from bert import datasource
+  from bert.etl import APILimiter
+
+  def _client(self):
+    raise AssertionError('An unlimited APILimiter should not connect to Redis')
+
+  monkeypatch.setattr(datasource.RedisConnection, 'client', _client)
+  with APILimiter('https://api.example.com/', 0) as limiter:
+    assert [limiter.delay() for idx in range(0, 100)] == [0] * 100
+
+def test_api_limiter_reconnects(limiter_redis, monkeypatch):
+  from bert.etl import APILimiter
+
+  limiter_redis.connected = False
+  limiter = APILimiter('https://api.example.com/', .5, burst=2)
+  assert limiter.delay() == 0
+  assert limiter.metrics()['distributed'] is False
+
+  # Redis is back, but the limiter waits for its backoff before it connects again
+  limiter_redis.connected = True
+  limiter.delay()
+  assert limiter.metrics()['distributed'] is False
+  monkeypatch.setattr(limiter, '_reconnect_at', 0.0)
+  assert limiter.delay() == 0
+  assert limiter.metrics()['distributed'] is True
+
+def test_api_limiter_script_replicates_effects(limiter_redis):
+  import fakeredis
+  from bert.etl import _TOKEN_BUCKET_SCRIPT
+
+  # Redis before 5 rejects writes after TIME unless the script switched to effects replication first
+  assert _TOKEN_BUCKET_SCRIPT.index('redis.replicate_commands()') < _TOKEN_BUCKET_SCRIPT.index("redis.call('TIME')")
+  client = fakeredis.FakeRedis(server=limiter_redis)
+  assert client.eval(_TOKEN_BUCKET_SCRIPT, 1, 'bucket', 1, 2, 1) == b'0'
+  assert float(client.hget('bucket', 'tokens')) == 1
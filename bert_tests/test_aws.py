@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/test-role'
+
+@pytest.fixture
+def fresh_aws(monkeypatch):
+  from bert import aws, constants
+  for key, value in {'AWS_ACCESS_KEY_ID': 'base-access-key', 'AWS_SECRET_ACCESS_KEY': 'base-secret-key', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+    monkeypatch.setenv(key, value)
+
+  monkeypatch.delenv('AWS_SESSION_TOKEN', raising=False)
+  for name in ['AWS_SESSIONS', 'AWS_CLIENTS', 'ROLE_SESSIONS', 'ROLE_DURATIONS', 'ROLE_CREDENTIALS']:
+    monkeypatch.setattr(aws, name, {})
+
+  monkeypatch.setattr(aws, 'ACTIVE_ROLES', [])
+  monkeypatch.setattr(aws, 'BASE_CREDENTIALS', [None])
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE', 'none')
+  return aws
+
+def _fake_sts(monkeypatch, lifetimes, delay=0):
+  # Hands out `key-N` credentials, the Nth living for the Nth of `lifetimes` seconds and the last for the rest
+  from datetime import datetime, timedelta, timezone
+  from bert import aws
+  calls = []
+  class FakeSTS:
+    def assume_role(self, RoleArn, RoleSessionName, DurationSeconds):
+      calls.append(RoleArn)
+      time.sleep(delay)
+      lifetime = lifetimes[min(len(calls), len(lifetimes)) - 1]
+      return {'Credentials': {
+        'AccessKeyId': f'key-{len(calls)}',
+        'SecretAccessKey': f'secret-{len(calls)}',
+        'SessionToken': f'token-{len(calls)}',
+        'Expiration': datetime.now(timezone.utc) + timedelta(seconds=lifetime)}}
+
+  monkeypatch.setattr(aws, '_sts_client', lambda: FakeSTS())
+  return calls
+
+def test_credentials_cached_in_process(fresh_aws, monkeypatch):
+  calls = _fake_sts(monkeypatch, [3600])
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-1'
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-1'
+  assert calls == [ROLE_ARN]
+
+def test_credentials_refreshed_before_expiry(fresh_aws, monkeypatch):
+  from bert import constants
+  # Credentials with less than BERT_AWS_CREDENTIAL_REFRESH seconds left are requested again
+  calls = _fake_sts(monkeypatch, [constants.AWS_CREDENTIAL_REFRESH - 60, 3600])
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-1'
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-2'
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-2'
+  assert len(calls) == 2
+
+def test_credentials_file_cache(fresh_aws, monkeypatch, tmp_path):
+  import os
+  from bert import constants
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE', 'file')
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE_DIR', str(tmp_path / 'credentials'))
+  calls = _fake_sts(monkeypatch, [3600], delay=.1)
+
+  # Workers asking at once wait on the lock, one calls STS and the others read what it cached
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'])) for idx in range(0, 4)]
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  assert results == ['key-1'] * 4
+  assert calls == [ROLE_ARN]
+  cached = [name for name in os.listdir(tmp_path / 'credentials') if name.endswith('.json')]
+  assert len(cached) == 1
+  assert os.stat(tmp_path / 'credentials' / cached[0]).st_mode & 0o777 == 0o600
+
+  # Another worker, without the credentials in memory, reads them from the file
+  monkeypatch.setattr(fresh_aws, 'ROLE_CREDENTIALS', {})
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-1'
+  assert calls == [ROLE_ARN]
+
+def test_credentials_unwritable_cache(fresh_aws, monkeypatch, tmp_path):
+  from bert import constants
+  # The cache directory can't be created, its parent is a file
+  (tmp_path / 'home').write_text('')
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE', 'file')
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE_DIR', str(tmp_path / 'home' / 'credentials'))
+  calls = _fake_sts(monkeypatch, [3600])
+  with fresh_aws.assume_role(ROLE_ARN):
+    import os
+    assert os.environ['AWS_ACCESS_KEY_ID'] == 'key-1'
+
+  assert fresh_aws.assumed_role_credentials(ROLE_ARN)['access_key'] == 'key-1'
+  assert calls == [ROLE_ARN]
+
+def test_role_session_refreshes_credentials(fresh_aws, monkeypatch):
+  # botocore refreshes credentials inside its mandatory refresh window of 10 minutes on their next use
+  calls = _fake_sts(monkeypatch, [300, 3600])
+  credentials = fresh_aws.role_session(ROLE_ARN).get_credentials()
+  assert calls == []
+  assert credentials.get_frozen_credentials().access_key == 'key-1'
+  assert credentials.get_frozen_credentials().access_key == 'key-2'
+  assert credentials.get_frozen_credentials().access_key == 'key-2'
+  assert len(calls) == 2
+
+def test_role_sessions_reset_after_fork(fresh_aws, monkeypatch):
+  role_session = fresh_aws.role_session(ROLE_ARN)
+  assert fresh_aws.role_session(ROLE_ARN) is role_session
+
+  # A forked worker finds the sessions of another PID
+  monkeypatch.setattr(fresh_aws, 'AWS_SESSIONS', {-1: fresh_aws.AWS_SESSIONS.popitem()[1]})
+  assert not fresh_aws.role_session(ROLE_ARN) is role_session
+
+def _access_key(aws_client):
+  return aws_client._request_signer._credentials.get_frozen_credentials().access_key
+
+def test_client_cache_keys(fresh_aws, monkeypatch):
+  calls = _fake_sts(monkeypatch, [3600])
+  s3 = fresh_aws.client('s3')
+  assert fresh_aws.client('s3') is s3
+  assert fresh_aws.client('s3', 'us-east-1') is s3
+  assert list(fresh_aws.AWS_CLIENTS.keys()) == [('s3', 'us-east-1', 'base-access-key', None)]
+  # Service and region are part of the key
+  assert not fresh_aws.client('sqs') is s3
+  assert not fresh_aws.client('s3', 'eu-west-1') is s3
+  with fresh_aws.assume_role(ROLE_ARN):
+    role_s3 = fresh_aws.client('s3')
+    assert not role_s3 is s3
+    assert fresh_aws.client('s3') is role_s3
+    assert _access_key(role_s3) == 'key-1'
+
+  assert ('s3', 'us-east-1', 'role', ROLE_ARN) in fresh_aws.AWS_CLIENTS.keys()
+  assert fresh_aws.client('s3') is s3
+  assert calls == [ROLE_ARN]
+
+def test_client_new_credentials(fresh_aws, monkeypatch):
+  s3 = fresh_aws.client('s3')
+  assert _access_key(s3) == 'base-access-key'
+  monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'other-access-key')
+  other_s3 = fresh_aws.client('s3')
+  assert not other_s3 is s3
+  assert _access_key(other_s3) == 'other-access-key'
+
+  # The same key with a session token is other credentials
+  monkeypatch.setenv('AWS_SESSION_TOKEN', 'other-token')
+  token_s3 = fresh_aws.client('s3')
+  assert not token_s3 in [s3, other_s3]
+  assert token_s3._request_signer._credentials.get_frozen_credentials().token == 'other-token'
+
+  monkeypatch.delenv('AWS_SESSION_TOKEN')
+  monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'base-access-key')
+  assert fresh_aws.client('s3') is s3
+
+def test_clients_reset_after_fork(fresh_aws, monkeypatch):
+  s3 = fresh_aws.client('s3')
+  aws_session = fresh_aws.session()
+  # A forked worker finds the session of another PID, it builds its own session and clients
+  monkeypatch.setattr(fresh_aws.os, 'getpid', lambda: -1)
+  forked_s3 = fresh_aws.client('s3')
+  assert not forked_s3 is s3
+  assert not fresh_aws.session() is aws_session
+  assert list(fresh_aws.AWS_SESSIONS.keys()) == [-1]
+  assert list(fresh_aws.AWS_CLIENTS.values()) == [forked_s3]
+  assert fresh_aws.client('s3') is forked_s3
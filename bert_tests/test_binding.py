@@ -0,0 +1,140 @@
+def test_follow_dag():
+  from bert import binding, utils
+
+  @binding.follow('noop')
+  def dag_extract():
+    pass
+
+  @binding.follow(dag_extract)
+  def dag_left():
+    pass
+
+  @binding.follow(dag_extract)
+  def dag_right():
+    pass
+
+  @binding.follow([dag_left, dag_right])
+  def dag_join():
+    pass
+
+  # The first child keeps reading the parent's done queue, every other child gets a work queue of its own
+  assert dag_left.work_key == dag_extract.done_key
+  assert dag_right.work_key != dag_extract.done_key
+  assert dag_extract.done_keys == [dag_left.work_key, dag_right.work_key]
+  assert dag_left.done_keys == [dag_join.work_key]
+  assert dag_right.done_keys == [dag_join.work_key]
+  assert dag_join.parent_funcs == [dag_extract, dag_left, dag_right]
+
+  chain = binding.build_job_chain()
+  assert chain.index(dag_extract) < chain.index(dag_left) < chain.index(dag_join)
+  assert chain.index(dag_right) < chain.index(dag_join)
+
+  jobs = {job.__name__: job for job in [dag_extract, dag_left, dag_right, dag_join]}
+  assert utils.job_levels(jobs) == [['dag_extract'], ['dag_left', 'dag_right'], ['dag_join']]
+
+def test_comm_binders_cache():
+  import threading
+  from bert import binding, constants, utils
+  constants.QueueType = constants.QueueTypes.LocalQueue
+
+  @binding.follow('noop')
+  def cached_binders():
+    pass
+
+  work_queue, done_queue, ologger = utils.comm_binders(cached_binders)
+  assert utils.comm_binders(cached_binders)[:2] == (work_queue, done_queue)
+
+  other_thread = []
+  thread = threading.Thread(target=lambda: other_thread.extend(utils.comm_binders(cached_binders)[:2]))
+  thread.start()
+  thread.join()
+  assert not other_thread[0] is work_queue and not other_thread[1] is done_queue
+
+def test_thread_queues_evicted():
+  import threading
+  from bert import binding, constants, utils
+  constants.QueueType = constants.QueueTypes.LocalQueue
+  utils.clear_queue_cache()
+
+  @binding.follow('noop')
+  def evicted_binders():
+    pass
+
+  # Both threads are alive at once, so their idents differ, and each iterates its own work queue
+  barrier = threading.Barrier(2)
+  built = {}
+  def _build(name):
+    work_queue = utils.comm_binders(evicted_binders)[0]
+    work_queue._value = name
+    barrier.wait()
+    assert utils.comm_binders(evicted_binders)[0] is work_queue
+    assert work_queue._value == name
+    built[name] = (threading.get_ident(), work_queue)
+    barrier.wait()
+    if name == 'evicting':
+      utils.evict_thread_queues()
+
+  threads = [threading.Thread(target=_build, args=(name,)) for name in ['evicting', 'keeping']]
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  assert built['evicting'][1] is not built['keeping'][1]
+  assert utils.comm_binders(evicted_binders)[0] not in [queue for ident, queue in built.values()]
+  # The queues of the thread that evicted them are gone, the queues of the one that didn't are left for a reused ident
+  assert {cache_key[0] for cache_key in utils.QUEUE_CACHE.keys()} == {built['keeping'][0], threading.get_ident()}
+
+  # A later thread never picks up the queues of an ended one that evicted them, even when it reuses its ident
+  utils.clear_queue_cache()
+  queues = []
+  def _build_evicting():
+    queues.append(utils.comm_binders(evicted_binders)[0])
+    utils.evict_thread_queues()
+
+  for idx in range(0, 5):
+    thread = threading.Thread(target=_build_evicting)
+    thread.start()
+    thread.join()
+
+  assert len(set(id(queue) for queue in queues)) == 5
+  assert utils.QUEUE_CACHE == {}
+
+def test_comm_binders_role_switch(tmp_path, monkeypatch):
+  import moto
+  from bert import aws, binding, constants, queues, utils
+  for name in ['AWS_SESSIONS', 'AWS_CLIENTS', 'ROLE_SESSIONS', 'ROLE_DURATIONS']:
+    monkeypatch.setattr(aws, name, {})
+
+  monkeypatch.setattr(aws, 'ACTIVE_ROLES', [])
+  monkeypatch.setattr(aws, 'BASE_CREDENTIALS', [])
+  monkeypatch.setattr(constants, 'AWS_CREDENTIAL_CACHE_DIR', str(tmp_path))
+  monkeypatch.setattr(constants, 'QueueType', constants.QueueTypes.Dynamodb)
+  utils.clear_queue_cache()
+
+  @binding.follow('noop')
+  def role_binders():
+    pass
+
+  def _access_key(queue):
+    return queue._dynamodb_client._request_signer._credentials.get_frozen_credentials().access_key
+
+  with moto.mock_aws():
+    for key, value in {'AWS_ACCESS_KEY_ID': 'base-access-key', 'AWS_SECRET_ACCESS_KEY': 'base-secret-key', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+      monkeypatch.setenv(key, value)
+
+    monkeypatch.delenv('AWS_SESSION_TOKEN', raising=False)
+    # The runner builds the queues before it assumes the execution role, the job builds them again inside it
+    outside = utils.comm_binders(role_binders)[0]
+    assert isinstance(outside, queues.DynamodbQueue)
+    with aws.assume_role('arn:aws:iam::123456789012:role/execution-role'):
+      inside = utils.comm_binders(role_binders)[0]
+      assert not inside is outside
+      assert utils.comm_binders(role_binders)[0] is inside
+      assert _access_key(inside) != 'base-access-key'
+
+    assert utils.comm_binders(role_binders)[0] is outside
+    assert _access_key(outside) == 'base-access-key'
+
+  utils.clear_queue_cache()
@@ -0,0 +1,106 @@
+import errno
+import os
+
+import pytest
+
+def _storage(tmp_path):
+  from bert.etl.storage import LocalStorage
+  class CountingStorage(LocalStorage):
+    remote = True
+    def __init__(self, root):
+      super().__init__(root)
+      self.opened = []
+
+    def open(self, key, if_none_match=None):
+      self.opened.append((key, if_none_match))
+      return super().open(key, if_none_match)
+
+  return CountingStorage(str(tmp_path / 'storage'))
+
+def _cache(tmp_path, max_bytes=1024 * 1024):
+  from bert.etl.cache import DatasetCache
+  return DatasetCache(str(tmp_path / 'cache'), max_bytes)
+
+def _blobs(cache):
+  return sorted([name for name in os.listdir(cache._blobs) if not name.startswith('.')])
+
+def test_cache_conditional_hit(tmp_path):
+  storage, cache = _storage(tmp_path), _cache(tmp_path)
+  etag = storage.put('part.json', b'body', {'bert-codec': 'none'})
+  first = cache.get(storage, 'part.json')
+  second = cache.get(storage, 'part.json')
+  assert bytes(first.body) == bytes(second.body) == b'body'
+  assert (second.metadata, second.etag) == ({'bert-codec': 'none'}, etag)
+  assert (cache.misses, cache.hits) == (1, 1)
+  # The second read only asked whether the object changed since the first
+  assert storage.opened == [('part.json', None), ('part.json', etag)]
+  with cache.open(storage, 'part.json').body as stream:
+    assert stream.read() == b'body'
+
+def test_cache_changed_etag(tmp_path):
+  storage, cache = _storage(tmp_path), _cache(tmp_path)
+  old_etag = storage.put('part.json', b'old')
+  assert bytes(cache.get(storage, 'part.json').body) == b'old'
+  new_etag = storage.put('part.json', b'new body')
+  stored = cache.get(storage, 'part.json')
+  assert (bytes(stored.body), stored.etag) == (b'new body', new_etag)
+  assert (cache.misses, cache.hits) == (2, 0)
+  assert storage.opened[-1] == ('part.json', old_etag)
+  assert bytes(cache.get(storage, 'part.json').body) == b'new body'
+  assert cache.hits == 1
+
+def test_cache_lru_eviction(tmp_path):
+  storage, cache = _storage(tmp_path), _cache(tmp_path, max_bytes=250)
+  for key in ['a', 'b', 'c']:
+    storage.put(key, key.encode('utf-8') * 100)
+
+  cache.get(storage, 'a')
+  cache.get(storage, 'b')
+  blobs = {key: cache._lookup(storage, key)['blob'] for key in ['a', 'b']}
+  os.utime(os.path.join(cache._blobs, blobs['a']), (1000, 1000))
+  os.utime(os.path.join(cache._blobs, blobs['b']), (2000, 2000))
+  # Reading `a` again makes it the most recently used, so `b` is evicted for `c`
+  cache.get(storage, 'a')
+  cache.get(storage, 'c')
+  assert _blobs(cache) == sorted([blobs['a'], cache._lookup(storage, 'c')['blob']])
+  assert cache._lookup(storage, 'b') is None
+  assert bytes(cache.get(storage, 'b').body) == b'b' * 100
+  assert (cache.misses, cache.hits) == (4, 1)
+
+def test_cache_blob_evicted_after_lookup(tmp_path, monkeypatch):
+  storage, cache = _storage(tmp_path), _cache(tmp_path)
+  etag = storage.put('part.json', b'body')
+  cache.get(storage, 'part.json')
+  lookup = cache._lookup
+  def _evicted_lookup(storage, key):
+    entry = lookup(storage, key)
+    os.remove(os.path.join(cache._blobs, entry['blob']))
+    return entry
+
+  monkeypatch.setattr(cache, '_lookup', _evicted_lookup)
+  stored = cache.get(storage, 'part.json')
+  assert (bytes(stored.body), stored.etag) == (b'body', etag)
+  # The 304 pointed at a blob that was gone, the object is read from storage instead
+  assert storage.opened[-2:] == [('part.json', etag), ('part.json', None)]
+
+def test_cache_write_failure(tmp_path, monkeypatch):
+  from bert.etl import cache as etl_cache
+  storage, cache = _storage(tmp_path), _cache(tmp_path)
+  etag = storage.put('part.json', b'body', {'bert-codec': 'none'})
+  def _full(*args, **kwargs):
+    raise OSError(errno.ENOSPC, 'No space left on device')
+
+  monkeypatch.setattr(etl_cache.tempfile, 'mkstemp', _full)
+  stored = cache.get(storage, 'part.json')
+  assert (bytes(stored.body), stored.metadata, stored.etag) == (b'body', {'bert-codec': 'none'}, etag)
+  with cache.open(storage, 'part.json').body as stream:
+    assert stream.read() == b'body'
+
+  assert cache._lookup(storage, 'part.json') is None
+
+def test_cache_read_only_directory(tmp_path):
+  storage, cache = _storage(tmp_path), _cache(tmp_path)
+  storage.put('part.json', b'body')
+  # The cache directory can't be created, its parent is a file
+  (tmp_path / 'cache').write_bytes(b'')
+  assert bytes(cache.get(storage, 'part.json').body) == b'body'
@@ -0,0 +1,94 @@
+import pytest
+
+RECORDS = [
+  {'idx': idx, 'name': f'name-{idx:03}', 'score': idx / 4, 'flag': idx % 2 == 0, 'note': None if idx % 3 == 0 else 'note'}
+  for idx in range(0, 100)]
+
+def _part(tmp_path, records, **kwargs):
+  from bert.etl.columnar import ColumnarPart, encode_columnar
+  from bert.etl.storage import LocalStorage
+
+  storage = LocalStorage(str(tmp_path))
+  storage.put('part.col', encode_columnar(records, **kwargs))
+  return storage, ColumnarPart(storage, 'part.col')
+
+def test_encode_columnar_round_trip(tmp_path):
+  # Missing keys stay missing and None stays None
+  records = RECORDS + [{'idx': 100}, {'idx': 101, 'extra': [1, 2]}, {'idx': 102, 'name': None}]
+  for codec in ['gzip', 'none']:
+    storage, part = _part(tmp_path, records, codec=codec, row_group_rows=16)
+    assert list(part.read()) == records
+    assert part.footer['rows'] == len(records)
+    assert len(part.footer['row-groups']) == 7
+
+def test_columnar_projection_and_filters(tmp_path):
+  storage, part = _part(tmp_path, RECORDS, row_group_rows=10)
+  assert list(part.read(columns=['idx', 'name'], filters=[('idx', '>=', 95)])) == [
+    {'idx': idx, 'name': f'name-{idx:03}'} for idx in range(95, 100)]
+  # Filtered columns are read but only projected columns come back
+  assert list(part.read(columns=['name'], filters=[('idx', 'in', [3, 42]), ('flag', '==', True)])) == [{'name': 'name-042'}]
+  assert list(part.read(columns=['idx'], filters=[('note', '==', None), ('idx', '<', 10)])) == [{'idx': 0}, {'idx': 3}, {'idx': 6}, {'idx': 9}]
+  assert list(part.read(filters=[('idx', '>', 1000)])) == []
+
+def test_may_match(tmp_path):
+  from bert.etl.columnar import may_match
+  storage, part = _part(tmp_path, RECORDS, row_group_rows=10)
+  row_group = part.load_footer()['row-groups'][2]
+  assert may_match(row_group, [('idx', '==', 25)])
+  assert not may_match(row_group, [('idx', '==', 35)])
+  assert not may_match(row_group, [('idx', '<', 20)])
+  assert may_match(row_group, [('idx', '<=', 20)])
+  assert not may_match(row_group, [('idx', '>', 29)])
+  assert may_match(row_group, [('idx', '>=', 29)])
+  assert not may_match(row_group, [('idx', 'in', [1, 99])])
+  assert may_match(row_group, [('idx', 'in', [1, 22])])
+  # Statistics can't rule out None or a column the row group doesn't have
+  assert may_match(row_group, [('idx', '==', None)])
+  assert not may_match(row_group, [('missing', '==', 1)])
+  assert may_match(row_group, [('missing', '!=', 1)])
+  assert may_match(row_group, [('name', '==', 0)])
+
+  storage, part = _part(tmp_path, [{'idx': 1}, {'idx': 1}])
+  row_group = part.load_footer()['row-groups'][0]
+  assert not may_match(row_group, [('idx', '!=', 1)])
+
+def test_columnar_skips_row_groups(tmp_path, monkeypatch):
+  storage, part = _part(tmp_path, RECORDS, row_group_rows=10)
+  part.load_footer()
+  reads = []
+  read_range = storage.read_range
+  monkeypatch.setattr(storage, 'read_range', lambda *args: reads.append(args) or read_range(*args))
+  assert [record['idx'] for record in part.read(filters=[('idx', '>=', 90)])] == list(range(90, 100))
+  assert len(reads) == 1
+
+def test_columnar_coalesces_near_chunks(tmp_path, monkeypatch):
+  from bert.etl import columnar
+  storage, part = _part(tmp_path, RECORDS, row_group_rows=100)
+  part.load_footer()
+  reads = []
+  read_range = storage.read_range
+  monkeypatch.setattr(storage, 'read_range', lambda *args: reads.append(args) or read_range(*args))
+
+  # Columns are laid out in sorted order, flag and note have idx, name and score between them
+  assert list(part.read(columns=['flag', 'note'])) == [columnar.project(record, ['flag', 'note']) for record in RECORDS]
+  assert len(reads) == 1
+
+  reads.clear()
+  monkeypatch.setattr(columnar, 'COALESCE_GAP', 0)
+  assert list(part.read(columns=['flag', 'note'])) == [columnar.project(record, ['flag', 'note']) for record in RECORDS]
+  assert len(reads) == 2
+  # Adjacent chunks still share a read
+  reads.clear()
+  assert list(part.read(columns=['flag', 'idx'])) == [columnar.project(record, ['flag', 'idx']) for record in RECORDS]
+  assert len(reads) == 1
+
+def test_columnar_format_error(tmp_path):
+  from bert import exceptions
+  from bert.etl.columnar import ColumnarPart
+  from bert.etl.storage import LocalStorage
+
+  storage = LocalStorage(str(tmp_path))
+  for body in [b'{"not": "columnar"}\n', b'BC']:
+    storage.put('part.json', body)
+    with pytest.raises(exceptions.DatasetFormatError):
+      list(ColumnarPart(storage, 'part.json').read())
@@ -0,0 +1,134 @@
+def _part(index, size):
+  return {'key': f'dataset/{index}.ndjson', 'index': index, 'size': size, 'rows': 1, 'checksum': None}
+
+def _write(message, rows, **kwargs):
+  from bert.etl import ETLDataset
+  with ETLDataset(message, part_rows=1, **kwargs) as dataset:
+    for row in rows:
+      dataset.add(row)
+
+def _read(message):
+  from bert.etl import ETLDatasetReader
+  with ETLDatasetReader(message) as reader:
+    return list(reader)
+
+def _manifest(message):
+  import hashlib
+  from bert.etl.constants import BERT_ETL_S3_PREFIX
+  from bert.etl.manifest import DatasetManifest
+  from bert.etl.storage import dataset_url
+  return DatasetManifest(f'{BERT_ETL_S3_PREFIX}/etl-dataset/{hashlib.sha256(message.encode("utf-8")).hexdigest()}', dataset_url()).load()
+
+def _keys(tmp_path):
+  from bert.etl.storage import get_storage
+  return sorted(key for key, size in get_storage(f'file://{tmp_path}').list(''))
+
+def test_plan_compaction():
+  from bert.etl.compaction import plan_compaction
+  # Large parts split runs, runs close at the target, and runs of one part are left alone
+  parts = [_part(0, 10), _part(1, 10), _part(2, 100), _part(3, 10), _part(5, 10), _part(6, 10), _part(7, 10), _part(8, 10)]
+  assert [[part['index'] for part in run] for run in plan_compaction(list(reversed(parts)), 30, 50)] == [[0, 1], [3, 5, 6], [7, 8]]
+  assert plan_compaction([_part(0, 10), _part(1, 100), _part(2, 10)], 30, 50) == []
+  assert plan_compaction([], 30, 50) == []
+
+def test_compact_dataset_keeps_row_order(tmp_path, monkeypatch):
+  from bert.etl.compaction import compact_dataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  rows = [{'idx': idx} if idx % 2 else [idx, idx] for idx in range(0, 20)]
+  _write('compact', rows)
+  before = _read('compact')
+  summary = compact_dataset('compact', target_bytes=100, small_bytes=50)
+  assert summary['parts'] == 20
+  assert len(summary['merged']) > 1
+  assert summary['deleted'] == []
+  assert _read('compact') == before
+
+  # The replaced parts are retired, not deleted, and the merged parts replace them in the manifest
+  manifest = _manifest('compact')
+  merged_keys = [merged['key'] for merged in summary['merged']]
+  retired_keys = [key for merged in summary['merged'] for key in merged['parts']]
+  assert all(key in [part['key'] for part in manifest.parts] for key in merged_keys)
+  assert sorted(part['key'] for part in manifest.retired) == sorted(retired_keys)
+  assert all(key in _keys(tmp_path) for key in retired_keys)
+  assert sum(part['rows'] for part in manifest.parts) == 20
+
+def test_compact_dataset_columnar(tmp_path, monkeypatch):
+  from bert.etl.compaction import compact_dataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  _write('columnar', [{'idx': idx} for idx in range(0, 6)], part_format='columnar')
+  before = _read('columnar')
+  summary = compact_dataset('columnar', target_bytes=10000, small_bytes=5000)
+  assert [merged['key'].endswith('.bcol') for merged in summary['merged']] == [True]
+  assert _read('columnar') == before
+
+def test_purge_retired_after_grace_period(tmp_path, monkeypatch):
+  import time
+  from bert.etl import compaction
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  _write('purge', [f'row-{idx}' for idx in range(0, 6)])
+  retired_keys = [key for merged in compaction.compact_dataset('purge', target_bytes=10000, small_bytes=5000)['merged'] for key in merged['parts']]
+  assert len(retired_keys) == 6
+
+  # Within the grace period retired parts stay, readers may still be on the old manifest
+  assert compaction.compact_dataset('purge', grace_period=3600)['deleted'] == []
+  assert all(key in _keys(tmp_path) for key in retired_keys)
+
+  now = time.time()
+  monkeypatch.setattr(compaction.time, 'time', lambda: now + 3601)
+  assert compaction.compact_dataset('purge', grace_period=3600, dry_run=True)['deleted'] == retired_keys
+  assert all(key in _keys(tmp_path) for key in retired_keys)
+  assert sorted(compaction.compact_dataset('purge', grace_period=3600)['deleted']) == sorted(retired_keys)
+  assert not any(key in _keys(tmp_path) for key in retired_keys)
+  assert _manifest('purge').retired == []
+  assert sorted(_read('purge')) == [f'row-{idx}' for idx in range(0, 6)]
+
+def test_compact_dataset_dry_run(tmp_path, monkeypatch):
+  from bert.etl.compaction import compact_dataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  _write('dry-run', [f'row-{idx}' for idx in range(0, 4)])
+  keys = _keys(tmp_path)
+  summary = compact_dataset('dry-run', target_bytes=10000, small_bytes=5000, dry_run=True)
+  assert summary['merged'] == [{'parts': [part['key'] for part in sorted(_manifest('dry-run').parts, key=lambda part: part['index'])], 'key': None}]
+  assert _keys(tmp_path) == keys
+  assert _manifest('dry-run').retired == []
+
+def test_compact_dataset_lost_race(tmp_path, monkeypatch):
+  from bert.etl import compaction
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  _write('race', [f'row-{idx}' for idx in range(0, 4)])
+
+  # Another compaction retires one of the parts between the plan and the swap
+  replace_parts = compaction.DatasetManifest.replace_parts
+  def _racing_replace_parts(self, removed, added, retries=10):
+    other = _manifest('race')
+    assert replace_parts(other, removed[:1], [])
+    return replace_parts(self, removed, added, retries)
+
+  keys = _keys(tmp_path)
+  monkeypatch.setattr(compaction.DatasetManifest, 'replace_parts', _racing_replace_parts)
+  summary = compaction.compact_dataset('race', target_bytes=10000, small_bytes=5000)
+  assert summary['merged'] == []
+  # The merged part never made it into the manifest and is deleted, the parts are left as they were
+  assert _keys(tmp_path) == keys
+  assert len(_manifest('race').parts) == 3
+
+def test_manifest_conflict(tmp_path, monkeypatch):
+  import pytest
+  from bert import exceptions
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  _write('conflict', ['row-0'])
+  manifest = _manifest('conflict')
+  def _conflict():
+    raise exceptions.DatasetPreconditionFailed('manifest.json')
+
+  # Every write loses to another writer, reloading finds the manifest as it was
+  parts, retired = list(manifest.parts), list(manifest.retired)
+  def _load():
+    manifest.parts, manifest.retired = list(parts), list(retired)
+    return manifest
+
+  monkeypatch.setattr(manifest, '_save', _conflict)
+  monkeypatch.setattr(manifest, 'load', _load)
+  for update in [lambda: manifest.put_part(b'row\n', 1, 'checksum', retries=2), lambda: manifest.reserve_index(retries=2), lambda: manifest.replace_parts([manifest.parts[0]['key']], [], retries=2), lambda: manifest.forget_retired([], retries=2)]:
+    with pytest.raises(exceptions.ManifestConflict):
+      update()
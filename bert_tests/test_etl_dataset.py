@@ -0,0 +1,195 @@
+import json
+
+def _read(message):
+  from bert.etl import ETLDatasetReader
+  with ETLDatasetReader(message) as reader:
+    return list(reader)
+
+def _sorted(rows):
+  return sorted(rows, key=json.dumps)
+
+def test_etl_dataset_round_trip(tmp_path, monkeypatch):
+  from bert.etl import ETLDataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  rows = [[1, 2], [3, 4], {'a': 1}, {'b': [1, 2]}, 'text', 5, 2.5, True, [], [[1], [2]]]
+  for codec in ['none', 'gzip']:
+    monkeypatch.setattr('bert.etl.sync_utils.BERT_ETL_CODEC', codec)
+    for part_rows in [1, 3, 100]:
+      message = f'round-trip-{codec}-{part_rows}'
+      with ETLDataset(message, part_rows=part_rows) as dataset:
+        for row in rows:
+          dataset.add(row)
+
+      assert _sorted(_read(message)) == _sorted(rows)
+
+  # One list row is one row, not the items of the list
+  with ETLDataset('single-list') as dataset:
+    dataset.add([1, 2])
+
+  assert _read('single-list') == [[1, 2]]
+
+def test_etl_dataset_reads_legacy_parts(tmp_path, monkeypatch):
+  import hashlib
+  from bert.etl import ETLDataset
+  from bert.etl.constants import BERT_ETL_S3_PREFIX
+  from bert.etl.storage import get_storage
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+
+  # Parts written by older releases are a single JSON array at `{index}.json`, without bert metadata
+  prefix = f'{BERT_ETL_S3_PREFIX}/etl-dataset/{hashlib.sha256(b"legacy").hexdigest()}'
+  get_storage().put(f'{prefix}/0.json', json.dumps([[1, 2], {'a': 1}, 'text']).encode('utf-8'))
+  with ETLDataset('legacy') as dataset:
+    dataset.add([3, 4])
+
+  assert _sorted(_read('legacy')) == _sorted([[1, 2], {'a': 1}, 'text', [3, 4]])
+
+def _manifest_parts(message):
+  import hashlib
+  from bert.etl.constants import BERT_ETL_S3_PREFIX
+  from bert.etl.manifest import DatasetManifest
+  from bert.etl.storage import dataset_url
+  manifest = DatasetManifest(f'{BERT_ETL_S3_PREFIX}/etl-dataset/{hashlib.sha256(message.encode("utf-8")).hexdigest()}', dataset_url()).load()
+  return sorted(manifest.parts, key=lambda part: part['index'])
+
+def test_etl_dataset_rolls_over_parts(tmp_path, monkeypatch):
+  from bert.etl import ETLDataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  with ETLDataset('rows', part_rows=3) as dataset:
+    for idx in range(0, 10):
+      dataset.add(f'row-{idx}')
+
+  assert [part['rows'] for part in _manifest_parts('rows')] == [3, 3, 3, 1]
+
+  # Each row is 10 bytes encoded, a part rolls over once it holds 25
+  with ETLDataset('bytes', part_bytes=25) as dataset:
+    for idx in range(0, 10):
+      dataset.add(f'row-{idx:04}')
+
+  assert [part['rows'] for part in _manifest_parts('bytes')] == [3, 3, 3, 1]
+  assert _read('bytes') == [f'row-{idx:04}' for idx in [9, 6, 7, 8, 3, 4, 5, 0, 1, 2]]
+
+def test_etl_dataset_orders_parts_by_flush(tmp_path, monkeypatch):
+  import time
+  from bert.etl import ETLDataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+
+  # Earlier parts upload slower, so their uploads finish after the later ones
+  upload_part = ETLDataset._upload_part
+  def _slow_upload_part(self, lines, index):
+    time.sleep(.05 * (4 - index))
+    return upload_part(self, lines, index)
+
+  monkeypatch.setattr(ETLDataset, '_upload_part', _slow_upload_part)
+  with ETLDataset('ordered', part_rows=1, upload_workers=4) as dataset:
+    for idx in range(0, 4):
+      dataset.add(f'row-{idx}')
+
+  assert [part['index'] for part in _manifest_parts('ordered')] == [0, 1, 2, 3]
+  assert _read('ordered') == ['row-3', 'row-2', 'row-1', 'row-0']
+
+def test_etl_dataset_bounds_uploads(tmp_path, monkeypatch):
+  import threading
+  import time
+  from bert.etl import ETLDataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  lock = threading.Lock()
+  running = [0]
+  most_running = [0]
+  most_queued = [0]
+  upload_part = ETLDataset._upload_part
+  def _counted_upload_part(self, lines, index):
+    with lock:
+      running[0] += 1
+      most_running[0] = max(most_running[0], running[0])
+
+    time.sleep(.02)
+    try:
+      return upload_part(self, lines, index)
+    finally:
+      with lock:
+        running[0] -= 1
+
+  monkeypatch.setattr(ETLDataset, '_upload_part', _counted_upload_part)
+  with ETLDataset('bounded', part_rows=2, upload_workers=2) as dataset:
+    for idx in range(0, 40):
+      dataset.add(f'row-{idx}')
+      most_queued[0] = max(most_queued[0], len(dataset._uploads))
+
+  # `add` blocks on the oldest upload once every worker is busy, so at most two parts are held in memory
+  assert most_running[0] == 2
+  assert most_queued[0] == 2
+  assert sorted(_read('bounded')) == sorted(f'row-{idx}' for idx in range(0, 40))
+
+def test_etl_dataset_commits_each_part(tmp_path, monkeypatch):
+  from bert.etl import ETLDataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  dataset = ETLDataset('timeout', part_rows=2, upload_workers=1).__enter__()
+  for idx in range(0, 5):
+    dataset.add(f'row-{idx}')
+
+  # The job times out with a part in progress, after its finished parts were uploaded
+  dataset._commit_parts(0)
+  dataset._executor.shutdown(wait=True)
+  with ETLDataset('timeout') as rerun:
+    assert [rerun.contains(f'row-{idx}') for idx in range(0, 5)] == [True, True, True, True, False]
+    for idx in range(0, 5):
+      if not rerun.contains(f'row-{idx}'):
+        rerun.add(f'row-{idx}')
+
+  assert sorted(_read('timeout')) == [f'row-{idx}' for idx in range(0, 5)]
+
+def _reader_keys(reader):
+  reader.consolidate()
+  reader._iterator.close()
+  return reader._consolidated_s3_keys
+
+def test_etl_reference_shards_cover_dataset(tmp_path, monkeypatch):
+  from bert.etl import ETLDataset, ETLReference
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  with ETLDataset('sharded', part_rows=1) as dataset:
+    for idx in range(0, 20):
+      dataset.add(f'row-{idx}')
+
+  part_keys = sorted([part['key'] for part in _manifest_parts('sharded')])
+  assert len(part_keys) == 20
+  for shard_count in [1, 3, 7]:
+    shards = [_reader_keys(reference.resolve()) for reference in ETLReference('sharded').shard(shard_count)]
+    assert len(shards) == shard_count
+    # Every part is read by exactly one shard
+    assert sorted(sum(shards, [])) == part_keys
+    rows = []
+    for reference in ETLReference('sharded').shard(shard_count):
+      with reference.resolve() as reader:
+        rows.extend(reader)
+
+    assert sorted(rows) == sorted([f'row-{idx}' for idx in range(0, 20)])
+
+  splits = [reference._part_keys for reference in ETLReference('sharded').split(6)]
+  assert 0 < len(splits) <= 6 and all([len(keys) > 0 for keys in splits])
+  assert sorted(sum(splits, [])) == part_keys
+
+def test_etl_reference_shard_survives_queue(tmp_path, monkeypatch):
+  import fakeredis
+  from bert import datasource, encoders, queues
+  from bert.encoders import etl as etl_encoders
+  from bert.etl import ETLDataset, ETLDatasetReader, ETLReference
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  monkeypatch.setattr(encoders, 'QUEUE_ENCODERS', [etl_encoders.encode_aws_object])
+  monkeypatch.setattr(encoders, 'QUEUE_DECODERS', [etl_encoders.decode_aws_object])
+  server = fakeredis.FakeServer()
+  monkeypatch.setattr(datasource.RedisConnection, 'client', lambda self: fakeredis.FakeRedis(server=server))
+  with ETLDataset('queued', part_rows=1) as dataset:
+    for idx in range(0, 12):
+      dataset.add(f'row-{idx}')
+
+  references = ETLReference('queued').shard(3) + ETLReference('queued').split(4) + [ETLDatasetReader('queued', 1, 3)]
+  queue = queues.RedisQueue('shard-specs')
+  for reference in references:
+    queue.put({'dataset': reference})
+
+  for reference in references:
+    reader = queue.get()['dataset']
+    assert isinstance(reader, ETLDatasetReader)
+    assert (reader._shard_index, reader._shard_count, reader._part_keys) == (reference._shard_index, reference._shard_count, reference._part_keys)
+    expected = reference.resolve() if isinstance(reference, ETLReference) else ETLDatasetReader('queued', 1, 3)
+    assert _reader_keys(reader) == _reader_keys(expected)
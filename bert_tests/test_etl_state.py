@@ -0,0 +1,282 @@
+
+def test_probabilistic_etl_state_reset(tmp_path, monkeypatch):
+  import bert.etl
+  from bert.etl import ProbabilisticETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ProbabilisticETLState('test-reset').localize()
+  for idx in range(0, 500):
+    state.contain(f'item-{idx}')
+
+  state.synchronize()
+  assert ProbabilisticETLState('test-reset').localize().contains('item-10')
+
+  monkeypatch.setattr(bert.etl, 'RESET_ETL_STATE', True)
+  state = ProbabilisticETLState('test-reset').localize()
+  assert not state.contains('item-10')
+  state.contain('item-after-reset')
+  state.synchronize()
+
+  monkeypatch.setattr(bert.etl, 'RESET_ETL_STATE', False)
+  state = ProbabilisticETLState('test-reset').localize()
+  assert state.contains('item-after-reset')
+  assert not any([state.contains(f'item-{idx}') for idx in range(0, 500)])
+
+def test_watermark_etl_state_kinds(tmp_path, monkeypatch):
+  from datetime import datetime, timedelta, timezone
+  from bert.etl import WatermarkETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  created = datetime(2020, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc)
+  with WatermarkETLState('https://api.example.com/v1/events') as state:
+    assert state.watermark('events') is None
+    assert state.watermark('events', default=0) == 0
+    assert state.is_after('events', created)
+    state.advance('events', created)
+    state.advance('events', created - timedelta(days=1))
+    state.advance('offset', 10)
+    state.advance('offset', 5)
+    state.advance('score', 1.5)
+    state.advance('page', 'token-b')
+    state.advance('page', 'token-a')
+    # Advanced watermarks only show once synchronized
+    assert state.watermark('events') is None
+
+  state = WatermarkETLState('https://api.example.com/v1/events').localize()
+  assert state.watermark('events') == created
+  assert state.watermark('offset') == 10
+  assert state.watermark('score') == 1.5
+  assert state.watermark('page') == 'token-a'
+  assert not state.is_after('events', created)
+  assert state.is_after('events', created + timedelta(microseconds=1))
+  assert state.is_after('offset', 11) and not state.is_after('offset', 10)
+
+  # A failed block leaves the watermarks where they were
+  try:
+    with WatermarkETLState('https://api.example.com/v1/events') as state:
+      state.advance('offset', 20)
+      raise RuntimeError
+  except RuntimeError:
+    pass
+
+  assert WatermarkETLState('https://api.example.com/v1/events').localize().watermark('offset') == 10
+
+def test_watermark_etl_state_merge(tmp_path, monkeypatch):
+  from datetime import datetime
+  from bert.etl import WatermarkETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  first = WatermarkETLState('merge').localize()
+  second = WatermarkETLState('merge').localize()
+  first.advance('offset', 10)
+  first.advance('events', datetime(2020, 1, 1))
+  first.advance('first-only', 'a')
+  first.synchronize()
+
+  # The second write loses the conditional put, downloads the first one and keeps the higher of each watermark
+  second.advance('offset', 5)
+  second.advance('events', datetime(2020, 6, 1))
+  second.advance('second-only', 1)
+  second.synchronize()
+  state = WatermarkETLState('merge').localize()
+  assert state.watermark('offset') == 10
+  assert state.watermark('events') == datetime(2020, 6, 1)
+  assert state.watermark('first-only') == 'a'
+  assert state.watermark('second-only') == 1
+  assert second.watermark('offset') == 10
+
+  # Watermarks another run didn't touch since this one localized are replaced as they are
+  first.localize()
+  second.advance('offset', 11)
+  second.synchronize()
+  first.advance('events', datetime(2021, 1, 1))
+  first.synchronize()
+  state = WatermarkETLState('merge').localize()
+  assert state.watermark('offset') == 11
+  assert state.watermark('events') == datetime(2021, 1, 1)
+
+def test_watermark_etl_state_conflict(tmp_path, monkeypatch):
+  import pytest
+  from bert import exceptions
+  from bert.etl import WatermarkETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  first = WatermarkETLState('conflict').localize()
+  second = WatermarkETLState('conflict').localize()
+  first.advance('page', 'token-a')
+  first.synchronize()
+
+  # Cursors can't be ordered, two runs advancing the same one is a conflict
+  second.advance('page', 'token-b')
+  with pytest.raises(exceptions.ETLStateConflict):
+    second.synchronize()
+
+  # So is a watermark whose kind changed
+  second = WatermarkETLState('conflict').localize()
+  first.advance('offset', 1)
+  first.synchronize()
+  second.advance('offset', 'token')
+  with pytest.raises(exceptions.ETLStateConflict):
+    second.synchronize()
+
+  assert WatermarkETLState('conflict').localize().watermark('page') == 'token-a'
+
+def test_watermark_etl_state_retries(tmp_path, monkeypatch):
+  import json
+  import pytest
+  from bert import exceptions
+  from bert.etl import WatermarkETLState
+  from bert.etl.storage import LocalStorage
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = WatermarkETLState('retries').localize()
+  state.advance('offset', 100)
+
+  # Another run writes between every download and conditional put
+  put = LocalStorage.put
+  writes = []
+  def _racing_put(self, key, body, *args, **kwargs):
+    writes.append(key)
+    put(self, key, json.dumps({'watermarks': {'offset': {'kind': 'sequence', 'value': len(writes)}}}).encode('utf-8'))
+    return put(self, key, body, *args, **kwargs)
+
+  monkeypatch.setattr(LocalStorage, 'put', _racing_put)
+  with pytest.raises(exceptions.ETLStateConflict):
+    state.synchronize(retries=3)
+
+  assert len(writes) == 3
+  monkeypatch.setattr(LocalStorage, 'put', put)
+  assert WatermarkETLState('retries').localize().watermark('offset') == 3
+  state.synchronize()
+  assert WatermarkETLState('retries').localize().watermark('offset') == 100
+
+def _state_keys(state):
+  from bert.etl.storage import get_storage
+  return sorted(key for key, size in get_storage().list(f'{state._s3_prefix}/'))
+
+def _spy(monkeypatch, name):
+  # Records the keys passed to upload_dataset(dataset, s3_key, ...) or download_dataset(s3_key, ...)
+  import bert.etl
+  calls = []
+  func = getattr(bert.etl, name)
+  def _spied(*args, **kwargs):
+    calls.append(args[1] if name == 'upload_dataset' else args[0])
+    return func(*args, **kwargs)
+
+  monkeypatch.setattr(bert.etl, name, _spied)
+  return calls
+
+def test_etl_state_shards(tmp_path, monkeypatch):
+  from bert.etl import ETLState
+  from bert.etl.sync_utils import download_dataset
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ETLState('test-shards', shard_prefix=1).localize()
+  hashes = [state.contain(f'item-{idx}') for idx in range(0, 200)]
+  state.synchronize()
+
+  # One object per first hex character of the hashes, holding the hashes that start with it
+  keys = _state_keys(state)
+  assert keys == sorted(state._shard_s3_key(shard) for shard in set(value_hash[0] for value_hash in hashes))
+  for key in keys:
+    shard = key.rsplit('/', 1)[1].split('.')[0]
+    assert download_dataset(key, f'file://{tmp_path}', dict)['contains'] == sorted(value_hash for value_hash in hashes if value_hash[0] == shard)
+
+  state = ETLState('test-shards', shard_prefix=1).localize()
+  assert all(state.contains(f'item-{idx}') for idx in range(0, 200))
+  assert not state.contains('item-200')
+
+def test_etl_state_dirty_shards(tmp_path, monkeypatch):
+  from bert.etl import ETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ETLState('test-dirty').localize()
+  for idx in range(0, 500):
+    state.contain(f'item-{idx}')
+
+  state.synchronize()
+  shard_count = len(_state_keys(state))
+  assert shard_count > 100
+
+  uploads = _spy(monkeypatch, 'upload_dataset')
+  downloads = _spy(monkeypatch, 'download_dataset')
+  state = ETLState('test-dirty').localize()
+  # Shards download the first time they're touched
+  assert downloads == []
+  assert state.contains('item-1')
+  assert downloads == [state._shard_s3_key(state._generate_hash('item-1')[:2])]
+  state.synchronize()
+  assert uploads == []
+
+  # Only the shards that changed are uploaded, and a hash already there isn't a change
+  value_hash = state.contain('item-new')
+  state.contain('item-1')
+  state.synchronize()
+  assert uploads == [state._shard_s3_key(value_hash[:2])]
+  state.synchronize()
+  assert len(uploads) == 1
+  assert len(_state_keys(state)) in [shard_count, shard_count + 1]
+
+def test_etl_state_migrates_legacy_object(tmp_path, monkeypatch):
+  import json
+  from bert.etl import ETLState
+  from bert.etl.storage import get_storage
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ETLState('test-legacy')
+  hashes = [state._generate_hash(f'item-{idx}') for idx in range(0, 100)]
+
+  # Written by a release before sharding, one uncompressed JSON document without metadata
+  get_storage().put(state._s3_key, json.dumps({'contains': hashes}).encode('utf-8'))
+  state.localize()
+  assert all(state.contains(f'item-{idx}') for idx in range(0, 100))
+  state.contain('item-100')
+  state.synchronize()
+
+  # The shards replace the object
+  assert not any(key == state._s3_key for key, size in get_storage().list(state._s3_key))
+  assert len(_state_keys(state)) > 0
+  state = ETLState('test-legacy').localize()
+  assert all(state.contains(f'item-{idx}') for idx in range(0, 101))
+  assert state._stale_s3_keys == []
+
+def test_etl_state_migrates_shard_width(tmp_path, monkeypatch):
+  from bert.etl import ETLState
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ETLState('test-width', shard_prefix=1).localize()
+  for idx in range(0, 100):
+    state.contain(f'item-{idx}')
+
+  state.synchronize()
+  narrow_keys = _state_keys(state)
+
+  # Shards of another width are folded into shards of this one, then removed
+  state = ETLState('test-width', shard_prefix=3).localize()
+  assert all(state.contains(f'item-{idx}') for idx in range(0, 100))
+  state.synchronize()
+  keys = _state_keys(state)
+  assert not any(key in narrow_keys for key in keys)
+  assert all(len(key.rsplit('/', 1)[1].split('.')[0]) == 3 for key in keys)
+  state = ETLState('test-width', shard_prefix=3).localize()
+  assert all(state.contains(f'item-{idx}') for idx in range(0, 100))
+
+def test_etl_state_reset(tmp_path, monkeypatch):
+  import json
+  import bert.etl
+  from bert.etl import ETLState
+  from bert.etl.storage import get_storage
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  state = ETLState('test-reset').localize()
+  for idx in range(0, 100):
+    state.contain(f'item-{idx}')
+
+  state.synchronize()
+  narrow = ETLState('test-reset', shard_prefix=1)
+  get_storage().put(narrow._shard_s3_key('0'), json.dumps({'contains': [state._generate_hash('item-0')]}).encode('utf-8'))
+  get_storage().put(state._s3_key, json.dumps({'contains': [state._generate_hash('item-0')]}).encode('utf-8'))
+
+  # Every layout is emptied, shards of this width are overwritten and the others deleted
+  monkeypatch.setattr(bert.etl, 'RESET_ETL_STATE', True)
+  state = ETLState('test-reset').localize()
+  assert not any(state.contains(f'item-{idx}') for idx in range(0, 100))
+  state.contain('item-after-reset')
+  state.synchronize()
+  assert not narrow._shard_s3_key('0') in _state_keys(state)
+  assert list(get_storage().list(state._s3_key)) == []
+
+  monkeypatch.setattr(bert.etl, 'RESET_ETL_STATE', False)
+  state = ETLState('test-reset').localize()
+  assert state.contains('item-after-reset')
+  assert not any(state.contains(f'item-{idx}') for idx in range(0, 100))
@@ -0,0 +1,136 @@
+
+def test_cache_function_results_tuple_result(tmp_path, monkeypatch):
+  from bert.etl import functools as etl_functools
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  calls = []
+
+  @etl_functools.cache_function_results
+  def pair(x=0):
+    calls.append(x)
+    return (x, x + 1)
+
+  assert pair(1) == (1, 2)
+  pair._memo.clear()
+  assert pair(1) == [1, 2]
+  assert calls == [1]
+  pair.synchronize()
+
+def test_cache_function_results_unencodable_result(tmp_path, monkeypatch):
+  import datetime
+  from bert.etl import functools as etl_functools
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  calls = []
+
+  @etl_functools.cache_function_results
+  def today(x=0):
+    calls.append(x)
+    return {'at': datetime.datetime(2020, 1, 1)}
+
+  assert today(1) == {'at': datetime.datetime(2020, 1, 1)}
+  assert today(1) == {'at': datetime.datetime(2020, 1, 1)}
+  assert calls == [1, 1]
+  today.synchronize()
+
+def test_cache_function_results_memo_hit(tmp_path, monkeypatch):
+  from bert.etl import functools as etl_functools
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  calls = []
+
+  @etl_functools.cache_function_results
+  def lookup(x=0):
+    calls.append(x)
+    return {'x': x, 'tags': ['a']}
+
+  assert lookup(1) == {'x': 1, 'tags': ['a']}
+
+  # The second call never reaches the storage
+  def _download(*args, **kwargs):
+    raise AssertionError('A memoized result should not be downloaded')
+
+  monkeypatch.setattr(etl_functools, 'download_dataset', _download)
+  result = lookup(1)
+  assert result == {'x': 1, 'tags': ['a']}
+  assert calls == [1]
+  assert lookup._memo.hits == 1
+
+  # Callers get a copy
+  result['tags'].append('b')
+  assert lookup(1) == {'x': 1, 'tags': ['a']}
+  lookup.synchronize()
+
+def test_memo_cache_eviction(monkeypatch):
+  from bert.etl import functools as etl_functools
+  clock = [100.0]
+  monkeypatch.setattr(etl_functools.time, 'monotonic', lambda: clock[0])
+
+  memo = etl_functools.MemoCache(max_size=2, ttl=10)
+  memo.put('a', 1)
+  memo.put('b', 2)
+  assert memo.get('a') == 1
+  # b is the least recently used
+  memo.put('c', 3)
+  assert memo.get('b') is etl_functools._MISSING
+  assert memo.get('a') == 1 and memo.get('c') == 3
+
+  clock[0] += 11
+  assert memo.get('a') is etl_functools._MISSING
+  assert memo.get('c') is etl_functools._MISSING
+  assert (memo.hits, memo.misses) == (3, 3)
+
+  # Without copies, callers share the cached result
+  memo = etl_functools.MemoCache(copy_results=False)
+  value = {'rows': [1]}
+  memo.put('a', value)
+  assert memo.get('a') is value
+
+def _cached_lookups(tmp_path, monkeypatch, server, instances):
+  import fakeredis
+  import threading
+  import time
+  from bert import datasource
+  from bert.etl import functools as etl_functools
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  monkeypatch.setattr(datasource.RedisConnection, 'client', lambda self: fakeredis.FakeRedis(server=server))
+  calls = []
+  lookups = []
+  # One instance per worker, they share the storage and Redis but nothing in process
+  for idx in range(0, instances):
+    def slow_lookup(x=0):
+      calls.append(x)
+      time.sleep(.3)
+      return {'x': x}
+
+    cached = etl_functools.cache_function_results('single-flight-test')
+    cached(slow_lookup)
+    lookups.append(cached)
+
+  results = []
+  threads = [threading.Thread(target=lambda lookup=lookups[idx % instances]: results.append(lookup(1))) for idx in range(0, 2)]
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  for lookup in lookups:
+    lookup.synchronize()
+
+  return calls, results
+
+def test_single_flight_redis(tmp_path, monkeypatch):
+  import fakeredis
+  server = fakeredis.FakeServer()
+  calls, results = _cached_lookups(tmp_path, monkeypatch, server, 2)
+  assert calls == [1]
+  assert results == [{'x': 1}, {'x': 1}]
+  # The lock was released
+  assert fakeredis.FakeRedis(server=server).keys('bert-etl-single-flight:*') == []
+
+def test_single_flight_redis_down(tmp_path, monkeypatch):
+  import fakeredis
+  server = fakeredis.FakeServer()
+  server.connected = False
+  # Without Redis the threads of a process still wait for each other
+  calls, results = _cached_lookups(tmp_path, monkeypatch, server, 1)
+  assert calls == [1]
+  assert results == [{'x': 1}, {'x': 1}]
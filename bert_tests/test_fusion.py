@@ -0,0 +1,50 @@
+
+def test_run_fused_chain():
+  from bert import binding, constants, queues, utils
+  constants.QueueType = constants.QueueTypes.LocalQueue
+  results = []
+
+  @binding.follow('noop', pipeline_type=constants.PipelineType.CONCURRENT)
+  def fused_head():
+    work_queue, done_queue, ologger = utils.comm_binders(fused_head)
+    for idx in range(0, 2500):
+      done_queue.put({'idx': idx})
+
+  @binding.follow(fused_head, pipeline_type=constants.PipelineType.CONCURRENT, fuse=True)
+  def fused_double():
+    work_queue, done_queue, ologger = utils.comm_binders(fused_double)
+    for details in work_queue:
+      done_queue.put({'idx': details['idx'] * 2})
+
+  @binding.follow(fused_double, pipeline_type=constants.PipelineType.CONCURRENT, fuse=True)
+  def fused_tail():
+    work_queue, done_queue, ologger = utils.comm_binders(fused_tail)
+    for details in work_queue:
+      results.append(details['idx'])
+
+  assert [job.__name__ for job in utils.fused_chain(fused_head)] == ['fused_head', 'fused_double', 'fused_tail']
+  utils.run_fused_chain(fused_head)
+  assert results == [idx * 2 for idx in range(0, 2500)]
+  assert queues.FUSED_QUEUES == {}
+
+def test_run_fused_chain_evicts_thread_queues():
+  import threading
+  from bert import binding, constants, utils
+  constants.QueueType = constants.QueueTypes.LocalQueue
+  utils.clear_queue_cache()
+
+  @binding.follow('noop', pipeline_type=constants.PipelineType.CONCURRENT)
+  def evicting_head():
+    work_queue, done_queue, ologger = utils.comm_binders(evicting_head)
+    for idx in range(0, 10):
+      done_queue.put({'idx': idx})
+
+  @binding.follow(evicting_head, pipeline_type=constants.PipelineType.CONCURRENT, fuse=True)
+  def evicting_tail():
+    work_queue, done_queue, ologger = utils.comm_binders(evicting_tail)
+    for details in work_queue:
+      done_queue.put(details)
+
+  utils.run_fused_chain(evicting_head)
+  # Only the queues of the calling thread are left, the fused stage's thread evicted its own
+  assert {cache_key[0] for cache_key in utils.QUEUE_CACHE.keys()} == {threading.get_ident()}
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+# Microseconds `import bert.binding` may take, measured by -X importtime in a fresh interpreter
+IMPORT_BUDGET: int = int(os.environ.get('BERT_IMPORT_BUDGET', 250000))
+HEAVY_MODULES = ['boto3', 'botocore', 'redis', 'aioredis', 'marshmallow', 'multiprocessing', 'asyncio']
+
+def _fresh_interpreter(source: str) -> subprocess.CompletedProcess:
+  return subprocess.run([sys.executable, '-X', 'importtime', '-c', source], capture_output=True, text=True,
+    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_binding_import_is_lean():
+  result = _fresh_interpreter(f'import sys, bert.binding; print([mod for mod in {HEAVY_MODULES!r} if mod in sys.modules])')
+  assert result.returncode == 0, result.stderr
+  assert result.stdout.strip().splitlines()[-1] == '[]'
+
+def test_binding_import_time_budget():
+  result = _fresh_interpreter('import bert.binding')
+  assert result.returncode == 0, result.stderr
+  cumulative = [int(line.split('|')[1]) for line in result.stderr.splitlines() if line.startswith('import time:') and line.split('|')[2].strip() == 'bert.binding']
+  assert len(cumulative) == 1
+  assert cumulative[0] < IMPORT_BUDGET, f'import bert.binding took {cumulative[0]}us, budget is {IMPORT_BUDGET}us'
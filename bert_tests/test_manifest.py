@@ -0,0 +1,85 @@
+import threading
+
+def _manifest(tmp_path, prefix='dataset'):
+  from bert.etl.manifest import DatasetManifest
+  return DatasetManifest(prefix, f'file://{tmp_path}').load()
+
+def test_manifest_concurrent_writers(tmp_path):
+  errors = []
+  def _writer(writer):
+    try:
+      manifest = _manifest(tmp_path)
+      for idx in range(0, 10):
+        manifest.put_part(f'{writer}-{idx}\n'.encode('utf-8'), 1, f'{writer}-{idx}', retries=100)
+
+    except Exception as err:
+      errors.append(err)
+
+  threads = [threading.Thread(target=_writer, args=(writer, )) for writer in range(0, 4)]
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  assert errors == []
+  manifest = _manifest(tmp_path)
+  # Every part is listed once, no writer overwrote another's part
+  assert len(manifest.parts) == 40
+  assert len(set(part['key'] for part in manifest.parts)) == 40
+  assert sorted(part['index'] for part in manifest.parts) == list(range(0, 40))
+  assert manifest.next_index == 40
+  for part in manifest.parts:
+    assert manifest._storage.get(part['key']).body == f'{part["checksum"]}\n'.encode('utf-8')
+
+def test_manifest_listing_fallback(tmp_path):
+  from bert.etl.storage import get_storage
+  storage = get_storage(f'file://{tmp_path}')
+  for name in ['0.ndjson', '1.ndjson.gz', '10.ndjson', 'other.json']:
+    storage.put(f'dataset/{name}', b'row\n')
+
+  # Datasets written before manifests are listed, the first part written builds their manifest
+  manifest = _manifest(tmp_path)
+  assert [(part['key'], part['rows']) for part in manifest.parts] == [('dataset/0.ndjson', None), ('dataset/1.ndjson.gz', None), ('dataset/10.ndjson', None)]
+  assert manifest.next_index == 11
+  assert manifest.put_part(b'row\n', 1, 'checksum')['key'] == 'dataset/11.ndjson'
+  storage.put('dataset/12.ndjson', b'row\n')
+  assert [part['index'] for part in _manifest(tmp_path).parts] == [0, 1, 10, 11]
+
+def test_manifest_put_part_listed_by_another_writer(tmp_path):
+  first = _manifest(tmp_path)
+  save = first._save
+  def _racing_save():
+    # Another writer opens the dataset by listing it after the part was written, and saves the manifest first
+    first._save = save
+    _manifest(tmp_path).put_part(b'second\n', 1, 'second')
+    save()
+
+  first._save = _racing_save
+  part = first.put_part(b'first\n', 1, 'first')
+  manifest = _manifest(tmp_path)
+  assert [(part['key'], part['rows'], part['checksum']) for part in manifest.parts] == [('dataset/0.ndjson', 1, 'first'), ('dataset/1.ndjson', 1, 'second')]
+  assert manifest.next_index == 2
+
+def test_manifest_replace_parts(tmp_path):
+  manifest = _manifest(tmp_path)
+  parts = [manifest.put_part(f'{idx}\n'.encode('utf-8'), 1, str(idx)) for idx in range(0, 3)]
+  stale = _manifest(tmp_path)
+  compacted = {'key': 'dataset/compacted.ndjson', 'index': 0, 'size': 4, 'rows': 2, 'checksum': 'compacted'}
+  assert manifest.replace_parts([parts[0]['key'], parts[1]['key']], [compacted])
+  assert sorted(part['key'] for part in _manifest(tmp_path).parts) == sorted([parts[2]['key'], compacted['key']])
+  assert [part['key'] for part in _manifest(tmp_path).retired] == [parts[0]['key'], parts[1]['key']]
+
+  # A writer holding an older manifest reloads on the conflict and finds its parts already replaced
+  assert stale.replace_parts([parts[1]['key']], [compacted]) is False
+  assert len(stale.parts) == 2
+  assert manifest.replace_parts(['dataset/missing.ndjson'], []) is False
+
+  # Retired parts stay listed until they are forgotten, also from a manifest that missed later writes
+  stale = _manifest(tmp_path)
+  manifest.put_part(b'3\n', 1, '3')
+  stale.forget_retired([parts[0]['key']])
+  manifest = _manifest(tmp_path)
+  assert [part['key'] for part in manifest.retired] == [parts[1]['key']]
+  assert len(manifest.parts) == 3
+  assert manifest.next_index == 4
@@ -0,0 +1,80 @@
+def _list_queue(key, items=()):
+  from bert import queues
+
+  class ListQueue(queues.BaseQueue):
+    def __init__(self, key, items):
+      super(ListQueue, self).__init__(key)
+      self.items = list(items)
+
+    def get(self):
+      return self.items.pop(0) if len(self.items) > 0 else None
+
+    def put(self, value):
+      self.items.append(value)
+
+    def size(self):
+      return len(self.items)
+
+    def _destroy(self, queue_item):
+      pass
+
+  return ListQueue(key, items)
+
+def _run_stage(func, items):
+  from bert import queues
+  from bert.etl.memo import StageMemo
+
+  memo = StageMemo(func, workers=2)
+  done_queue = _list_queue(func.done_key)
+  work_queue = queues.MemoWorkQueue(_list_queue(func.work_key, items), done_queue, memo)
+  memo_done_queue = queues.MemoDoneQueue(done_queue, work_queue)
+  seen = []
+  for details in work_queue:
+    seen.append(details['idx'])
+    memo_done_queue.put({'idx': details['idx'], 'double': details['idx'] * 2})
+    memo_done_queue.put({'idx': details['idx'], 'triple': details['idx'] * 3})
+
+  return seen, done_queue.items, memo
+
+def test_memo_queues_round_trip(tmp_path, monkeypatch):
+  from bert import binding
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+
+  @binding.follow('noop')
+  def memo_round_trip():
+    pass
+
+  seen, outputs, memo = _run_stage(memo_round_trip, [{'idx': idx} for idx in range(0, 10)])
+  assert seen == list(range(0, 10))
+  assert (memo.hits, memo.misses) == (0, 10)
+  first_outputs = outputs
+
+  # Recorded items are answered from their record, in order, and only the new ones reach the stage
+  seen, outputs, memo = _run_stage(memo_round_trip, [{'idx': idx} for idx in range(0, 12)])
+  assert seen == [10, 11]
+  assert (memo.hits, memo.misses) == (10, 2)
+  assert outputs[:20] == first_outputs
+  assert outputs[20:] == [{'idx': 10, 'double': 20}, {'idx': 10, 'triple': 30}, {'idx': 11, 'double': 22}, {'idx': 11, 'triple': 33}]
+
+def test_memo_skips_failed_items(tmp_path, monkeypatch):
+  from bert import binding, queues
+  from bert.etl.memo import StageMemo
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+
+  @binding.follow('noop')
+  def memo_failed():
+    pass
+
+  memo = StageMemo(memo_failed, workers=2)
+  done_queue = _list_queue(memo_failed.done_key)
+  work_queue = queues.MemoWorkQueue(_list_queue(memo_failed.work_key, [{'idx': 0}, {'idx': 1}]), done_queue, memo)
+  memo_done_queue = queues.MemoDoneQueue(done_queue, work_queue)
+  for details in work_queue:
+    memo_done_queue.put(details)
+    if details['idx'] == 1:
+      break
+
+  memo.flush()
+  # The stage never asked for the item after 1, so only 0 was recorded
+  seen, outputs, memo = _run_stage(memo_failed, [{'idx': 0}, {'idx': 1}])
+  assert seen == [1]
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def sharded_redis(monkeypatch):
+  import fakeredis
+  from bert import constants, datasource, encoders
+  from bert.encoders import base
+
+  monkeypatch.setattr(encoders, 'QUEUE_ENCODERS', [base.encode_aws_object])
+  monkeypatch.setattr(encoders, 'QUEUE_DECODERS', [base.decode_aws_object])
+  server = fakeredis.FakeServer()
+  monkeypatch.setattr(datasource.RedisConnection, 'client', lambda self: fakeredis.FakeRedis(server=server))
+  monkeypatch.setattr(constants, 'PARTITION_LEASE', .5)
+  monkeypatch.setattr(constants, 'PARTITION_REBALANCE', .1)
+  monkeypatch.setattr(constants, 'DELAY', .02)
+  yield fakeredis.FakeRedis(server=server)
+
+def _sharded_queue():
+  from bert import queues
+  return queues.ShardedRedisQueue('sharded-test', queues.PartitionSpec(shards=4, key='key'))
+
+def _fill(queue, items=40):
+  for idx in range(0, items):
+    queue.put({'key': idx % 8, 'idx': idx})
+
+def test_sharded_queue_rebalance(sharded_redis):
+  first, second = _sharded_queue(), _sharded_queue()
+  first._rebalance()
+  assert first._owned_shards == [0, 1, 2, 3]
+
+  # The second worker gets its half once the first gives it up, until then it holds nothing
+  second._rebalance()
+  assert second._owned_shards == []
+  first._rebalance()
+  second._rebalance()
+  assert len(first._owned_shards) == len(second._owned_shards) == 2
+  assert sorted(first._owned_shards + second._owned_shards) == [0, 1, 2, 3]
+
+  # Each worker only pops from its own shards, and items sharing a key come out in order
+  _fill(first)
+  seen = {}
+  for worker in [first, second]:
+    for idx in range(0, 20):
+      item = worker.get()
+      assert worker.calc_shard(item) in worker._owned_shards
+      seen.setdefault(item['key'], []).append(item['idx'])
+
+  assert sorted(idx for idxs in seen.values() for idx in idxs) == list(range(0, 40))
+  assert all(idxs == sorted(idxs) for idxs in seen.values())
+  assert first.get() == 'STOP'
+  # A worker that leaves hands its shards to the rest
+  second._rebalance()
+  assert second._owned_shards == [0, 1, 2, 3]
+
+def test_sharded_queue_lease_expiry(sharded_redis):
+  first, second = _sharded_queue(), _sharded_queue()
+  _fill(first)
+  first._rebalance()
+  assert first._owned_shards == [0, 1, 2, 3]
+
+  # The first worker goes away without releasing its shards, the second waits for its leases to expire
+  first._heartbeat.set()
+  started = time.time()
+  items = [second.get() for idx in range(0, 40)]
+  assert time.time() - started >= .4
+  assert sorted(item['idx'] for item in items) == list(range(0, 40))
+  assert second._owned_shards == [0, 1, 2, 3]
+  assert second.get() == 'STOP'
+  assert sharded_redis.zcard('sharded-test:workers') == 0
+  assert all(sharded_redis.get(second._lease_key(shard)) is None for shard in range(0, 4))
+
+def test_sharded_queue_slow_consumer(sharded_redis):
+  first, second = _sharded_queue(), _sharded_queue()
+  _fill(first)
+  items = [first.get()]
+  assert first._owned_shards == [0, 1, 2, 3]
+
+  # The first worker spends three leases on one item, its heartbeat keeps the shards while the second one waits
+  taken = []
+  def _consume():
+    for item in second:
+      taken.append(item)
+
+  thread = threading.Thread(target=_consume)
+  thread.start()
+  time.sleep(1.5)
+  assert thread.is_alive()
+  assert taken == []
+  assert first._owned_shards == [0, 1, 2, 3]
+  assert all(sharded_redis.get(first._lease_key(shard)).decode('utf-8') == first._worker_id for shard in range(0, 4))
+
+  # Once the first worker is back it hands half of its shards over
+  items.extend(first)
+  thread.join(5)
+  assert not thread.is_alive()
+  assert sorted(item['idx'] for item in items + taken) == list(range(0, 40))
+  assert first._heartbeat is None and second._heartbeat is None
+
+def test_sharded_queue_waits_for_other_shards(sharded_redis):
+  first, second = _sharded_queue(), _sharded_queue()
+  for worker in [first, second, first, second]:
+    worker._rebalance()
+
+  # Every item lands in a shard of the first worker, the second keeps going until those are drained
+  for idx in range(0, 10):
+    first.put({'key': next(key for key in range(0, 100) if first.calc_shard({'key': key}) == first._owned_shards[0]), 'idx': idx})
+
+  results = []
+  thread = threading.Thread(target=lambda: results.append(second.get()))
+  thread.start()
+  time.sleep(.2)
+  assert thread.is_alive()
+  drained = [first.get() for idx in range(0, 10)]
+  thread.join(5)
+  assert results == ['STOP']
+  assert [item['idx'] for item in drained] == list(range(0, 10))
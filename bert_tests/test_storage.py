@@ -0,0 +1,173 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+def _local(tmp_path):
+  from bert.etl.storage import LocalStorage
+  return LocalStorage(str(tmp_path))
+
+def _temp_files(tmp_path):
+  from bert.etl.storage import LOCAL_TEMP_PREFIX
+  return [filename for dirpath, dirnames, filenames in os.walk(tmp_path) for filename in filenames if filename.startswith(LOCAL_TEMP_PREFIX)]
+
+def test_local_storage_round_trip(tmp_path):
+  from bert import exceptions
+  storage = _local(tmp_path)
+  etag = storage.put('a/b/object.json', b'body', {'bert-codec': 'none'})
+  stored = storage.get('a/b/object.json')
+  assert (bytes(stored.body), stored.metadata, stored.etag) == (b'body', {'bert-codec': 'none'}, etag)
+  with storage.open('a/b/object.json').body as stream:
+    assert stream.read() == b'body'
+
+  storage.upload('a/b/uploaded.json', io.BytesIO(b'x' * 100000), {'bert-format': 'ndjson'})
+  assert bytes(storage.get('a/b/uploaded.json').body) == b'x' * 100000
+  assert storage.get('a/b/uploaded.json').metadata == {'bert-format': 'ndjson'}
+
+  with pytest.raises(exceptions.DatasetNotModified):
+    storage.get('a/b/object.json', if_none_match=etag)
+
+  assert bytes(storage.get('a/b/object.json', if_none_match='"other"').body) == b'body'
+  for key in ['missing.json', 'a/b', 'a/b/object.json/below']:
+    with pytest.raises(exceptions.DatasetKeyNotFound):
+      storage.get(key)
+
+  storage.delete(['a/b/object.json', 'a/b/missing.json'])
+  with pytest.raises(exceptions.DatasetKeyNotFound):
+    storage.get('a/b/object.json')
+
+def test_local_storage_conditional_put(tmp_path):
+  from bert import exceptions
+  storage = _local(tmp_path)
+  etag = storage.put('object.json', b'first', if_none_match=True)
+  with pytest.raises(exceptions.DatasetPreconditionFailed):
+    storage.put('object.json', b'second', if_none_match=True)
+
+  with pytest.raises(exceptions.DatasetPreconditionFailed):
+    storage.put('object.json', b'second', if_match='"stale"')
+
+  with pytest.raises(exceptions.DatasetPreconditionFailed):
+    storage.put('missing.json', b'second', if_match=etag)
+
+  # Failed writes leave the object and no temporary files behind
+  assert bytes(storage.get('object.json').body) == b'first'
+  assert _temp_files(tmp_path) == []
+
+  new_etag = storage.put('object.json', b'second', if_match=etag)
+  assert new_etag != etag
+  with pytest.raises(exceptions.DatasetPreconditionFailed):
+    storage.put('object.json', b'third', if_match=etag)
+
+  assert storage.get('object.json').etag == new_etag
+
+def test_local_storage_concurrent_conditional_puts(tmp_path):
+  from bert import exceptions
+  storage = _local(tmp_path)
+  etag = storage.put('counter.json', b'0')
+  winners = []
+  def _increment(worker):
+    try:
+      storage.put('counter.json', f'worker-{worker}'.encode('utf-8'), if_match=etag)
+      winners.append(worker)
+    except exceptions.DatasetPreconditionFailed:
+      pass
+
+  threads = [threading.Thread(target=_increment, args=(worker, )) for worker in range(0, 8)]
+  for thread in threads:
+    thread.start()
+
+  for thread in threads:
+    thread.join()
+
+  # Only one writer saw the etag it expected
+  assert len(winners) == 1
+  assert bytes(storage.get('counter.json').body) == f'worker-{winners[0]}'.encode('utf-8')
+
+def test_local_storage_atomic_replace(tmp_path):
+  storage = _local(tmp_path)
+  bodies = [bytes([idx]) * 1000000 for idx in range(0, 4)]
+  storage.put('object.bin', bodies[0])
+  stop = threading.Event()
+  def _write():
+    idx = 0
+    while not stop.is_set():
+      idx += 1
+      storage.put('object.bin', bodies[idx % len(bodies)])
+
+  writer = threading.Thread(target=_write)
+  writer.start()
+  try:
+    # Readers only ever see a whole object, with the etag of the body they read
+    for idx in range(0, 50):
+      stored = storage.get('object.bin')
+      assert bytes(stored.body) in bodies
+      assert stored.etag == f'"{hashlib.md5(bytes(stored.body)).hexdigest()}"'
+
+  finally:
+    stop.set()
+    writer.join()
+
+  assert _temp_files(tmp_path) == []
+
+def test_local_storage_read_range(tmp_path):
+  storage = _local(tmp_path)
+  storage.put('object.bin', b'0123456789')
+  assert storage.read_range('object.bin', 2, 3) == b'234'
+  assert storage.read_range('object.bin', 7) == b'789'
+  assert storage.read_range('object.bin', -4) == b'6789'
+  assert storage.read_range('object.bin', -4, 2) == b'67'
+  # More than the whole object from the end is the whole object
+  assert storage.read_range('object.bin', -100) == b'0123456789'
+  assert storage.read_range('object.bin', 20) == b''
+
+def test_local_storage_list(tmp_path):
+  storage = _local(tmp_path)
+  for key in ['data/1.json', 'data/10.json', 'data/sub/2.json', 'database/3.json', 'other/4.json']:
+    storage.put(key, b'body', {'bert-codec': 'none'}, if_none_match=True)
+
+  # Prefixes match whole keys like S3, and metadata and lock files aren't listed
+  assert [key for key, size in storage.list('data/')] == ['data/1.json', 'data/10.json', 'data/sub/2.json']
+  assert [key for key, size in storage.list('data')] == ['data/1.json', 'data/10.json', 'data/sub/2.json', 'database/3.json']
+  assert [key for key, size in storage.list('data/1')] == ['data/1.json', 'data/10.json']
+  assert list(storage.list('data/1.json')) == [('data/1.json', 4)]
+  assert list(storage.list('missing/')) == []
+
+def test_local_storage_rejects_escaping_keys(tmp_path):
+  storage = _local(tmp_path / 'root')
+  for key in ['../outside.json', 'a/../../outside.json', '/etc/passwd', '..']:
+    with pytest.raises(NotImplementedError):
+      storage.put(key, b'body')
+
+  assert not os.path.exists(tmp_path / 'outside.json')
+  # Keys that only look like they leave the root stay in it
+  storage.put('a/../inside.json', b'body')
+  assert bytes(storage.get('inside.json').body) == b'body'
+
+def test_get_storage(tmp_path, monkeypatch):
+  from bert.etl import storage
+  monkeypatch.setattr(storage, 'STORAGES', {})
+  s3_storage = storage.get_storage('s3://bucket/some/prefix/')
+  assert isinstance(s3_storage, storage.S3Storage)
+  assert (s3_storage._bucket_name, s3_storage._prefix, s3_storage.url) == ('bucket', 'some/prefix', 's3://bucket/some/prefix')
+  assert s3_storage._key('a.json') == 'some/prefix/a.json'
+  assert storage.get_storage('s3://bucket/some/prefix/') is s3_storage
+
+  # A bare name is a bucket, as DATASET_BUCKET was
+  bucket_storage = storage.get_storage('bucket')
+  assert isinstance(bucket_storage, storage.S3Storage)
+  assert (bucket_storage._bucket_name, bucket_storage.url, bucket_storage._key('a.json')) == ('bucket', 's3://bucket', 'a.json')
+
+  local_storage = storage.get_storage(f'file://{tmp_path}')
+  assert isinstance(local_storage, storage.LocalStorage)
+  assert local_storage.url == f'file://{tmp_path}'
+  with pytest.raises(NotImplementedError):
+    storage.get_storage('gs://bucket')
+
+  # DATASET_URL wins over DATASET_BUCKET
+  monkeypatch.setenv('DATASET_BUCKET', 'bucket')
+  monkeypatch.delenv('DATASET_URL', raising=False)
+  assert storage.get_storage() is storage.get_storage('s3://bucket')
+  monkeypatch.setenv('DATASET_URL', f'file://{tmp_path}')
+  assert storage.get_storage() is local_storage
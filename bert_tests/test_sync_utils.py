@@ -0,0 +1,90 @@
+import gzip
+import io
+import json
+
+import pytest
+
+ROWS = [[1, 2], {'a': [1, 2]}, 'text', 5, 2.5, True, None, []]
+
+def test_codec_round_trip(tmp_path):
+  from bert.etl import sync_utils
+  for codec in ['none', 'gzip']:
+    # Written in small chunks, so the compressor sees more than one
+    body = b''.join(sync_utils.compress_chunks([sync_utils.encode_record(row) for row in ROWS], codec))
+    assert sync_utils.sniff_codec(body) == codec
+    assert list(sync_utils.iter_records(body)) == ROWS
+    assert list(sync_utils.iter_records(io.BytesIO(body))) == ROWS
+    assert sync_utils.dump_records(ROWS, codec) == body
+
+  assert gzip.decompress(sync_utils.dump_records(ROWS, 'gzip')) == sync_utils.dump_records(ROWS, 'none')
+  assert list(sync_utils.iter_records(b'')) == []
+  with pytest.raises(NotImplementedError):
+    sync_utils.resolve_codec('lz4')
+
+def test_zstd_codec():
+  from bert.etl import sync_utils
+  try:
+    import zstandard
+  except ImportError:
+    # Without zstandard, zstd falls back to gzip
+    assert sync_utils.resolve_codec('zstd') == 'gzip'
+    return None
+
+  assert sync_utils.resolve_codec('zstd') == 'zstd'
+  body = sync_utils.dump_records(ROWS, 'zstd')
+  assert sync_utils.sniff_codec(body) == 'zstd'
+  assert list(sync_utils.iter_records(body)) == ROWS
+
+def test_zstd_codec_fallback(monkeypatch):
+  import sys
+  from bert.etl import sync_utils
+  monkeypatch.setitem(sys.modules, 'zstandard', None)
+  assert sync_utils.resolve_codec('zstd') == 'gzip'
+  monkeypatch.setattr(sync_utils, 'BERT_ETL_CODEC', 'zstd')
+  assert sync_utils.resolve_codec() == 'gzip'
+  assert sync_utils.resolve_codec('NONE') == 'none'
+
+def test_upload_download_dataset(tmp_path):
+  from bert.etl import sync_utils
+  from bert.etl.storage import get_storage
+  storage_url = f'file://{tmp_path}'
+  for codec in ['none', 'gzip']:
+    sync_utils.upload_dataset(ROWS, f'{codec}/rows.json', storage_url, codec=codec)
+    sync_utils.upload_dataset({'rows': ROWS}, f'{codec}/document.json', storage_url, codec=codec)
+    assert get_storage(storage_url).get(f'{codec}/rows.json').metadata == {'bert-codec': codec, 'bert-format': 'ndjson'}
+    assert get_storage(storage_url).get(f'{codec}/document.json').metadata == {'bert-codec': codec, 'bert-format': 'json'}
+    assert sync_utils.download_dataset(f'{codec}/rows.json', storage_url, list) == ROWS
+    assert sync_utils.download_dataset(f'{codec}/document.json', storage_url, dict) == {'rows': ROWS}
+
+    # The datastructure has to be the one expected
+    with pytest.raises(NotImplementedError):
+      sync_utils.download_dataset(f'{codec}/rows.json', storage_url, dict)
+
+    with pytest.raises(NotImplementedError):
+      sync_utils.download_dataset(f'{codec}/document.json', storage_url, list)
+
+  with pytest.raises(NotImplementedError):
+    sync_utils.download_dataset('none/rows.json', storage_url, set)
+
+  # A list of one list is still a list of rows
+  sync_utils.upload_dataset([[1, 2]], 'single.json', storage_url)
+  assert sync_utils.download_dataset('single.json', storage_url, list) == [[1, 2]]
+
+def test_download_legacy_dataset(tmp_path):
+  from bert.etl import sync_utils
+  from bert.etl.storage import get_storage
+  storage_url = f'file://{tmp_path}'
+  storage = get_storage(storage_url)
+
+  # Objects written by older releases are one uncompressed JSON document, without bert metadata
+  storage.put('legacy/rows.json', json.dumps(ROWS).encode('utf-8'))
+  storage.put('legacy/document.json', json.dumps({'rows': ROWS}).encode('utf-8'))
+  storage.put('legacy/compressed.json', gzip.compress(json.dumps(ROWS).encode('utf-8')))
+  assert sync_utils.download_dataset('legacy/rows.json', storage_url, list) == ROWS
+  assert sync_utils.download_dataset('legacy/document.json', storage_url, dict) == {'rows': ROWS}
+  assert sync_utils.download_dataset('legacy/compressed.json', storage_url, list) == ROWS
+  assert list(sync_utils.read_part('legacy/rows.json', storage_url)) == ROWS
+
+  # Parts without metadata are newline-delimited JSON when their key says so
+  storage.put('legacy/0.ndjson', sync_utils.dump_records(ROWS))
+  assert list(sync_utils.read_part('legacy/0.ndjson', storage_url)) == ROWS
@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+
+from bert.etl import factory
+
+if __name__ in ['__main__']:
+    factory.run_from_cli()
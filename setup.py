@@ -16,7 +16,7 @@ import bert
 # https://github.com/django/django/blob/master/setup.py#L7
 
 CURRENT_PYTHON = sys.version_info[:2]
-REQUIRED_PYTHON = (3, 6)
+REQUIRED_PYTHON = (3, 8)
 
 if CURRENT_PYTHON < REQUIRED_PYTHON:
     sys.stderr.write("""
@@ -60,7 +60,9 @@ setup(
     install_requires=[
         'redis==3.3.5',
         'marshmallow==2.19.5',
-        'boto3==1.9.251',
+        # S3 conditional writes, IfNoneMatch and IfMatch on put_object, arrived in 1.35.69
+        'boto3>=1.35.69',
+        'botocore>=1.35.69',
         'pyyaml==5.1.2',
         'GitPython==3.1.1',
     ],
@@ -72,6 +74,7 @@ setup(
             'bert-secrets.py = bert.secrets.factory:run_from_cli',
             'bert-roles.py = bert.roles.factory:run_from_cli',
             'bert-debug.py = bert.debug.factory:run_from_cli',
+            'bert-etl.py = bert.etl.factory:run_from_cli',
         ]
     },
     zip_safe=False,
@@ -79,8 +82,6 @@ setup(
     'Operating System :: OS Independent',
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.6',
-    'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3.8',
     'Programming Language :: Python :: 3.9',
     'Programming Language :: Python :: 3 :: Only',